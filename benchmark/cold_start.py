@@ -0,0 +1,114 @@
+"""
+Measure the import time and cold start time of the packaged Lambda functions.
+
+Each zip artifact under the build directory is extracted and its handler module is
+imported in a fresh Python process, the way a new Lambda execution environment would.
+Cold start time is the import plus building the first boto3 client the handler uses.
+No AWS call is made.
+
+Usage:
+    python3 benchmark/cold_start.py [build_dir] [runs]
+"""
+import glob
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+# Zip artifact name -> (handler module, first client the handler builds)
+ARTIFACTS = {
+    'ec2.zip': ('ec2_function', 'ec2'),
+    'rds.zip': ('rds_function', 'rds'),
+    's3.zip': ('s3_function', 's3'),
+    'dynamodb_cw.zip': ('dynamodb_cloudwatch_function', 'stepfunctions'),
+    'dynamodb_sfn.zip': ('dynamodb_sfn_function', 'dynamodb'),
+    'redshift.zip': ('redshift_function', 'stepfunctions'),
+    'redshift_sfn.zip': ('redshift_sfn_function', 'redshift'),
+    'batch.zip': ('batch_function', 'ec2'),
+    'router.zip': ('router_function', 'ec2'),
+    'sweeper.zip': ('sweeper_function', 'dynamodb'),
+}
+
+PROBE = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from boto3wrapper import Boto3Wrapper
+Boto3Wrapper.get_client('{service}')
+ready = time.perf_counter()
+import boto3
+print(imported - start, ready - start, 'vendored' if boto3.__file__.startswith('{path}') else 'runtime')
+"""
+
+
+def probe(path, module, service):
+    """
+    Import a handler module and build its first client in a new interpreter.
+
+    :param path: The directory the artifact is extracted to.
+    :param module: The handler module.
+    :param service: The service of the first client.
+    :return: The (import seconds, cold start seconds, boto3 origin) tuple.
+    """
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1',
+               AWS_ACCESS_KEY_ID='cold-start', AWS_SECRET_ACCESS_KEY='cold-start')
+    env.pop('PYTHONPATH', None)
+    output = subprocess.run([sys.executable, '-c', PROBE.format(module=module, service=service,
+                                                                path=path)],
+                            cwd=path, env=env, check=True, capture_output=True, text=True)
+    import_time, cold_start, origin = output.stdout.split()
+    return float(import_time), float(cold_start), origin
+
+
+def measure(artifact, runs):
+    """
+    Measure one zip artifact.
+
+    :param artifact: The zip file path.
+    :param runs: The number of fresh processes to measure.
+    :return: The report row, a dict.
+    """
+    module, service = ARTIFACTS[os.path.basename(artifact)]
+    with tempfile.TemporaryDirectory() as path:
+        with zipfile.ZipFile(artifact) as archive:
+            archive.extractall(path)
+        samples = [probe(path, module, service) for _ in range(runs)]
+
+    return {
+        'artifact': os.path.basename(artifact),
+        'size_kb': os.path.getsize(artifact) / 1024,
+        'import_ms': statistics.median(sample[0] for sample in samples) * 1000,
+        'cold_start_ms': statistics.median(sample[1] for sample in samples) * 1000,
+        'boto3': samples[0][2],
+    }
+
+
+def main(argv):
+    """
+    Report import and cold start time for every known artifact in the build directory.
+    :param argv: Optional build directory and number of runs.
+    :return: The process exit code.
+    """
+    build_dir = argv[0] if argv else 'build'
+    runs = int(argv[1]) if len(argv) > 1 else 5
+
+    artifacts = sorted(artifact for artifact in glob.glob(os.path.join(build_dir, '*', '*.zip'))
+                       if os.path.basename(artifact) in ARTIFACTS)
+    if not artifacts:
+        print(f'No Lambda artifacts in {build_dir}, run make build or make build-slim first')
+        return 1
+
+    print(f"{'artifact':<18} {'size KB':>10} {'import ms':>10} {'cold start ms':>14} "
+          f"{'boto3':>9}")
+    for artifact in artifacts:
+        row = measure(artifact, runs)
+        print(f"{row['artifact']:<18} {row['size_kb']:>10.0f} {row['import_ms']:>10.1f} "
+              f"{row['cold_start_ms']:>14.1f} {row['boto3']:>9}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
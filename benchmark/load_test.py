@@ -0,0 +1,143 @@
+"""
+Load test the Lambda handlers against the fault-injecting local AWS stand-in
+(lambda/fake_aws.py), to see how throughput and latency hold up when AWS answers slowly,
+throttles, or reports resources that are still being created.
+
+The mixed replay scenario (see replay.py) is run through the handlers by --concurrency
+threads, the way concurrent Lambda executions share an account's API limits. Every
+Boto3Wrapper client is pointed at the stand-in with AUTOTAG_ENDPOINT_URL, so botocore
+retries, rate limits and tagging retries run as they would against AWS. The fault profile
+is built from the options, see fake_aws.py for finer profiles.
+
+The report has invocations per second of wall time, handler latency percentiles, and the
+API calls answered by the stand-in per operation and outcome.
+
+Usage:
+    python3 benchmark/load_test.py [--events N] [--concurrency N] [--latency-median-ms MS]
+                                   [--latency-p99-ms MS] [--throttle-rate RATE]
+                                   [--not-ready-seconds SECONDS] [--seed N] [--json]
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from replay import ENVIRONMENT, mixed_events, percentile
+
+# pylint: disable=import-error,wrong-import-position
+from boto3wrapper import Boto3Wrapper, ENDPOINT_URL_ENV
+from fake_aws import FakeAWS
+from idempotency import set_store
+
+
+def fault_profile(args):
+    """
+    :param args: The parsed command line arguments.
+    :return: The fault profile of the stand-in.
+    """
+    latency = args.latency_median_ms
+    if latency and args.latency_p99_ms:
+        latency = {'median': args.latency_median_ms, 'p99': args.latency_p99_ms}
+    return {'default': {'latency_ms': latency, 'throttle_rate': args.throttle_rate,
+                        'not_ready_seconds': args.not_ready_seconds}}
+
+
+def invoke(handler, event):
+    """
+    :param handler: The Lambda handler.
+    :param event: The event, copied before the call.
+    :return: The (latency seconds, failed) tuple.
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        handler(copy.deepcopy(event), None)
+    except Exception:  # pylint: disable=broad-except
+        failed = True
+    return time.perf_counter() - start, failed
+
+
+def load_test(invocations, fake, concurrency):
+    """
+    Invoke the handlers against the stand-in.
+    :param invocations: The (handler, event) pairs.
+    :param fake: The running stand-in.
+    :param concurrency: The number of concurrent invocations.
+    :return: The report row, a dict.
+    """
+    os.environ[ENDPOINT_URL_ENV] = fake.endpoint_url
+    Boto3Wrapper.get_session()
+    set_store(None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda invocation: invoke(*invocation), invocations))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    calls = {}
+    for (operation, outcome), count in sorted(fake.calls.items()):
+        calls.setdefault(operation, {})[outcome] = count
+    return {
+        'invocations': len(results),
+        'failed': sum(1 for _, failed in results if failed),
+        'concurrency': concurrency,
+        'invocations_per_sec': len(results) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_in_flight': fake.max_in_flight,
+        'calls': calls,
+    }
+
+
+def main(argv):
+    """
+    Run the load test and print the report.
+    :param argv: The command line arguments.
+    :return: The process exit code.
+    """
+    parser = argparse.ArgumentParser(description='Load test the handlers against a local '
+                                                 'fault-injecting AWS stand-in')
+    parser.add_argument('--events', type=int, default=500, help='events to invoke')
+    parser.add_argument('--concurrency', type=int, default=20,
+                        help='concurrent invocations')
+    parser.add_argument('--latency-median-ms', type=float, default=20.0,
+                        help='median API latency, 0 for none')
+    parser.add_argument('--latency-p99-ms', type=float, default=200.0,
+                        help='99th percentile API latency, 0 for a fixed latency')
+    parser.add_argument('--throttle-rate', type=float, default=0.05,
+                        help='share of API requests throttled')
+    parser.add_argument('--not-ready-seconds', type=float, default=0.0,
+                        help='seconds a new table or cluster cannot be tagged')
+    parser.add_argument('--seed', type=int, default=7, help='random seed of the faults')
+    parser.add_argument('--json', action='store_true', help='print a JSON line')
+    args = parser.parse_args(argv)
+
+    os.environ.update(ENVIRONMENT)
+    logging.disable(logging.WARNING)
+
+    with FakeAWS(fault_profile(args), seed=args.seed) as fake:
+        row = load_test(mixed_events(args.events), fake, args.concurrency)
+
+    if args.json:
+        print(json.dumps(row))
+        return 0
+    print(f"{'invocations':>11} {'failed':>7} {'concurrency':>11} {'inv/s':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'in flight':>9}")
+    print(f"{row['invocations']:>11} {row['failed']:>7} {row['concurrency']:>11} "
+          f"{row['invocations_per_sec']:>9.1f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f} "
+          f"{row['max_in_flight']:>9}")
+    print()
+    print(f"{'operation':<28} {'ok':>7} {'throttled':>9} {'not ready':>9} {'error':>7}")
+    for operation, outcomes in row['calls'].items():
+        print(f"{operation:<28} {outcomes.get('ok', 0):>7} {outcomes.get('throttled', 0):>9} "
+              f"{outcomes.get('not ready', 0):>9} {outcomes.get('error', 0):>7}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,349 @@
+"""
+Replay synthetic CloudTrail event streams through the Lambda handlers against recorded
+placebo responses, to catch throughput regressions such as repeated tagging calls.
+
+Event streams are built from the test_event_data templates:
+    o ec2_run_instances_N - RunInstances events launching N instances each
+    o s3_put_object_burst  - PutObject events, a few writes per key, one handler call each
+    o s3_put_object_batch  - the same burst through the SQS batch handler, 100 per batch
+    o mixed                - every supported template, through its handler
+
+Responses are played back from a directory assembled from local-aws-response, with a
+DescribeInstances response generated for the RunInstances scenarios. Latency includes
+placebo reading its response files, so compare runs of this harness with each other only.
+
+Usage:
+    python3 benchmark/replay.py [--scenario NAME] [--events N] [--json]
+"""
+import argparse
+import copy
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+
+# pylint: disable=import-error,wrong-import-position
+import placebo
+from boto3wrapper import Boto3Wrapper
+from batch_function import sqs_batch_handler
+from dynamodb_cloudwatch_function import dynamodb_cloudwatch_handler
+from dynamodb_sfn_function import dynamodb_sfn_handler
+from ec2_function import ec2_lambda_handler
+from idempotency import set_store
+from rds_function import rds_lambda_handler
+from redshift_function import redshift_lambda_handler
+from redshift_sfn_function import redshift_sfn_lambda_handler
+from s3_function import s3_lambda_handler
+
+EVENT_DATA = os.path.join(ROOT, 'test_event_data')
+RESPONSES = os.path.join(ROOT, 'local-aws-response')
+
+# Recorded responses replayed by every scenario, (directory, file)
+RECORDED = [
+    ('create_volume', 'ec2.CreateTags_1.json'),
+    ('create_DBInstance', 'rds.AddTagsToResource_1.json'),
+    ('create_S3Bucket', 's3.GetBucketTagging_1.json'),
+    ('create_S3Bucket', 's3.PutBucketTagging_1.json'),
+    ('put_S3Object', 's3.GetObjectTagging_1.json'),
+    ('put_S3Object', 's3.PutObjectTagging_1.json'),
+    ('create_DynamoDBTable', 'states.StartExecution_1.json'),
+    ('create_DynamoDBTable_SFN', 'dynamodb.TagResource_1.json'),
+    ('create_DynamoDBCluster_SFN', 'dax.TagResource_1.json'),
+    ('create_RedshiftCluster_SFN', 'redshift.CreateTags_1.json'),
+]
+
+# Handlers by eventSource
+HANDLERS = {
+    'ec2.amazonaws.com': ec2_lambda_handler,
+    'rds.amazonaws.com': rds_lambda_handler,
+    's3.amazonaws.com': s3_lambda_handler,
+    'dynamodb.amazonaws.com': dynamodb_cloudwatch_handler,
+    'dax.amazonaws.com': dynamodb_cloudwatch_handler,
+    'redshift.amazonaws.com': redshift_lambda_handler,
+}
+
+ENVIRONMENT = {
+    'SFN_ARN': 'arn:aws:states:us-east-1:292909299215:stateMachine:AutoTag-Replay',
+    'SFN_MAX_ATTEMPTS': '20',
+    'SFN_MAX_RETRIES': '20',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'replay',
+    'AWS_SECRET_ACCESS_KEY': 'replay',
+}
+
+BATCH_SIZE = 100
+
+
+def load_template(name):
+    """
+    :param name: The test_event_data file name.
+    :return: The event detail template.
+    """
+    with open(os.path.join(EVENT_DATA, name), encoding='utf-8') as template:
+        return json.load(template)
+
+
+def cloudwatch_event(detail):
+    """
+    :param detail: The CloudTrail event detail.
+    :return: The EventBridge event, with a unique event ID.
+    """
+    detail = dict(detail, eventID=str(uuid.uuid4()))
+    return {'account': '292909299215', 'region': 'us-east-1', 'detail': detail}
+
+
+def run_instances_events(instances, count):
+    """
+    Build RunInstances events from the StartInstances template. Every event launches its
+    own instances, see describe_instances_response, so the idempotency store does not
+    skip them.
+    :param instances: The number of instances launched by each event.
+    :param count: The number of events.
+    :return: The (handler, event) pairs.
+    """
+    template = load_template('ec2_StartInstances.json')
+    template['eventName'] = 'RunInstances'
+    invocations = []
+    for event in range(count):
+        detail = copy.deepcopy(template)
+        detail['responseElements']['instancesSet']['items'] = [
+            {'instanceId': f'i-{index:017x}'}
+            for index in range(event * instances, (event + 1) * instances)]
+        invocations.append((ec2_lambda_handler, cloudwatch_event(detail)))
+    return invocations
+
+
+def put_object_details(count, keys=10):
+    """
+    Build a burst of PutObject event details, spread over a few keys.
+    :param count: The number of events.
+    :param keys: The number of distinct object keys.
+    :return: The event details.
+    """
+    template = load_template('s3_PutObject.json')
+    details = []
+    for index in range(count):
+        detail = copy.deepcopy(template)
+        detail['requestParameters']['key'] = f'uploads/object-{index % keys}.bin'
+        details.append(detail)
+    return details
+
+
+def put_object_events(count):
+    """
+    :param count: The number of events.
+    :return: The (handler, event) pairs, one s3_lambda_handler call per event.
+    """
+    return [(s3_lambda_handler, cloudwatch_event(detail))
+            for detail in put_object_details(count)]
+
+
+def put_object_batches(count):
+    """
+    :param count: The number of events.
+    :return: The (handler, SQS event) pairs, BATCH_SIZE events per sqs_batch_handler call.
+    """
+    records = [{'messageId': str(index), 'body': json.dumps(cloudwatch_event(detail))}
+               for index, detail in enumerate(put_object_details(count))]
+    return [(sqs_batch_handler, {'Records': records[start:start + BATCH_SIZE]})
+            for start in range(0, len(records), BATCH_SIZE)]
+
+
+def mixed_events(count):
+    """
+    Build events from every event template, round robin.
+    :param count: The number of events.
+    :return: The (handler, event) pairs.
+    """
+    templates = []
+    for path in sorted(glob.glob(os.path.join(EVENT_DATA, '*.json'))):
+        detail = load_template(os.path.basename(path))
+        if 'eventSource' in detail:
+            templates.append((HANDLERS[detail['eventSource']], detail))
+        elif 'EventName' not in detail:
+            # Not an event template, e.g. the creator_tags.json lookup file of enrichment.py
+            continue
+        elif 'MaxRetries' in detail:
+            templates.append((redshift_sfn_lambda_handler,
+                              dict(detail, Retries=0, MaxRetries=10)))
+        else:
+            templates.append((dynamodb_sfn_handler, dict(detail, Attempts=0, MaxAttempts=10)))
+
+    events = []
+    for index in range(count):
+        handler, detail = templates[index % len(templates)]
+        events.append((handler, cloudwatch_event(detail) if handler in HANDLERS.values()
+                       else dict(detail)))
+    return events
+
+
+def describe_instances_response(instances, event=0):
+    """
+    Generate a DescribeInstances response for the RunInstances scenarios, each instance
+    with its root volume and network interface.
+    :param instances: The number of instances.
+    :param event: The index of the event launching the instances, see run_instances_events.
+    :return: The placebo response.
+    """
+    with open(os.path.join(RESPONSES, 'start_instances', 'ec2.DescribeInstances_1.json'),
+              encoding='utf-8') as recorded:
+        response = json.load(recorded)
+    template = response['data']['Reservations'][0]['Instances'][0]
+    generated = []
+    for index in range(event * instances, (event + 1) * instances):
+        instance = copy.deepcopy(template)
+        instance['InstanceId'] = f'i-{index:017x}'
+        instance['BlockDeviceMappings'][0]['Ebs']['VolumeId'] = f'vol-{index:017x}'
+        instance['NetworkInterfaces'][0]['NetworkInterfaceId'] = f'eni-{index:017x}'
+        generated.append(instance)
+    response['data']['Reservations'] = [dict(response['data']['Reservations'][0],
+                                             Instances=generated)]
+    response['data'].pop('NextToken', None)
+    return response
+
+
+def scenarios(events):
+    """
+    :param events: The number of events per scenario.
+    :return: The scenarios, keyed by name, as (event builder, DescribeInstances size,
+    number of DescribeInstances responses).
+    """
+    built = {}
+    count = max(events // 10, 1)
+    for instances in (1, 10, 100, 500):
+        built[f'ec2_run_instances_{instances}'] = (
+            lambda instances=instances: run_instances_events(instances, count),
+            instances, count)
+    built['s3_put_object_burst'] = (lambda: put_object_events(events), 0, 0)
+    built['s3_put_object_batch'] = (lambda: put_object_batches(events), 0, 0)
+    built['mixed'] = (lambda: mixed_events(events), 1, 1)
+    return built
+
+
+def prepare_responses(path, instances, count):
+    """
+    Assemble the placebo response directory of a scenario.
+    :param path: The directory.
+    :param instances: The number of instances of the generated DescribeInstances responses.
+    :param count: The number of DescribeInstances responses, one per RunInstances event.
+    """
+    for directory, name in RECORDED:
+        shutil.copy(os.path.join(RESPONSES, directory, name), path)
+    for event in range(count):
+        with open(os.path.join(path, f'ec2.DescribeInstances_{event + 1}.json'), 'w',
+                  encoding='utf-8') as generated:
+            json.dump(describe_instances_response(instances, event), generated)
+
+
+def replay(invocations, path, trace_memory):
+    """
+    Invoke the handlers once per event against the placebo responses.
+    :param invocations: The (handler, event) pairs.
+    :param path: The placebo response directory.
+    :param trace_memory: If true measure the peak memory with tracemalloc, which slows
+    the handlers down, so latency is measured in a separate pass. Each pass starts with an
+    empty idempotency store.
+    :return: The handler latencies in seconds, the number of API calls and the peak memory
+    in bytes.
+    """
+    set_store(None)
+    session = Boto3Wrapper.get_session()
+    placebo.attach(session, data_path=path).playback()
+    calls = []
+    session.events.register('after-call', lambda **kwargs: calls.append(1))
+
+    latencies = []
+    if trace_memory:
+        tracemalloc.start()
+    for handler, event in invocations:
+        start = time.perf_counter()
+        handler(copy.deepcopy(event), None)
+        latencies.append(time.perf_counter() - start)
+    peak = 0
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return latencies, len(calls), peak
+
+
+def percentile(values, fraction):
+    """
+    :param values: The samples.
+    :param fraction: The percentile, between 0 and 1.
+    :return: The nearest rank percentile.
+    """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def measure(name, builder, instances, count):
+    """
+    Replay one scenario.
+    :param name: The scenario name.
+    :param builder: Callable building the (handler, event) pairs.
+    :param instances: The DescribeInstances size of the scenario.
+    :param count: The number of DescribeInstances responses of the scenario.
+    :return: The report row, a dict.
+    """
+    invocations = builder()
+    events = sum(len(event['Records']) if 'Records' in event else 1
+                 for _, event in invocations)
+    with tempfile.TemporaryDirectory() as path:
+        prepare_responses(path, instances, count)
+        latencies, api_calls, _ = replay(invocations, path, trace_memory=False)
+        _, _, peak = replay(invocations, path, trace_memory=True)
+
+    return {
+        'scenario': name,
+        'events': events,
+        'invocations': len(invocations),
+        'invocations_per_sec': len(invocations) / sum(latencies),
+        'api_calls_per_event': api_calls / events,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_kb': peak / 1024,
+    }
+
+
+def main(argv):
+    """
+    Replay the scenarios and print the report.
+    :param argv: The command line arguments.
+    :return: The process exit code.
+    """
+    parser = argparse.ArgumentParser(description='Replay synthetic CloudTrail events')
+    parser.add_argument('--scenario', help='run only this scenario')
+    parser.add_argument('--events', type=int, default=200, help='events per scenario')
+    parser.add_argument('--json', action='store_true', help='print JSON lines')
+    args = parser.parse_args(argv)
+
+    os.environ.update(ENVIRONMENT)
+    logging.disable(logging.INFO)
+
+    built = scenarios(args.events)
+    names = [args.scenario] if args.scenario else list(built)
+    if not args.json:
+        print(f"{'scenario':<24} {'events':>7} {'inv/s':>9} {'calls/event':>12} "
+              f"{'p50 ms':>8} {'p99 ms':>8} {'peak KB':>9}")
+    for name in names:
+        row = measure(name, *built[name])
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{row['scenario']:<24} {row['events']:>7} {row['invocations_per_sec']:>9.1f} "
+                  f"{row['api_calls_per_event']:>12.2f} {row['p50_ms']:>8.2f} "
+                  f"{row['p99_ms']:>8.2f} {row['peak_kb']:>9.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,182 @@
+"""
+Compare the cold start rate and latency of one Lambda per service with the single router
+Lambda (router_function.py), under a mixed-service event stream.
+
+The mixed replay scenario (see replay.py) is spread over a simulated timeline with
+exponential inter-arrival times. A function's execution environment stays warm for
+--keep-warm seconds after an invocation; an invocation after that starts cold. Latency
+is the handler latency measured against placebo responses, plus, for cold invocations,
+the init time measured in fresh Python processes:
+    o per service - import of the handler module and its first client
+    o router      - the same for the first event of a container, and for the first event
+                    of each other service in a warm container only the lazy import of its
+                    module and its client, as boto3 is already loaded
+
+Usage:
+    python3 benchmark/router_bench.py [--events N] [--rate PER_MINUTE] [--keep-warm SECONDS]
+                                      [--runs N] [--seed N] [--json]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from replay import ROOT, ENVIRONMENT, mixed_events, prepare_responses, replay, percentile
+
+LAMBDA_DIR = os.path.join(ROOT, 'lambda')
+
+# First client built by each handler module
+CLIENTS = {
+    'ec2_function': 'ec2',
+    'rds_function': 'rds',
+    's3_function': 's3',
+    'dynamodb_cloudwatch_function': 'stepfunctions',
+    'dynamodb_sfn_function': 'dynamodb',
+    'redshift_function': 'stepfunctions',
+    'redshift_sfn_function': 'redshift',
+}
+
+PROBE = """
+import time
+{warmup}
+start = time.perf_counter()
+import {module}
+from boto3wrapper import Boto3Wrapper
+Boto3Wrapper.get_client('{service}')
+print(time.perf_counter() - start)
+"""
+
+# Loads the SDK before the probed module, as an earlier event of a router container did
+WARMUP = """
+import router_function
+from boto3wrapper import Boto3Wrapper
+Boto3Wrapper.get_client('sts')
+"""
+
+
+def probe(module, warm, runs):
+    """
+    Measure the init time of a handler module in fresh interpreters.
+
+    :param module: The handler module.
+    :param warm: If true load the router and boto3 first, and time only the module and
+    its client.
+    :param runs: The number of fresh processes.
+    :return: The median init time in seconds.
+    """
+    env = dict(os.environ, **ENVIRONMENT)
+    env.pop('PYTHONPATH', None)
+    code = PROBE.format(warmup=WARMUP if warm else '', module=module, service=CLIENTS[module])
+    samples = [float(subprocess.run([sys.executable, '-c', code], cwd=LAMBDA_DIR, env=env,
+                                    check=True, capture_output=True, text=True).stdout)
+               for _ in range(runs)]
+    return statistics.median(samples)
+
+
+def simulate(invocations, init, lazy, keep_warm, router):
+    """
+    Replay the timeline against one deployment.
+
+    :param invocations: The (arrival second, module, handler seconds) triples, in order.
+    :param init: The cold init seconds, keyed by module.
+    :param lazy: The lazy import seconds in a warm router container, keyed by module.
+    :param keep_warm: The seconds an idle execution environment stays warm.
+    :param router: If true all modules share one function.
+    :return: The number of cold starts and the latencies in seconds.
+    """
+    last_used = {}
+    loaded = set()
+    cold_starts = 0
+    latencies = []
+    for arrival, module, seconds in invocations:
+        function = 'router' if router else module
+        if arrival - last_used.get(function, float('-inf')) > keep_warm:
+            cold_starts += 1
+            loaded = {module} if router else loaded
+            seconds += init[module]
+        elif router and module not in loaded:
+            loaded.add(module)
+            seconds += lazy[module]
+        last_used[function] = arrival
+        latencies.append(seconds)
+    return cold_starts, latencies
+
+
+def timeline(events, rate, seed):
+    """
+    Measure the handler latency of the mixed scenario and spread it over a timeline.
+
+    :param events: The number of events.
+    :param rate: The mean number of events per minute, all services together.
+    :param seed: The random seed of the arrival times.
+    :return: The (arrival second, module, handler seconds) triples.
+    """
+    pairs = mixed_events(events)
+    random.Random(seed).shuffle(pairs)
+    with tempfile.TemporaryDirectory() as path:
+        prepare_responses(path, 1, 1)
+        latencies, _, _ = replay(pairs, path, trace_memory=False)
+
+    arrivals = random.Random(seed)
+    arrival = 0.0
+    invocations = []
+    for (handler, _), seconds in zip(pairs, latencies):
+        arrival += arrivals.expovariate(rate / 60.0)
+        invocations.append((arrival, handler.__module__, seconds))
+    return invocations
+
+
+def main(argv):
+    """
+    Run both deployments over the same timeline and print the report.
+    :param argv: The command line arguments.
+    :return: The process exit code.
+    """
+    parser = argparse.ArgumentParser(description='Compare per-service Lambdas with the router')
+    parser.add_argument('--events', type=int, default=1000, help='events in the timeline')
+    parser.add_argument('--rate', type=float, default=2.0, help='events per minute')
+    parser.add_argument('--keep-warm', type=float, default=600.0,
+                        help='seconds an idle execution environment stays warm')
+    parser.add_argument('--runs', type=int, default=3, help='fresh processes per init probe')
+    parser.add_argument('--seed', type=int, default=7, help='random seed of the timeline')
+    parser.add_argument('--json', action='store_true', help='print JSON lines')
+    args = parser.parse_args(argv)
+
+    os.environ.update(ENVIRONMENT)
+    logging.disable(logging.INFO)
+
+    invocations = timeline(args.events, args.rate, args.seed)
+    modules = sorted({module for _, module, _ in invocations})
+    init = {module: probe(module, False, args.runs) for module in modules}
+    lazy = {module: probe(module, True, args.runs) for module in modules}
+
+    if not args.json:
+        print(f"{'deployment':<12} {'functions':>9} {'events':>7} {'cold starts':>11} "
+              f"{'cold %':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, router in (('per-service', False), ('router', True)):
+        cold_starts, latencies = simulate(invocations, init, lazy, args.keep_warm, router)
+        row = {
+            'deployment': name,
+            'functions': 1 if router else len(modules),
+            'events': len(latencies),
+            'cold_starts': cold_starts,
+            'cold_pct': 100.0 * cold_starts / len(latencies),
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(f"{row['deployment']:<12} {row['functions']:>9} {row['events']:>7} "
+                  f"{row['cold_starts']:>11} {row['cold_pct']:>7.1f} {row['p50_ms']:>8.2f} "
+                  f"{row['p99_ms']:>8.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,176 @@
+"""
+Concurrent tagging with asyncio, for batch and backfill workloads that spend most of their
+time waiting on tagging calls. Tag requests are split into chunks as in
+registry.tag_resources and all chunks, across resources, services and regions, run
+concurrently with at most max_in_flight calls waiting at a time.
+
+aiobotocore is optional, it is imported on first use and is not part of the Lambda
+packages. The Lambda handlers keep tagging with boto3, see registry.tag_resources.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+from botocore.exceptions import ClientError
+from boto3wrapper import DEFAULT_REGION, ENDPOINT_URL_ENV
+from registry import TAGGING_APIS, TAG_MAX_ATTEMPTS, retry_delay
+from registry import NO_TAGS_ERROR_CODES, merge_tags, plan_tag_chunks, read_request, tag_request
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AIO_MAX_IN_FLIGHT = int(os.environ.get('AIO_MAX_IN_FLIGHT', '16'))
+
+
+def aiobotocore_available():
+    """
+    :return: True when aiobotocore can be imported.
+    """
+    try:
+        import aiobotocore.session  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+    return True
+
+
+class AsyncBoto3Wrapper:
+    """
+    The asyncio counterpart of Boto3Wrapper: aiobotocore clients cached per service and
+    region for the life of an `async with AsyncBoto3Wrapper() as wrapper` block, with the
+    current credentials.
+    """
+
+    def __init__(self, endpoint_url=None):
+        """
+        :param endpoint_url: Sent every call to this URL instead of the AWS endpoints,
+        e.g. a local stand-in, defaults to AUTOTAG_ENDPOINT_URL.
+        """
+        self.endpoint_url = endpoint_url or os.environ.get(ENDPOINT_URL_ENV)
+        self._clients = {}
+        self._lock = None
+        self._session = None
+        self._stack = None
+
+    async def __aenter__(self):
+        # pylint: disable=import-outside-toplevel,import-error
+        from aiobotocore.session import get_session
+
+        self._session = get_session()
+        self._lock = asyncio.Lock()
+        self._stack = contextlib.AsyncExitStack()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._clients.clear()
+        await self._stack.aclose()
+
+    async def get_client(self, aws_resource, region_name=None):
+        """
+        :param aws_resource: The service name, e.g. 'ec2'.
+        :param region_name: The region, DEFAULT_REGION when None.
+        :return: The cached aiobotocore client.
+        """
+        key = (aws_resource, region_name or DEFAULT_REGION)
+        async with self._lock:
+            if key not in self._clients:
+                self._clients[key] = await self._stack.enter_async_context(
+                    self._session.create_client(aws_resource, region_name=key[1],
+                                                endpoint_url=self.endpoint_url))
+        return self._clients[key]
+
+
+async def _read_tags(client, tagging, resource_id):
+    """
+    The asyncio counterpart of registry.read_tags.
+
+    :param client: The aiobotocore client of the tagging API service.
+    :param tagging: The TAGGING_APIS entry name.
+    :param resource_id: The resource.
+    :return: The tags, empty when the resource has none.
+    """
+    api, kwargs = read_request(tagging, resource_id)
+    try:
+        response = await getattr(client, api)(**kwargs)
+    except ClientError as error:
+        if error.response.get('Error', {}).get('Code') in NO_TAGS_ERROR_CODES:
+            return []
+        raise
+    return response['TagSet']
+
+
+async def _tag_chunk(wrapper, semaphore, request, chunk):
+    """
+    Tag one chunk, retried on its own until it is tagged or TAG_MAX_ATTEMPTS is used up,
+    after the wait of registry.retry_delay, as in registry.apply_tag_chunks. Fatal errors
+    are not retried. The wait does not hold the semaphore.
+
+    :param wrapper: The AsyncBoto3Wrapper.
+    :param semaphore: The semaphore bounding the calls in flight.
+    :param request: The tag request, see tag_requests_async.
+    :param chunk: The resource IDs of the chunk.
+    :return: The chunk outcome, see registry.apply_tag_chunks.
+    """
+    tagging = request['Tagging']
+    client = await wrapper.get_client(TAGGING_APIS[tagging]['service'], request.get('Region'))
+    outcome = {'Resources': chunk, 'Status': 'pending', 'Attempts': 0}
+
+    while True:
+        outcome['Attempts'] = outcome['Attempts'] + 1
+        try:
+            async with semaphore:
+                tags = request['Tags']
+                if 'read_api' in TAGGING_APIS[tagging]:
+                    tags = merge_tags(await _read_tags(client, tagging, chunk[0]), tags)
+                api, kwargs = tag_request(tagging, chunk, tags)
+                await getattr(client, api)(**kwargs)
+            outcome['Status'] = 'tagged'
+            outcome.pop('Error', None)
+            return outcome
+        except ClientError as error:
+            logger.warning('tagging attempt %d failed for %d resources: %s',
+                           outcome['Attempts'], len(outcome['Resources']), error)
+            outcome['Status'] = 'failed'
+            outcome['Error'] = str(error)
+            delay = retry_delay(error, outcome['Attempts'], TAG_MAX_ATTEMPTS)
+            if delay is None:
+                return outcome
+        await asyncio.sleep(delay)
+
+
+async def tag_requests_async(requests, max_in_flight=AIO_MAX_IN_FLIGHT, endpoint_url=None):
+    """
+    Tag resources of several services and regions concurrently.
+
+    :param requests: The tag requests, dicts with Tagging (the TAGGING_APIS entry name),
+    Resources (the resource IDs, duplicates are ignored), Tags and optionally Region.
+    :param max_in_flight: The maximum number of tagging calls waiting at a time.
+    :param endpoint_url: Sent every call to this URL, see AsyncBoto3Wrapper.
+    :return: The per-chunk outcomes of each request, in request order, see
+    registry.apply_tag_chunks.
+    """
+    semaphore = asyncio.Semaphore(max_in_flight)
+    async with AsyncBoto3Wrapper(endpoint_url) as wrapper:
+        plans = [plan_tag_chunks(request['Resources'],
+                                 TAGGING_APIS[request['Tagging']].get('max_ids', 1))
+                 for request in requests]
+        outcomes = await asyncio.gather(*[
+            _tag_chunk(wrapper, semaphore, request, chunk)
+            for request, chunks in zip(requests, plans) for chunk in chunks])
+
+    results = []
+    for chunks in plans:
+        results.append(outcomes[:len(chunks)])
+        outcomes = outcomes[len(chunks):]
+    return results
+
+
+def tag_requests(requests, max_in_flight=AIO_MAX_IN_FLIGHT, endpoint_url=None):
+    """
+    Run tag_requests_async to completion from synchronous code.
+
+    :param requests: The tag requests, see tag_requests_async.
+    :param max_in_flight: The maximum number of tagging calls waiting at a time.
+    :param endpoint_url: Sent every call to this URL, see AsyncBoto3Wrapper.
+    :return: The per-chunk outcomes of each request.
+    """
+    return asyncio.run(tag_requests_async(requests, max_in_flight, endpoint_url))
@@ -0,0 +1,401 @@
+"""
+Backfill the Creator tag of resources created before the stacks were deployed, from the
+CloudTrail log files delivered to the trail bucket, e.g. after
+`aws s3 sync s3://<trail bucket>/AWSLogs ./logs`.
+
+RunInstances events also tag the volumes and network interfaces still attached to their
+instances, as ec2_function does. Resources deleted since their event, e.g. terminated
+instances, are counted as missing and do not fail the window.
+
+Resources are tagged in the account and region of their event. Logs of other accounts,
+e.g. of an organization trail, need --role-name, a role deployed in every account that the
+backfill assumes.
+
+With --engine async (or BACKFILL_ENGINE=async) resources of the current account are tagged
+by async_tagging.py, up to --workers tagging calls in flight across all groups. It needs
+aiobotocore.
+
+Usage:
+    python3 backfill.py LOG_DIR [--checkpoint FILE] [--workers N] [--window N]
+                        [--role-name NAME] [--engine threads|async] [--placebo DIR] [--dry-run]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from async_tagging import aiobotocore_available, tag_requests
+from boto3wrapper import Boto3Wrapper
+from fanout import role_arns
+from registry import lookup_event, extract_resource_ids, TAGGING_APIS, TAG_MAX_ATTEMPTS
+from registry import is_creation_event
+from registry import apply_tag_chunks, plan_tag_chunks, tag_request, merge_tags, read_tags
+from utils import is_err_detail, get_creator, creator_tags
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+LOG_FILE_SUFFIX = '.json.gz'
+
+ENGINE_ENV = 'BACKFILL_ENGINE'
+
+# Log files grouped and tagged together, then checkpointed, the default of --window
+WINDOW_FILES = 100
+
+# Tagging options of backfill:
+#   workers   - the maximum number of concurrent tagging groups
+#   window    - the number of log files per window
+#   role_name - the role assumed in the account of each event, see tag_groups
+#   engine    - 'threads', or 'async' to tag with async_tagging, see tag_groups
+DEFAULT_OPTIONS = {'workers': 4, 'window': WINDOW_FILES, 'role_name': None,
+                   'engine': os.environ.get(ENGINE_ENV, 'threads')}
+
+# Events that carry no responseElements, see s3_lambda_handler
+NO_RESP_ELEMS_SOURCES = ('s3.amazonaws.com',)
+
+# Instances named per DescribeInstances call, the limit of values of a filter
+DESCRIBE_MAX_INSTANCES = 200
+
+# Error codes of tagging resources deleted since their event, besides the *NotFound codes
+MISSING_ERROR_CODES = frozenset(['NoSuchBucket', 'NoSuchKey'])
+
+# Resource IDs in an error message, e.g. "The volume 'vol-0123' does not exist."
+_MESSAGE_IDS = re.compile(r"[a-z]+-[0-9a-f]{8,17}\b")
+
+
+def iter_log_files(log_dir):
+    """
+    List the CloudTrail log files under a directory, in a stable order.
+
+    :param log_dir: The directory the trail bucket is copied to.
+    :return: A generator of log file paths.
+    """
+    for root, dirs, files in os.walk(log_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(LOG_FILE_SUFFIX):
+                yield os.path.join(root, name)
+
+
+def iter_records(paths):
+    """
+    Read the records of CloudTrail log files, one file in memory at a time.
+
+    :param paths: The log file paths.
+    :return: A generator of CloudTrail records, the detail portion of CloudTrail events.
+    """
+    for path in paths:
+        with gzip.open(path, 'rt', encoding='utf-8') as log_file:
+            records = json.load(log_file).get('Records', [])
+        yield from records
+
+
+def iter_creation_events(records):
+    """
+    Keep the successful creation events handled by the Lambda functions.
+
+    :param records: The CloudTrail records.
+    :return: A generator of (event spec, creator, record) triples.
+    """
+    for record in records:
+        if not is_creation_event(record):
+            continue
+        spec = lookup_event(record)
+        if is_err_detail(logger, record,
+                         expect_resp_elems=record['eventSource'] not in NO_RESP_ELEMS_SOURCES):
+            continue
+        yield spec, get_creator({'detail': record}), record
+
+
+def group_events(events):
+    """
+    Group the resource IDs of creation events per account, region, tagging API and creator.
+
+    :param events: The (event spec, creator, record) triples.
+    :return: The resource ID lists, keyed by (account, region, TAGGING_APIS entry name,
+    creator).
+    """
+    groups = {}
+    for spec, creator, record in events:
+        try:
+            ids = extract_resource_ids(record, spec)
+        except (KeyError, TypeError) as error:
+            logger.warning('Skipping %s %s: %s', record['eventName'], record.get('eventID'),
+                           error)
+            continue
+        account = record.get('recipientAccountId') or record['userIdentity'].get('accountId')
+        key = (account, record.get('awsRegion'), spec['tagging'], creator)
+        groups.setdefault(key, []).extend(ids)
+    return groups
+
+
+def attachment_ids(ec2, instance_ids):
+    """
+    Find the volumes and network interfaces attached to instances. Instances are matched
+    with an instance-id filter rather than InstanceIds, so instances terminated since their
+    event are left out instead of failing the call.
+
+    :param ec2: The EC2 client.
+    :param instance_ids: The instance IDs.
+    :return: The volume and network interface IDs.
+    """
+    ids = []
+    paginator = ec2.get_paginator('describe_instances')
+    for chunk in plan_tag_chunks(instance_ids, DESCRIBE_MAX_INSTANCES):
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': chunk}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    ids.extend(mapping['Ebs']['VolumeId']
+                               for mapping in instance.get('BlockDeviceMappings', [])
+                               if 'Ebs' in mapping)
+                    ids.extend(eni['NetworkInterfaceId']
+                               for eni in instance.get('NetworkInterfaces', []))
+    return ids
+
+
+def is_missing(error):
+    """
+    :param error: The ClientError of a tagging call.
+    :return: True when the error names resources that no longer exist.
+    """
+    code = error.response.get('Error', {}).get('Code', '')
+    return code in MISSING_ERROR_CODES or code.endswith(('NotFound', 'NotFoundFault',
+                                                         'NotFoundException'))
+
+
+def tag_existing(client, tagging, ids, tags):
+    """
+    Tag the resources of a group that still exist, one call per chunk as in
+    registry.tag_resources. A chunk failing because some of its resources were deleted is
+    tagged again without them: the IDs named by the error message are dropped, or the
+    chunk is split in halves when the message names none, down to single resources.
+
+    :param client: The client of the tagging API service.
+    :param tagging: The TAGGING_APIS entry name.
+    :param ids: The resource IDs.
+    :param tags: The tags.
+    :return: The per-call outcomes, see registry.apply_tag_chunks, each with the Missing
+    resources of its chunk.
+    """
+    missing = set()
+
+    def tag(chunk):
+        chunk = [resource_id for resource_id in chunk if resource_id not in missing]
+        if not chunk:
+            return
+        chunk_tags = tags
+        if 'read_api' in TAGGING_APIS[tagging]:
+            chunk_tags = merge_tags(read_tags(client, tagging, chunk[0]), tags)
+        api, kwargs = tag_request(tagging, chunk, chunk_tags)
+        try:
+            getattr(client, api)(**kwargs)
+        except ClientError as error:
+            if not is_missing(error):
+                raise
+            named = set(_MESSAGE_IDS.findall(str(error))).intersection(chunk)
+            if named or len(chunk) == 1:
+                missing.update(named or chunk)
+                tag(chunk)
+            else:
+                tag(chunk[:len(chunk) // 2])
+                tag(chunk[len(chunk) // 2:])
+
+    chunks = plan_tag_chunks(ids, TAGGING_APIS[tagging].get('max_ids', 1))
+    outcomes = apply_tag_chunks(logger, tag, chunks, TAG_MAX_ATTEMPTS)
+    for outcome in outcomes:
+        outcome['Missing'] = [resource_id for resource_id in outcome['Resources']
+                              if resource_id in missing]
+    return outcomes
+
+
+def tag_groups(groups, workers, role_name=None, engine='threads'):
+    """
+    Tag each group with the tagging API of its service, on a bounded thread pool, or
+    concurrently with async_tagging when engine is 'async' and no role is
+    assumed. The instances of EC2 groups are tagged with their attachments. Chunks the
+    async engine fails to tag are tagged again on the thread pool, which leaves out
+    resources deleted since their event, see tag_existing.
+
+    :param groups: The resource ID lists, see group_events.
+    :param workers: The maximum number of concurrent tagging groups, or tagging calls in
+    flight with the async engine.
+    :param role_name: The role assumed in the account of each group, None to tag with the
+    current credentials.
+    :param engine: 'threads', or 'async' to tag with async_tagging.
+    :return: The per-call outcomes of all groups, see tag_existing.
+    """
+    clients = {}
+    for account, region, tagging, _ in groups:
+        role_arn = role_arns([account], role_name)[0] if role_name else None
+        clients[(account, region, tagging)] = Boto3Wrapper.get_client(
+            TAGGING_APIS[tagging]['service'], role_arn, region)
+
+    for (account, region, tagging, _), ids in groups.items():
+        instance_ids = [resource_id for resource_id in ids if resource_id.startswith('i-')]
+        if tagging == 'ec2' and instance_ids:
+            ids.extend(attachment_ids(clients[(account, region, tagging)], instance_ids))
+
+    outcomes = []
+    if role_name is None and engine == 'async':
+        outcomes, groups = _tag_groups_async(groups, workers)
+
+    def tag_group(item):
+        (account, region, tagging, creator), ids = item
+        return tag_existing(clients[(account, region, tagging)], tagging, ids,
+                            creator_tags(creator))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return outcomes + [outcome for results in pool.map(tag_group, groups.items())
+                           for outcome in results]
+
+
+def _tag_groups_async(groups, workers):
+    """
+    Tag groups with async_tagging.
+    :param groups: The resource ID lists, see group_events.
+    :param workers: The maximum number of tagging calls in flight.
+    :return: The outcomes of the tagged chunks, and the resource ID lists of the failed
+    chunks, keyed as groups.
+    """
+    requests = [{'Tagging': tagging, 'Region': region, 'Resources': ids,
+                 'Tags': creator_tags(creator)}
+                for (_, region, tagging, creator), ids in groups.items()]
+    outcomes = []
+    failed = {}
+    for key, results in zip(groups, tag_requests(requests, workers)):
+        for outcome in results:
+            if outcome['Status'] == 'tagged':
+                outcomes.append(dict(outcome, Missing=[]))
+            else:
+                failed.setdefault(key, []).extend(outcome['Resources'])
+    return outcomes, failed
+
+
+def load_checkpoint(checkpoint):
+    """
+    :param checkpoint: The checkpoint file path, None for no checkpoint.
+    :return: The set of log files already backfilled.
+    """
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, encoding='utf-8') as checkpoint_file:
+        return {line.rstrip('\n') for line in checkpoint_file if line.strip()}
+
+
+def save_checkpoint(checkpoint, paths):
+    """
+    Record log files as backfilled.
+
+    :param checkpoint: The checkpoint file path, None for no checkpoint.
+    :param paths: The log files.
+    """
+    if checkpoint is None:
+        return
+    with open(checkpoint, 'a', encoding='utf-8') as checkpoint_file:
+        checkpoint_file.writelines(path + '\n' for path in paths)
+
+
+def iter_windows(paths, size):
+    """
+    :param paths: The log file paths.
+    :param size: The number of log files per window.
+    :return: A generator of log file path lists.
+    """
+    window = []
+    for path in paths:
+        window.append(path)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def backfill(log_dir, checkpoint=None, options=None, dry_run=False):
+    """
+    Backfill the Creator tag from a directory of CloudTrail log files. Log files are
+    processed in windows: the resources of a window are grouped, tagged, and the window is
+    added to the checkpoint when every resource was tagged, so a re-run resumes after the
+    last complete window. Tagging is idempotent, re-tagging a resource is harmless.
+
+    :param log_dir: The directory the trail bucket is copied to.
+    :param checkpoint: The checkpoint file path, None for no checkpoint.
+    :param options: The tagging options updating DEFAULT_OPTIONS, a dict.
+    :param dry_run: If true log the groups without tagging.
+    :return: The summary counts, a dict.
+    """
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    done = load_checkpoint(checkpoint)
+    summary = {'files': 0, 'groups': 0, 'tagged': 0, 'missing': 0, 'failed': 0}
+    paths = (path for path in iter_log_files(log_dir) if path not in done)
+
+    for paths_window in iter_windows(paths, options['window']):
+        groups = group_events(iter_creation_events(iter_records(paths_window)))
+        summary['files'] += len(paths_window)
+        summary['groups'] += len(groups)
+        if dry_run:
+            for (account, region, tagging, creator), ids in groups.items():
+                logger.info('%s %s %s Creator [ %s ]: %d resources',
+                            account, region, tagging, creator, len(ids))
+            continue
+
+        if _count_outcomes(summary, tag_groups(groups, options['workers'],
+                                               options['role_name'], options['engine'])):
+            save_checkpoint(checkpoint, paths_window)
+
+    logger.info('backfill: %s', summary)
+    return summary
+
+
+def _count_outcomes(summary, outcomes):
+    """
+    Add the tagged, missing and failed resources of a window to the summary.
+    :param summary: The summary counts, see backfill.
+    :param outcomes: The per-call outcomes of the window, see tag_existing.
+    :return: True if every resource of the window was tagged or is missing.
+    """
+    for outcome in outcomes:
+        status = 'tagged' if outcome['Status'] == 'tagged' else 'failed'
+        summary[status] += len(outcome['Resources']) - len(outcome['Missing'])
+        summary['missing'] += len(outcome['Missing'])
+    return all(outcome['Status'] == 'tagged' for outcome in outcomes)
+
+
+def main(argv):
+    """
+    Parse the command line and run the backfill.
+    :param argv: The command line arguments.
+    :return: The process exit code, 1 when resources failed to be tagged.
+    """
+    parser = argparse.ArgumentParser(description='Backfill the Creator tag from CloudTrail logs')
+    parser.add_argument('log_dir', help='directory of CloudTrail .json.gz log files')
+    parser.add_argument('--checkpoint', help='file recording the backfilled log files')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent tagging groups')
+    parser.add_argument('--window', type=int, default=WINDOW_FILES, help='log files per window')
+    parser.add_argument('--role-name', help='role assumed in the account of each event')
+    parser.add_argument('--engine', choices=('threads', 'async'),
+                        default=DEFAULT_OPTIONS['engine'],
+                        help='tag on a thread pool, or with asyncio and aiobotocore')
+    parser.add_argument('--placebo', help='play back recorded AWS responses from this directory')
+    parser.add_argument('--dry-run', action='store_true', help='log the groups, do not tag')
+    args = parser.parse_args(argv)
+    if args.engine == 'async' and (args.role_name or not aiobotocore_available()):
+        parser.error('--engine async needs aiobotocore and does not support --role-name')
+
+    logging.basicConfig()
+    if args.placebo:
+        import placebo  # pylint: disable=import-outside-toplevel
+        placebo.attach(Boto3Wrapper.get_session(), data_path=args.placebo).playback()
+
+    options = {'workers': args.workers, 'window': args.window, 'role_name': args.role_name,
+               'engine': args.engine}
+    summary = backfill(args.log_dir, args.checkpoint, options, args.dry_run)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,195 @@
+"""SQS batch tagging Lambda"""
+import json
+import logging
+import time
+from boto3wrapper import Boto3Wrapper
+from ec2_function import load_resource_ids, tag_resources, tagged_ids
+from idempotency import is_cached_event, check_event, mark_processed
+from metrics import instrumented, timer
+from rds_function import rds_lambda_handler
+from registry import lookup_event
+from s3_function import s3_lambda_handler, throughput_mode, coalesce_object_events
+from s3_function import object_key, tag_objects
+from utils import is_err_detail, get_creator
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+EC2_EVENT_SOURCE = 'ec2.amazonaws.com'
+
+# Services tagged one resource per event, by the existing per-event handler
+RECORD_HANDLERS = {
+    'rds.amazonaws.com': rds_lambda_handler,
+    's3.amazonaws.com': s3_lambda_handler,
+}
+
+# Events that carry no responseElements, see s3_lambda_handler
+NO_RESP_ELEMS_SOURCES = ('s3.amazonaws.com',)
+
+# Events tagged by s3_function.tag_objects in throughput mode
+S3_OBJECT_EVENT = ('s3.amazonaws.com', 'PutObject')
+
+
+@instrumented
+def sqs_batch_handler(event, context):
+    """
+    Tag the resources of a batch of CloudTrail events delivered through SQS. Each record
+    body is an EventBridge event, as received by the single event handlers. Tag operations
+    are coalesced before any call is made:
+        o EC2 - the resource IDs of all events with the same creator are tagged together
+        o RDS, S3 - events with the same creator, event name and request parameters are
+          tagged once
+        o S3 objects, in throughput mode - events for the same object are coalesced into
+          one read-modify-write of its tag set, see s3_function.tag_objects
+
+    Error events, unsupported events and unreadable records are logged and dropped,
+    redelivering them would not change the outcome. A handler raising fails only the
+    records of its group.
+
+    :param event: The SQS event, a batch of records.
+    :param context: This object provides methods and properties that provide information
+    about the invocation, function, and execution environment.
+    See https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
+
+    :return: The partial batch response, listing the records that failed to be tagged so
+    only those are redelivered.
+    """
+    start = time.time()
+    failed = set()
+    with timer('ParseMs'):
+        ec2_groups, s3_objects, record_groups = _group_records(event['Records'])
+
+    tag_requests = 0
+    for creator, records in ec2_groups.items():
+        tag_requests += 1
+        failed.update(_tag_ec2_group(creator, records))
+
+    if s3_objects:
+        tag_requests += 1
+        failed.update(_tag_s3_objects(s3_objects))
+
+    for key, records in record_groups.items():
+        tag_requests += 1
+        handler = RECORD_HANDLERS[key[0]]
+        try:
+            tagged = handler(records[0][1], context)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Tagging records %s failed',
+                             [message_id for message_id, _ in records])
+            tagged = False
+        if not tagged:
+            failed.update(message_id for message_id, _ in records)
+
+    elapsed = time.time() - start
+    logger.info('%d records, %d coalesced tag requests, %d failed records in %.3f sec',
+                len(event['Records']), tag_requests, len(failed), elapsed)
+
+    return {
+        'batchItemFailures': [{'itemIdentifier': record['messageId']}
+                              for record in event['Records']
+                              if record['messageId'] in failed]
+    }
+
+
+def _group_records(records):
+    """
+    Parse the SQS records and group them into coalesced tag operations.
+
+    :param records: The SQS records.
+    :return: The EC2 groups, keyed by creator, the throughput mode S3 object records and the
+    per-event handler groups, keyed by (event source, creator, event name, request
+    parameters). Group members are (message ID, event detail) pairs for EC2, (message ID,
+    creator, event detail) triples for S3 objects and (message ID, event) pairs otherwise.
+    """
+    ec2_groups = {}
+    s3_objects = []
+    record_groups = {}
+    object_throughput = throughput_mode()
+
+    for record in records:
+        message_id = record['messageId']
+        try:
+            cw_event = json.loads(record['body'])
+            detail = cw_event['detail']
+            source = detail['eventSource']
+        except (ValueError, KeyError) as error:
+            logger.error('Dropping unreadable record %s: %s', message_id, error)
+            continue
+
+        if is_err_detail(logger, detail,
+                         expect_resp_elems=source not in NO_RESP_ELEMS_SOURCES):
+            continue
+
+        if lookup_event(detail) is None:
+            logger.warning('Not supported event: %s %s', source, detail.get('eventName'))
+            continue
+
+        creator = get_creator(cw_event)
+        if source == EC2_EVENT_SOURCE:
+            ec2_groups.setdefault(creator, []).append((message_id, detail))
+        elif object_throughput and (source, detail['eventName']) == S3_OBJECT_EVENT:
+            s3_objects.append((message_id, creator, detail))
+        elif source in RECORD_HANDLERS:
+            key = (source, creator, detail['eventName'],
+                   json.dumps(detail.get('requestParameters'), sort_keys=True))
+            record_groups.setdefault(key, []).append((message_id, cw_event))
+        else:
+            logger.warning('Not supported event source: %s', source)
+
+    return ec2_groups, s3_objects, record_groups
+
+
+def _tag_ec2_group(creator, records):
+    """
+    Tag the resources of several EC2 events from the same creator with a single plan.
+    Duplicate events and resources already tagged with the creator are skipped. Tagged
+    resources and processed events are recorded with a single store update.
+
+    :param creator: The Creator tag value shared by the events.
+    :param records: The (message ID, event detail) pairs.
+    :return: The message IDs whose resources were not all tagged.
+    """
+    failed = []
+    ids_by_message = {}
+    ec2 = Boto3Wrapper.get_client('ec2')
+
+    for message_id, detail in records:
+        if is_cached_event(detail):
+            continue
+        try:
+            duplicate, ids = check_event(detail, load_resource_ids(detail, ec2, creator), creator)
+        except (ec2.exceptions.ClientError, KeyError) as error:
+            logger.error(error)
+            failed.append(message_id)
+            continue
+        if not duplicate:
+            ids_by_message[message_id] = ids
+
+    ids = [resource_id for message_ids in ids_by_message.values() for resource_id in message_ids]
+    outcomes = tag_resources(ec2, ids, creator) if ids else []
+    failed_ids = {resource_id for outcome in outcomes if outcome['Status'] != 'tagged'
+                  for resource_id in outcome['Resources']}
+
+    processed = []
+    for message_id, detail in records:
+        if message_id not in ids_by_message:
+            continue
+        if failed_ids.intersection(ids_by_message[message_id]):
+            failed.append(message_id)
+        else:
+            processed.append(detail)
+    mark_processed(processed, tagged_ids(outcomes), creator)
+    return failed
+
+
+def _tag_s3_objects(records):
+    """
+    Tag the objects of several PutObject events in throughput mode, once per object.
+
+    :param records: The (message ID, creator, event detail) triples, oldest first.
+    :return: The message IDs whose object was not tagged.
+    """
+    objects = coalesce_object_events((creator, detail) for _, creator, detail in records)
+    outcomes = tag_objects(Boto3Wrapper.get_client('s3'), objects)
+    return [message_id for message_id, _, detail in records
+            if outcomes[object_key(detail)] == 'failed']
@@ -1,5 +1,58 @@
 """ AWS SDK client, session, resource wrapper """
-import boto3
+import os
+import threading
+import metrics
+import ratelimit
+
+# Comma separated list of services whose clients are built at import time,
+# e.g. "ec2" or "dynamodb,dax". Unset by default.
+PREWARM_ENV = 'BOTO3_PREWARM_CLIENTS'
+
+# Endpoint URL of all clients, e.g. the local stand-in of fake_aws.py for load tests.
+# Unset by default.
+ENDPOINT_URL_ENV = 'AUTOTAG_ENDPOINT_URL'
+
+DEFAULT_REGION = 'us-east-1'
+ROLE_SESSION_NAME = 'AutoTag'
+
+
+def _boto3():
+    """
+    Import boto3 on first use, so handlers that exit before tagging never load the SDK.
+    :return: The boto3 module.
+    """
+    import boto3  # pylint: disable=import-outside-toplevel
+    return boto3
+
+
+def _assumed_role_session(sts, role_arn, region_name):
+    """
+    Build a session whose credentials are assumed from a role. Credentials are fetched on
+    first use and refreshed by botocore before they expire.
+
+    :param sts: The STS client making the AssumeRole calls.
+    :param role_arn: The role to assume.
+    :param region_name: The session region.
+    :return: The boto3 Session.
+    """
+    # pylint: disable=import-outside-toplevel
+    from botocore.credentials import DeferredRefreshableCredentials
+    from botocore.session import get_session
+
+    def refresh():
+        credentials = sts.assume_role(RoleArn=role_arn,
+                                      RoleSessionName=ROLE_SESSION_NAME)['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+
+    botocore_session = get_session()
+    botocore_session._credentials = DeferredRefreshableCredentials(  # pylint: disable=protected-access
+        refresh, 'sts-assume-role')
+    return _boto3().Session(botocore_session=botocore_session, region_name=region_name)
 
 
 class Boto3Wrapper:
@@ -7,37 +60,115 @@ class Boto3Wrapper:
 
     SESSION_CREATION_HOOK = None
 
+    # Clients and resources are reused across warm Lambda invocations. Keys are
+    # (kind, service, region, session), where session is None for the default session.
+    _CACHE = {}
+    _CACHE_LOCK = threading.Lock()
+
+    # Sessions of other accounts and regions, keyed by (role ARN, region), where role ARN
+    # is None for the credentials of the Lambda itself.
+    _SESSIONS = {}
+
     @classmethod
-    def get_session(cls):
-        """Create or re-create an AWS session."""
+    def get_session(cls, region_name=DEFAULT_REGION):
+        """
+        Create or re-create an AWS session. Clients and pooled sessions built on the old
+        session are dropped.
 
-        session = boto3.Session(region_name='us-east-1')
+        :param region_name: The session region.
+        """
+        session = _boto3().Session(region_name=region_name)
         cls.SESSION_CREATION_HOOK = session
+        cls.clear_cache()
         return session
 
+    @classmethod
+    def clear_cache(cls):
+        """Drop all cached clients, resources and pooled sessions."""
+        with cls._CACHE_LOCK:
+            cls._CACHE.clear()
+            cls._SESSIONS.clear()
+
+    @classmethod
+    def get_pooled_session(cls, role_arn=None, region_name=DEFAULT_REGION):
+        """
+        Get the session of an account and region from the pool, creating it on first use.
+        Sessions of a role assume it with the Lambda credentials, through STS.
+
+        :param role_arn: The role to assume in the target account, None for the
+        credentials of the Lambda itself.
+        :param region_name: The session region.
+        :return: The boto3 Session.
+        """
+        hook = cls.SESSION_CREATION_HOOK
+        if role_arn is None and hook is not None and hook.region_name == region_name:
+            return hook
+
+        key = (role_arn, region_name)
+        with cls._CACHE_LOCK:
+            session = cls._SESSIONS.get(key)
+        if session is not None:
+            return session
+
+        if role_arn is None:
+            session = _boto3().Session(region_name=region_name)
+        else:
+            session = _assumed_role_session(cls.get_client('sts'), role_arn, region_name)
+        with cls._CACHE_LOCK:
+            return cls._SESSIONS.setdefault(key, session)
+
+    @classmethod
+    def _get_cached(cls, kind, aws_resource, session=None):
+        session = session or cls.SESSION_CREATION_HOOK
+        region = session.region_name if session is not None else None
+        key = (kind, aws_resource, region, session)
+
+        with cls._CACHE_LOCK:
+            if key not in cls._CACHE:
+                factory = session if session is not None else _boto3()
+                options = {}
+                if os.environ.get(ENDPOINT_URL_ENV):
+                    options['endpoint_url'] = os.environ[ENDPOINT_URL_ENV]
+                with metrics.timer('ClientBuildMs'):
+                    built = getattr(factory, kind)(aws_resource, **options)
+                client = built if kind == 'client' else built.meta.client
+                metrics.attach_client_hooks(client)
+                ratelimit.attach_client_hooks(client)
+                cls._CACHE[key] = built
+            return cls._CACHE[key]
+
     @classmethod
     def get_resource(cls, aws_resource):
         """
         Get the AWS resource from the session, or create from
         the default session it if there is no session.
         """
-        if cls.SESSION_CREATION_HOOK is None:
-            resource = boto3.resource(aws_resource)
-        else:
-            session = cls.SESSION_CREATION_HOOK
-            resource = session.resource(aws_resource)
-        return resource
+        return cls._get_cached('resource', aws_resource)
 
     @classmethod
-    def get_client(cls, aws_resource):
+    def get_client(cls, aws_resource, role_arn=None, region_name=None):
         """
         Get the client from the session, or create a low-level
-        service client from the default session.
+        service client from the default session. With a role or a region, the client is
+        built on the pooled session of that account and region, see get_pooled_session.
         """
-        if cls.SESSION_CREATION_HOOK is None:
-            resource = boto3.client(aws_resource)
-        else:
-            session = cls.SESSION_CREATION_HOOK
-            resource = session.client(aws_resource)
+        if role_arn is None and region_name is None:
+            return cls._get_cached('client', aws_resource)
+        session = cls.get_pooled_session(role_arn, region_name or DEFAULT_REGION)
+        return cls._get_cached('client', aws_resource, session)
+
+    @classmethod
+    def prewarm(cls, aws_resources):
+        """
+        Build and cache clients ahead of the first invocation, so the cost of loading
+        service models is paid during Lambda initialization.
+
+        :param aws_resources: The service names to build clients for.
+        """
+        for aws_resource in aws_resources:
+            cls.get_client(aws_resource)
+
 
-        return resource
+if os.environ.get(PREWARM_ENV):
+    Boto3Wrapper.prewarm([name.strip() for name in os.environ[PREWARM_ENV].split(',')
+                          if name.strip()])
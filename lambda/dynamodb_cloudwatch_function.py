@@ -3,18 +3,29 @@ import json
 import logging
 import os
 from boto3wrapper import Boto3Wrapper
-from utils import is_err_detail, get_creator
+from metrics import instrumented
+from pending import pending_mode, defer, aggregate, flush_requested
+from registry import extract_resource_ids
+from utils import preflight, tag_immediately, backoff_seconds
 
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 
+# Services whose tasks are started by the Map state machine of this handler in aggregate mode
+AGGREGATED_TAGGINGS = ('dynamodb', 'dax')
 
-def dynamodb_cloudwatch_handler(event, context):
+
+@instrumented
+def dynamodb_cloudwatch_handler(event, context, settings=None):
     """
     Lambda function that responds to DynamoDB create table and create cluster
     CloudWatch events via EventBridge triggers. The event is processed,
     summarized and becomes input to the DynamoDB Step Function state machine
-    that is started to manage the resource tagging.
+    that is started to manage the resource tagging. With TAG_IMMEDIATE set to "true",
+    a resource that is already taggable is tagged directly instead. With PENDING_MODE set to
+    "sweeper", the resource is put in the pending store for the sweeper instead, and set to
+    "aggregate", its task is buffered and started with the tasks of other resources by one
+    Map state machine execution. A {"Flush": true} event starts all buffered tasks.
 
     :param event: The incoming CloudWatch event object.
 
@@ -22,48 +33,61 @@ def dynamodb_cloudwatch_handler(event, context):
     about the invocation, function, and execution environment.
     See https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
 
-    @return: True if the state machine execution started or False if the
-    event represents an error.
+    :param settings: SFN_ARN, AGGREGATE_SFN_ARN and PENDING_MODE, defaults to the environment,
+    e.g. given per route by router_function.py.
+
+    @return: True if the resource was tagged, deferred or the state machine execution started,
+    False if the event represents an error or is not supported.
     """
     logger.debug('event: %s', event)
 
+    settings = os.environ if settings is None else settings
+    if flush_requested(event, AGGREGATED_TAGGINGS, settings):
+        return True
+
     detail = event['detail']
     event_name = detail['eventName']
-    creator = get_creator(event)
 
     logger.info('Event type: %s', event_name)
 
-    if is_err_detail(logger, detail):
+    creator, spec = preflight(logger, event)
+    if spec is None:
         return False
 
+    resource_arn = extract_resource_ids(detail, spec)[0]
+    logger.info('%s [ %s ] requires tag Creator [ %s ]',
+                detail['eventSource'], resource_arn, creator)
+
+    if tag_immediately(logger, spec, resource_arn, creator):
+        return True
+
+    if pending_mode(settings) == 'sweeper':
+        defer(event_name, creator, resource_arn, spec['tagging'])
+        logger.info('[ %s ] left to the sweeper', resource_arn)
+        return True
+
     sfn_event = {
         "EventName": event_name,
         "Creator": creator,
-        "ResourceArn": "",
+        "ResourceArn": resource_arn,
         "TagStatus": "pending",
         "MaxAttempts": int(os.environ['SFN_MAX_ATTEMPTS']),
-        "Attempts": 0
+        "Attempts": 0,
+        "WaitSeconds": backoff_seconds(0)
     }
 
-    if event_name == 'CreateTable':
-        sfn_event['ResourceArn'] = detail['responseElements']['tableDescription']['tableArn']
-        logger.info('Table [ %s ] requires tag Creator [ %s ]',
-                    sfn_event['ResourceArn'], creator)
-    elif event_name == 'CreateCluster':
-        sfn_event['ResourceArn'] = detail['responseElements']['cluster']['clusterArn']
-        logger.info('Cluster [ %s ] requires tag Creator [ %s ]',
-                    sfn_event['ResourceArn'], creator)
-    else:
-        logger.warning('Event [ %s ] is not supported', event_name)
-        return False
+    if pending_mode(settings) == 'aggregate':
+        aggregate(resource_arn, spec['tagging'], sfn_event, settings['AGGREGATE_SFN_ARN'],
+                  AGGREGATED_TAGGINGS)
+        return True
 
     sfn = Boto3Wrapper.get_client('stepfunctions')
     response = sfn.start_execution(
-        stateMachineArn=os.environ['SFN_ARN'],
+        stateMachineArn=settings['SFN_ARN'],
         name=creator+'-'+event_name+'-'+detail['eventID'],
         input=json.dumps(sfn_event)
     )
 
-    logger.info('Step Functions start execution: %s', response)
+    logger.debug('Step Functions start execution: %s', response)
 
     return True
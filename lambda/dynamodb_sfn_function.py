@@ -1,13 +1,14 @@
 """DynamoDB and DAX tagging Lambda"""
 import logging
-from botocore.exceptions import ClientError
 from boto3wrapper import Boto3Wrapper
-from utils import load_creator_tag
+from metrics import instrumented
+from utils import creator_tags, schedule_retry
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@instrumented
 def dynamodb_sfn_handler(event, context):
     """
     Lambda function that is called by the DynamoDB Step Function state machine.
@@ -19,9 +20,10 @@ def dynamodb_sfn_handler(event, context):
     about the invocation, function, and execution environment.
     See https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
 
-    @return: The event to the state machine. TagStatus and Attempts can be changed.
-    When the resource is tagged, TagStatus is set to "completed". Attempts increment
-    each time this Lambda is called.
+    @return: The event to the state machine. TagStatus, Attempts and WaitSeconds can be
+    changed. When the resource is tagged, TagStatus is set to "completed". Attempts increment
+    each time this Lambda is called. WaitSeconds is the exponential backoff, with jitter,
+    before the next attempt. Errors that retrying will not fix set TagStatus to "failed".
     """
 
     if event['MaxAttempts'] <= event['Attempts']:
@@ -29,30 +31,28 @@ def dynamodb_sfn_handler(event, context):
         return event
 
     event['Attempts'] = event['Attempts'] + 1
-    logging.info('Tag attempt for event: %s', event)
+    logger.debug('Tag attempt for event: %s', event)
 
     if event['EventName'] == 'CreateTable':
+        dynamodb = Boto3Wrapper.get_client('dynamodb')
         try:
-            dynamodb = Boto3Wrapper.get_client('dynamodb')
             dynamodb.tag_resource(
                 ResourceArn=event['ResourceArn'],
-                Tags=[load_creator_tag(event['Creator'])]
+                Tags=creator_tags(event['Creator'])
             )
-            logging.info('Table has been tagged.')
-        except ClientError as error:  # fails when resource not ready
-            logger.warning(error)
-            return event
+            logger.info('Table has been tagged.')
+        except dynamodb.exceptions.ClientError as error:  # fails when resource not ready
+            return schedule_retry(logger, event, error, event['Attempts'])
     elif event['EventName'] == 'CreateCluster':
+        dax = Boto3Wrapper.get_client('dax')
         try:
-            dax = Boto3Wrapper.get_client('dax')
             dax.tag_resource(
                 ResourceName=event['ResourceArn'],
-                Tags=[load_creator_tag(event['Creator'])]
+                Tags=creator_tags(event['Creator'])
             )
-            logging.info('Cluster has been tagged')
-        except ClientError as error:  # fails when resource not ready
-            logger.warning(error)
-            return event
+            logger.info('Cluster has been tagged')
+        except dax.exceptions.ClientError as error:  # fails when resource not ready
+            return schedule_retry(logger, event, error, event['Attempts'])
     else:
         event['TagStatus'] = 'unsupported event'
         return event
@@ -1,74 +1,131 @@
 """EC2 tagging Lambda"""
 import logging
 from boto3wrapper import Boto3Wrapper
-from utils import is_err_detail, get_creator, load_creator_tag
+from idempotency import is_cached_event, check_event, mark_processed
+from metrics import instrumented
+from registry import lookup_event, extract_resource_ids, tag_resources as tag_api_resources
+from registry import TAGGING_APIS
+from utils import preflight, creator_tags, CREATOR_TAG_NAME
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+CREATE_TAGS_MAX_RESOURCES = TAGGING_APIS['ec2']['max_ids']
 
+
+@instrumented
 def ec2_lambda_handler(event, context):
     """
-    Assign owner tag to new EC2 resources.
+    Assign owner tag to new EC2 resources. Events already processed, and resources
+    already tagged with the same creator, are skipped, see idempotency.py. The event and
+    its resources are looked up together, and recorded together once tagged, so a shared
+    store costs one read and one write per invocation.
     :param event: The incoming CloudTrail event object.
     :param context: This object provides methods and properties that provide information
     about the invocation, function, and execution environment.
-    :return: True for non-error response events.
+    :return: True for supported, non-error events where every resource was tagged.
     """
     # print('event:', event)
 
-    ids = []
+    creator, spec = preflight(logger, event)
+    if spec is None:
+        return False
+
     detail = event['detail']
-    event_name = detail['eventName']
-    creator = get_creator(event)
+    if is_cached_event(detail):
+        logger.info('Duplicate event: %s', detail['eventID'])
+        return True
 
-    ec2 = Boto3Wrapper.get_resource('ec2')
+    ec2 = Boto3Wrapper.get_client('ec2')
+    duplicate, ids = check_event(detail, load_resource_ids(detail, ec2, creator), creator)
+    if duplicate:
+        logger.info('Duplicate event: %s', detail['eventID'])
+        return True
 
-    if is_err_detail(logger, detail):
-        return False
+    outcomes = tag_resources(ec2, ids, creator) if ids else []
+    tagged = all(outcome['Status'] == 'tagged' for outcome in outcomes)
+    mark_processed([detail] if tagged else [], tagged_ids(outcomes), creator)
 
-    if event_name == 'CreateVolume':
-        ids.append(detail['responseElements']['volumeId'])
-        logger.info(ids)
-    elif event_name in ('RunInstances', 'StartInstances', 'RebootInstances'):
-        ids = _load_instance_ids(detail, ec2, event_name)
-        logger.info(ids)
+    return tagged
+
+
+def load_resource_ids(detail, ec2, creator=None):
+    """
+    Find the IDs of the EC2 resources created or started by the event.
+
+    :param detail: The detail portion of the CloudTrail object.
+    :param ec2: The EC2 client.
+    :param creator: The Creator tag value, instances already tagged with it are left out.
+    :return: The resource IDs, empty for unsupported events.
+    """
+    spec = lookup_event(detail)
+    if spec is None:
+        logger.warning('Not supported action: %s', detail['eventName'])
+        return []
+
+    ids = extract_resource_ids(detail, spec)
+    if spec.get('attachments'):
+        ids = _load_instance_ids(ids, ec2, creator)
         logger.info('number of instances: %d', len(ids))
-    elif event_name == 'CreateImage':
-        ids.append(detail['responseElements']['imageId'])
-        logger.info(ids)
-    elif event_name == 'CreateSnapshot':
-        ids.append(detail['responseElements']['snapshotId'])
-        logger.info(ids)
-    else:
-        logger.warning('Not supported action')
-
-    if ids:
-        for resource_id in ids:
-            logger.info('resource id: %s', resource_id)
-            ec2.create_tags(Resources=ids, Tags=[load_creator_tag(creator)])
-
-    return True
-
-
-def _load_instance_ids(detail, ec2, event_name):
-    ids = []
-
-    if event_name == 'RebootInstances':
-        instance_loc = 'requestParameters'
-    else:
-        instance_loc = 'responseElements'
-    items = detail[instance_loc]['instancesSet']['items']
-
-    for item in items:
-        ids.append(item['instanceId'])
-    base = ec2.instances.filter(InstanceIds=ids)
-
-    # loop through the instances
-    for instance in base:
-        for vol in instance.volumes.all():
-            ids.append(vol.id)
-        for eni in instance.network_interfaces:
-            ids.append(eni.id)
+    logger.debug('resource IDs: %s', ids)
 
     return ids
+
+
+def tag_resources(ec2, ids, creator):
+    """
+    Tag EC2 resources with the Creator tag, using one CreateTags call per chunk of
+    up to CREATE_TAGS_MAX_RESOURCES unique resource IDs. Failed chunks are retried alone.
+    The caller records the tagged resources in the idempotency store, see tagged_ids.
+
+    :param ec2: The EC2 client.
+    :param ids: The resource IDs to tag, duplicates are ignored.
+    :param creator: The Creator tag value.
+    :return: The per-chunk outcomes, see registry.apply_tag_chunks.
+    """
+    outcomes = tag_api_resources(logger, ec2, 'ec2', ids, creator_tags(creator))
+    for outcome in outcomes:
+        logger.info('%s %d resources after %d attempt(s)',
+                    outcome['Status'], len(outcome['Resources']), outcome['Attempts'])
+    return outcomes
+
+
+def tagged_ids(outcomes):
+    """
+    :param outcomes: The per-chunk outcomes of tag_resources.
+    :return: The IDs of the resources tagged.
+    """
+    return [resource_id for outcome in outcomes if outcome['Status'] == 'tagged'
+            for resource_id in outcome['Resources']]
+
+
+def _load_instance_ids(instance_ids, ec2, creator=None):
+    """
+    Add the IDs of the volumes and network interfaces attached to the instances. The
+    attachments are read from the BlockDeviceMappings and NetworkInterfaces of a single
+    paginated DescribeInstances, so the number of calls does not grow with the number
+    of instances.
+
+    :param instance_ids: The instance IDs from the event.
+    :param ec2: The EC2 client.
+    :param creator: The Creator tag value, instances already tagged with it are left out.
+    Their attachments are kept, they may have been attached since.
+    :return: The instance, volume and network interface IDs.
+    """
+    ids = list(instance_ids)
+    tagged = set()
+
+    paginator = ec2.get_paginator('describe_instances')
+    for page in paginator.paginate(InstanceIds=list(instance_ids)):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                if creator is not None and {'Key': CREATOR_TAG_NAME, 'Value': creator} in \
+                        instance.get('Tags', []):
+                    tagged.add(instance['InstanceId'])
+                for mapping in instance.get('BlockDeviceMappings', []):
+                    if 'Ebs' in mapping:
+                        ids.append(mapping['Ebs']['VolumeId'])
+                for eni in instance.get('NetworkInterfaces', []):
+                    ids.append(eni['NetworkInterfaceId'])
+
+    return [resource_id for resource_id in ids if resource_id not in tagged]
@@ -0,0 +1,100 @@
+"""
+Lookup backends of the tags derived from the creator, e.g. Team and CostCenter, added next
+to the Creator tag, see utils.creator_tags. The backend is chosen with CREATOR_TAGS_BACKEND:
+    o ""   - none, the default, only the Creator tag is added
+    o file - a local JSON or CSV file named by CREATOR_TAGS_FILE, e.g. packaged with the
+             function or used in tests. JSON maps creators to their tags,
+             {"alice": {"Team": "data", "CostCenter": "1234"}}. CSV has a Creator column
+             and one column per tag, empty cells are skipped.
+    o iam  - the tags of the IAM user named like the creator, restricted to the keys in
+             CREATOR_TAGS_KEYS (default "Team,CostCenter"). Creators that are not IAM
+             users, e.g. AWS services, get no tags.
+
+A backend has lookup(creator), returning the derived tags as a dict of key to value.
+"""
+import csv
+import json
+import logging
+import os
+from boto3wrapper import Boto3Wrapper
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CREATOR_TAGS_BACKEND = os.environ.get('CREATOR_TAGS_BACKEND', '')
+CREATOR_TAGS_FILE = os.environ.get('CREATOR_TAGS_FILE', '')
+CREATOR_TAGS_KEYS = os.environ.get('CREATOR_TAGS_KEYS', 'Team,CostCenter')
+
+CREATOR_COLUMN = 'Creator'
+
+
+class FileBackend:  # pylint: disable=too-few-public-methods
+    """
+    Derived tags read once from a JSON or CSV file, by file extension.
+    """
+
+    def __init__(self, path):
+        with open(path, newline='', encoding='utf-8') as source:
+            if path.lower().endswith('.csv'):
+                self.tags = {row.pop(CREATOR_COLUMN): {key: value for key, value in row.items()
+                                                       if value}
+                             for row in csv.DictReader(source)}
+            else:
+                self.tags = json.load(source)
+
+    def lookup(self, creator):
+        """
+        :param creator: The Creator tag value.
+        :return: The derived tags, a dict.
+        """
+        return dict(self.tags.get(creator, {}))
+
+
+class IAMUserTagsBackend:  # pylint: disable=too-few-public-methods
+    """
+    Derived tags read from the tags of the IAM user named like the creator.
+    """
+
+    def __init__(self, keys, client=None):
+        self.keys = frozenset(keys)
+        self.client = client
+
+    def lookup(self, creator):
+        """
+        :param creator: The Creator tag value.
+        :return: The derived tags, a dict, empty when the creator is not an IAM user.
+        """
+        client = self.client or Boto3Wrapper.get_client('iam')
+        try:
+            pages = client.get_paginator('list_user_tags').paginate(UserName=creator)
+            return {tag['Key']: tag['Value'] for page in pages for tag in page['Tags']
+                    if tag['Key'] in self.keys}
+        except client.exceptions.NoSuchEntityException:
+            return {}
+
+
+# The backend of the container, built on first use, see get_backend
+_BACKEND = {'backend': None}
+
+
+def get_backend():
+    """
+    :return: The lookup backend, see the module documentation, None when there is none.
+    """
+    if _BACKEND['backend'] is None:
+        if CREATOR_TAGS_BACKEND == 'file':
+            _BACKEND['backend'] = FileBackend(CREATOR_TAGS_FILE)
+        elif CREATOR_TAGS_BACKEND == 'iam':
+            _BACKEND['backend'] = IAMUserTagsBackend(
+                key.strip() for key in CREATOR_TAGS_KEYS.split(',') if key.strip())
+        elif CREATOR_TAGS_BACKEND:
+            logger.warning('Unknown CREATOR_TAGS_BACKEND: %s', CREATOR_TAGS_BACKEND)
+    return _BACKEND['backend']
+
+
+def set_backend(backend):
+    """
+    Replace the lookup backend, e.g. by a file backend in tests.
+    :param backend: An object with lookup(creator), None to rebuild the default.
+    """
+    _BACKEND['backend'] = backend
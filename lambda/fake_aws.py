@@ -0,0 +1,463 @@
+"""
+Fault-injecting local stand-in for the AWS APIs the handlers call, for load and throughput
+tests. Unlike the placebo fixtures in local-aws-response, answers take time, can be
+throttled, and deferred resources are not taggable until they finish creating. Clients
+built by Boto3Wrapper are pointed at it with AUTOTAG_ENDPOINT_URL, see benchmark/load_test.py.
+
+Supported operations:
+    o ec2      - CreateTags, DescribeInstances (each instance has one volume and one network
+                 interface, vol-<id> and eni-<id> for instance i-<id>)
+    o s3       - PutBucketTagging, GetBucketTagging, PutObjectTagging, GetObjectTagging
+    o rds      - AddTagsToResource
+    o dynamodb - TagResource, ListTables, DescribeTable
+    o dax      - TagResource, DescribeClusters
+    o redshift - CreateTags, DescribeClusters
+    o states   - StartExecution
+Tags are kept per resource, so reads return what was written.
+
+Faults are set by a profile, a dict keyed by "default", a signing name, e.g. "dynamodb", or
+"signing name.Operation", e.g. "ec2.CreateTags", the most specific key winning per setting:
+    o latency_ms        - milliseconds per answer, a number, {"median": 20, "p99": 200}
+                          for a lognormal distribution or {"distribution": "uniform",
+                          "min": 5, "max": 50}
+    o throttle_rate     - share of requests answered with the throttling error of the
+                          service, e.g. RequestLimitExceeded for EC2
+    o not_ready_seconds - seconds after a DynamoDB table, DAX cluster or Redshift cluster is
+                          first named, or registered with create, before it can be tagged
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+from registry import arn_resource_name
+
+# The 99th percentile of the standard normal distribution
+Z_99 = 2.326
+
+# Throttling errors as (HTTP status, error code), keyed by signing name
+THROTTLE_ERRORS = {
+    'ec2': (503, 'RequestLimitExceeded'),
+    'rds': (400, 'Throttling'),
+    'redshift': (400, 'Throttling'),
+    's3': (503, 'SlowDown'),
+    'dynamodb': (400, 'ThrottlingException'),
+    'dax': (400, 'ThrottlingException'),
+    'states': (400, 'ThrottlingException'),
+}
+
+# Errors of tagging a resource that is still being created, keyed by signing name
+NOT_READY_ERRORS = {
+    'dynamodb': 'ResourceNotFoundException',
+    'dax': 'ClusterNotFoundFault',
+    'redshift': 'InvalidClusterState',
+}
+
+# Query API response namespaces, keyed by signing name
+NAMESPACES = {
+    'ec2': 'http://ec2.amazonaws.com/doc/2016-11-15/',
+    'rds': 'http://rds.amazonaws.com/doc/2014-10-31/',
+    'redshift': 'http://redshift.amazonaws.com/doc/2012-12-01/',
+}
+
+S3_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+_SIGNING_NAME = re.compile(r'Credential=[^/]+/[^/]+/[^/]+/([^/]+)/')
+_QUERY_TAG_KEY = re.compile(r'^(.*\.?)(\d+)\.Key$')
+
+
+class FakeError(Exception):
+    """
+    An error answer.
+    """
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+def sample_latency(spec, rng):
+    """
+    :param spec: The latency_ms setting, see the module documentation.
+    :param rng: The random.Random drawing the sample.
+    :return: The latency in seconds.
+    """
+    if not spec:
+        return 0.0
+    if isinstance(spec, (int, float)):
+        return spec / 1000.0
+    if spec.get('distribution') == 'uniform':
+        return rng.uniform(spec['min'], spec['max']) / 1000.0
+    median = spec['median']
+    sigma = math.log(max(spec.get('p99', median), median) / median) / Z_99
+    return rng.lognormvariate(math.log(median), sigma) / 1000.0
+
+
+def _query_tags(params):
+    """
+    :param params: The query API parameters, e.g. Tag.1.Key or Tags.Tag.1.Key.
+    :return: The tags, a dict.
+    """
+    tags = {}
+    for name, value in params.items():
+        match = _QUERY_TAG_KEY.match(name)
+        if match:
+            tags[value] = params.get(f'{match.group(1)}{match.group(2)}.Value', '')
+    return tags
+
+
+def _numbered(params, prefix):
+    """
+    :param params: The query API parameters.
+    :param prefix: The list parameter name, e.g. ResourceId.
+    :return: The values of prefix.1, prefix.2 and so on.
+    """
+    values = []
+    while f'{prefix}.{len(values) + 1}' in params:
+        values.append(params[f'{prefix}.{len(values) + 1}'])
+    return values
+
+
+def _xml_tag_set(tags):
+    return ''.join(f'<Tag><Key>{escape(key)}</Key><Value>{escape(value)}</Value></Tag>'
+                   for key, value in tags.items())
+
+
+class FakeAWS:  # pylint: disable=too-many-instance-attributes
+    """
+    The stand-in, an HTTP server on a free localhost port, serving each request in a thread
+    after its latency. Answers are counted in calls, keyed by ("signing name.Operation",
+    outcome) with outcome "ok", "throttled", "not ready" or "error".
+    """
+
+    def __init__(self, profile=None, seed=None, clock=time.monotonic):
+        self.profile = profile or {}
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._created = {}
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def endpoint_url(self):
+        """
+        :return: The endpoint URL of the running server.
+        """
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        """
+        Serve requests in a background thread.
+        :return: The endpoint URL.
+        """
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.endpoint_url
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def settings(self, service, operation):
+        """
+        :param service: The signing name.
+        :param operation: The operation name.
+        :return: The profile settings of the operation, see the module documentation.
+        """
+        merged = {'latency_ms': 0, 'throttle_rate': 0.0, 'not_ready_seconds': 0}
+        for key in ('default', service, f'{service}.{operation}'):
+            merged.update(self.profile.get(key, {}))
+        return merged
+
+    def create(self, *names):
+        """
+        Start the not ready window of resources, e.g. when their creation event is sent.
+        :param names: The table, DAX cluster or Redshift cluster names.
+        """
+        now = self.clock()
+        with self._lock:
+            for name in names:
+                self._created.setdefault(name, now)
+
+    def tags(self, resource_id):
+        """
+        :param resource_id: The resource ID, ARN or "bucket/key".
+        :return: The tags written to the resource, a dict.
+        """
+        with self._lock:
+            return dict(self._tags.get(resource_id, {}))
+
+    def answer(self, service, operation, params):
+        """
+        Inject the faults of the operation and answer it.
+
+        :param service: The signing name.
+        :param operation: The operation name.
+        :param params: The request parameters.
+        :return: The answer, see the operation methods.
+        :raise FakeError: For throttled, not ready and unsupported requests.
+        """
+        settings = self.settings(service, operation)
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            latency = sample_latency(settings['latency_ms'], self.rng)
+            throttled = self.rng.random() < settings['throttle_rate']
+        time.sleep(latency)
+
+        outcome = 'ok'
+        try:
+            if throttled:
+                outcome = 'throttled'
+                status, code = THROTTLE_ERRORS.get(service, (400, 'ThrottlingException'))
+                raise FakeError(status, code, 'Rate exceeded')
+            method = getattr(self, f'_{service}_{operation}', None)
+            if method is None:
+                outcome = 'error'
+                raise FakeError(400, 'InvalidAction', f'{service}.{operation} not supported')
+            return method(params, settings)
+        except FakeError as error:
+            if error.code in NOT_READY_ERRORS.values():
+                outcome = 'not ready'
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self.calls[(f'{service}.{operation}', outcome)] += 1
+
+    def _tag(self, resource_ids, tags):
+        with self._lock:
+            for resource_id in resource_ids:
+                self._tags.setdefault(resource_id, {}).update(tags)
+
+    def _check_ready(self, service, arn, settings):
+        name = arn_resource_name(arn)
+        now = self.clock()
+        with self._lock:
+            created = self._created.setdefault(name, now)
+        if now - created < settings['not_ready_seconds']:
+            raise FakeError(400, NOT_READY_ERRORS[service], f'{name} is being created')
+
+    def _ready_names(self, settings):
+        now = self.clock()
+        with self._lock:
+            return sorted((name, now - created >= settings['not_ready_seconds'])
+                          for name, created in self._created.items())
+
+    # Operations, named _<signing name>_<Operation>, answer (status, body) for the query
+    # and REST APIs and a dict for the JSON APIs
+
+    def _ec2_CreateTags(self, params, _settings):  # pylint: disable=invalid-name
+        self._tag(_numbered(params, 'ResourceId'), _query_tags(params))
+        return 200, '<return>true</return>'
+
+    def _ec2_DescribeInstances(self, params, _settings):  # pylint: disable=invalid-name
+        items = []
+        for instance_id in _numbered(params, 'InstanceId'):
+            suffix = instance_id.split('-', 1)[-1]
+            items.append(
+                f'<item><instanceId>{instance_id}</instanceId>'
+                f'<blockDeviceMapping><item><deviceName>/dev/xvda</deviceName>'
+                f'<ebs><volumeId>vol-{suffix}</volumeId></ebs></item></blockDeviceMapping>'
+                f'<networkInterfaceSet><item><networkInterfaceId>eni-{suffix}'
+                f'</networkInterfaceId></item></networkInterfaceSet>'
+                f'<tagSet>{self._ec2_tag_set(instance_id)}</tagSet></item>')
+        return 200, (f'<reservationSet><item><reservationId>r-0</reservationId>'
+                     f'<instancesSet>{"".join(items)}</instancesSet></item></reservationSet>')
+
+    def _ec2_tag_set(self, resource_id):
+        return ''.join(f'<item><key>{escape(key)}</key><value>{escape(value)}</value></item>'
+                       for key, value in self.tags(resource_id).items())
+
+    def _rds_AddTagsToResource(self, params, _settings):  # pylint: disable=invalid-name
+        self._tag([params['ResourceName']], _query_tags(params))
+        return 200, ''
+
+    def _redshift_CreateTags(self, params, settings):  # pylint: disable=invalid-name
+        self._check_ready('redshift', params['ResourceName'], settings)
+        self._tag([params['ResourceName']], _query_tags(params))
+        return 200, ''
+
+    def _redshift_DescribeClusters(self, _params, settings):  # pylint: disable=invalid-name
+        clusters = ''.join(
+            f'<Cluster><ClusterIdentifier>{escape(name)}</ClusterIdentifier><ClusterStatus>'
+            f'{"available" if ready else "creating"}</ClusterStatus></Cluster>'
+            for name, ready in self._ready_names(settings))
+        return 200, (f'<DescribeClustersResult><Clusters>{clusters}</Clusters>'
+                     f'</DescribeClustersResult>')
+
+    def _dynamodb_TagResource(self, params, settings):  # pylint: disable=invalid-name
+        self._check_ready('dynamodb', params['ResourceArn'], settings)
+        self._tag([params['ResourceArn']], {tag['Key']: tag['Value'] for tag in params['Tags']})
+        return {}
+
+    def _dynamodb_ListTables(self, _params, settings):  # pylint: disable=invalid-name
+        return {'TableNames': [name for name, ready in self._ready_names(settings) if ready]}
+
+    def _dynamodb_DescribeTable(self, params, settings):  # pylint: disable=invalid-name
+        name = params['TableName']
+        now = self.clock()
+        with self._lock:
+            created = self._created.setdefault(name, now)
+        status = 'ACTIVE' if now - created >= settings['not_ready_seconds'] else 'CREATING'
+        return {'Table': {'TableName': name, 'TableStatus': status}}
+
+    def _dax_TagResource(self, params, settings):  # pylint: disable=invalid-name
+        self._check_ready('dax', params['ResourceName'], settings)
+        self._tag([params['ResourceName']], {tag['Key']: tag['Value'] for tag in params['Tags']})
+        return {'Tags': [{'Key': key, 'Value': value}
+                         for key, value in self.tags(params['ResourceName']).items()]}
+
+    def _dax_DescribeClusters(self, _params, settings):  # pylint: disable=invalid-name
+        return {'Clusters': [{'ClusterName': name, 'Status': 'available' if ready else 'creating'}
+                             for name, ready in self._ready_names(settings)]}
+
+    def _states_StartExecution(self, params, _settings):  # pylint: disable=invalid-name
+        name = params.get('name') or str(uuid.uuid4())
+        arn = params['stateMachineArn'].replace(':stateMachine:', ':execution:')
+        return {'executionArn': f'{arn}:{name}', 'startDate': time.time()}
+
+    def _s3_PutBucketTagging(self, params, _settings):  # pylint: disable=invalid-name
+        # Replaces the tag set, as S3 does, so callers must merge the tags they keep
+        with self._lock:
+            self._tags[params['Bucket']] = dict(params['TagSet'])
+        return 204, ''
+
+    def _s3_GetBucketTagging(self, params, _settings):  # pylint: disable=invalid-name
+        tags = self.tags(params['Bucket'])
+        if not tags:
+            raise FakeError(404, 'NoSuchTagSet', 'The TagSet does not exist')
+        return 200, f'<Tagging><TagSet>{_xml_tag_set(tags)}</TagSet></Tagging>'
+
+    def _s3_PutObjectTagging(self, params, _settings):  # pylint: disable=invalid-name
+        with self._lock:
+            self._tags[f"{params['Bucket']}/{params['Key']}"] = dict(params['TagSet'])
+        return 200, ''
+
+    def _s3_GetObjectTagging(self, params, _settings):  # pylint: disable=invalid-name
+        tags = self.tags(f"{params['Bucket']}/{params['Key']}")
+        return 200, f'<Tagging><TagSet>{_xml_tag_set(tags)}</TagSet></Tagging>'
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Decode the JSON, query and S3 REST requests of botocore, and encode the answers.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, avoid the delayed ACK of each answer
+    disable_nagle_algorithm = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a JSON or query API request."""
+        self._dispatch()
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        """Answer an S3 tagging write."""
+        self._dispatch()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer an S3 tagging read."""
+        self._dispatch()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _dispatch(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        match = _SIGNING_NAME.search(self.headers.get('Authorization', ''))
+        service = match.group(1) if match else ''
+        target = self.headers.get('X-Amz-Target')
+        if target:
+            protocol, operation = 'json', target.rsplit('.', 1)[-1]
+            params = json.loads(body or b'{}')
+        elif service == 's3':
+            protocol = 'rest'
+            operation, params = self._s3_request(body)
+        else:
+            protocol = 'query'
+            params = {name: values[0] for name, values in parse_qs(body.decode()).items()}
+            operation = params.get('Action', '')
+
+        request_id = str(uuid.uuid4())
+        try:
+            answer = self.server.fake.answer(service, operation, params)
+        except FakeError as error:
+            self._send_error(protocol, service, error, request_id)
+            return
+        if protocol == 'json':
+            self._send(200, 'application/x-amz-json-1.1', json.dumps(answer))
+        elif protocol == 'rest':
+            self._send(answer[0], 'application/xml', answer[1])
+        else:
+            namespace = NAMESPACES.get(service, '')
+            if service == 'ec2':
+                metadata = f'<requestId>{request_id}</requestId>'
+            else:
+                metadata = (f'<ResponseMetadata><RequestId>{request_id}</RequestId>'
+                            f'</ResponseMetadata>')
+            self._send(answer[0], 'text/xml',
+                       f'<{operation}Response xmlns="{namespace}">{answer[1]}{metadata}'
+                       f'</{operation}Response>')
+
+    def _s3_request(self, body):
+        url = urlsplit(self.path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        kind = 'Object' if key else 'Bucket'
+        verb = 'Put' if self.command == 'PUT' else 'Get'
+        params = {'Bucket': bucket, 'Key': key}
+        if body:
+            root = ElementTree.fromstring(body)
+            params['TagSet'] = {element.findtext(S3_NAMESPACE + 'Key'):
+                                element.findtext(S3_NAMESPACE + 'Value')
+                                for element in root.iter(S3_NAMESPACE + 'Tag')}
+        operation = f'{verb}{kind}Tagging' if url.query == 'tagging' else f'{verb}{kind}'
+        return operation, params
+
+    def _send_error(self, protocol, service, error, request_id):
+        message = escape(str(error))
+        if protocol == 'json':
+            self._send(error.status, 'application/x-amz-json-1.1',
+                       json.dumps({'__type': error.code, 'message': str(error)}))
+        elif protocol == 'rest':
+            self._send(error.status, 'application/xml',
+                       f'<Error><Code>{error.code}</Code><Message>{message}</Message>'
+                       f'<RequestId>{request_id}</RequestId></Error>')
+        elif service == 'ec2':
+            self._send(error.status, 'text/xml',
+                       f'<Response><Errors><Error><Code>{error.code}</Code><Message>{message}'
+                       f'</Message></Error></Errors><RequestID>{request_id}</RequestID>'
+                       f'</Response>')
+        else:
+            self._send(error.status, 'text/xml',
+                       f'<ErrorResponse><Error><Type>Sender</Type><Code>{error.code}</Code>'
+                       f'<Message>{message}</Message></Error><RequestId>{request_id}'
+                       f'</RequestId></ErrorResponse>')
+
+    def _send(self, status, content_type, body):
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -0,0 +1,76 @@
+"""
+Run a tagging or reconciliation job across accounts and regions concurrently.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from boto3wrapper import Boto3Wrapper
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Concurrent targets in total and per region, so one region's API limits are not
+# exhausted by many accounts at once
+FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', '32'))
+FANOUT_REGION_CONCURRENCY = int(os.environ.get('FANOUT_REGION_CONCURRENCY', '4'))
+
+ROLE_ARN_FORMAT = 'arn:aws:iam::{account}:role/{role_name}'
+
+
+def role_arns(accounts, role_name):
+    """
+    :param accounts: The account IDs.
+    :param role_name: The name of the role assumed in every account.
+    :return: The role ARNs, one per account.
+    """
+    return [ROLE_ARN_FORMAT.format(account=account, role_name=role_name) for account in accounts]
+
+
+def available_regions(service='ec2'):
+    """
+    List the regions of a service from the endpoint data of the SDK, without an AWS call.
+
+    :param service: The service name.
+    :return: The region names.
+    """
+    return Boto3Wrapper.get_pooled_session().get_available_regions(service)
+
+
+def fan_out(job, roles, regions, max_workers=FANOUT_MAX_WORKERS,
+            region_concurrency=FANOUT_REGION_CONCURRENCY):
+    """
+    Run a job once per (role, region) target on a thread pool. Each job gets the pooled
+    session of its target, see Boto3Wrapper.get_pooled_session. Targets are ordered
+    account by account, so consecutive targets spread over the regions, and no more than
+    region_concurrency jobs run in one region at a time.
+
+    A failed job does not stop the others, its error is returned in its outcome.
+
+    :param job: Callable taking (session, role ARN, region) and returning a result.
+    :param roles: The role ARNs, one per account. None runs with the Lambda credentials.
+    :param regions: The region names.
+    :param max_workers: The maximum number of concurrent jobs.
+    :param region_concurrency: The maximum number of concurrent jobs per region.
+    :return: The outcomes keyed by (role ARN, region), dicts with Status ('complete' or
+    'failed') and Result or Error.
+    """
+    limits = {region: threading.BoundedSemaphore(region_concurrency) for region in regions}
+    targets = [(role_arn, region) for role_arn in roles for region in regions]
+
+    def run(target):
+        role_arn, region = target
+        with limits[region]:
+            try:
+                session = Boto3Wrapper.get_pooled_session(role_arn, region)
+                return {'Status': 'complete', 'Result': job(session, role_arn, region)}
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error('%s %s failed: %s', role_arn, region, error)
+                return {'Status': 'failed', 'Error': str(error)}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        outcomes = dict(zip(targets, pool.map(run, targets)))
+
+    failed = sum(1 for outcome in outcomes.values() if outcome['Status'] == 'failed')
+    logger.info('%d targets, %d failed', len(outcomes), failed)
+    return outcomes
@@ -0,0 +1,243 @@
+"""
+Idempotency keys of processed events and tagged resources. EventBridge and CloudTrail
+deliver events at least once, and StartInstances and RebootInstances name the same
+instances every time they run, so handlers skip event IDs they already processed and
+(resource ID, creator) pairs they already tagged.
+
+Keys are kept in an LRU cache per container and, when IDEMPOTENCY_TABLE names a DynamoDB
+table, in that table so they are shared by all containers. The table has a string
+partition key Key and time to live enabled on the ExpiresAt attribute.
+"""
+import logging
+import os
+import time
+from boto3wrapper import Boto3Wrapper
+from utils import TTLCache
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE', '')
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', '3600'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '4096'))
+
+# DynamoDB batch limits
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+class InMemoryStore:
+    """
+    Idempotency keys in a TTLCache, kept across warm invocations of one container.
+    """
+
+    def __init__(self, max_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL):
+        self.cache = TTLCache(max_size, ttl)
+
+    def seen(self, keys):
+        """
+        :param keys: The keys to look up.
+        :return: The keys already added, a set.
+        """
+        return {key for key in keys if self.cache.get(key) is not None}
+
+    def cached(self, keys):
+        """
+        :param keys: The keys to look up.
+        :return: The keys already added, a set, see seen.
+        """
+        return self.seen(keys)
+
+    def add(self, keys):
+        """
+        :param keys: The keys to add.
+        """
+        for key in keys:
+            self.cache.put(key, True)
+
+
+class DynamoDBStore:
+    """
+    Idempotency keys in a DynamoDB table shared by all containers. Items expire
+    ttl seconds after being added. The store is best effort, errors are logged and
+    the keys are treated as not seen.
+    """
+
+    def __init__(self, table, ttl=IDEMPOTENCY_TTL, client=None, clock=time.time):
+        self.table = table
+        self.ttl = ttl
+        self.client = client or Boto3Wrapper.get_client('dynamodb')
+        self.clock = clock
+
+    def seen(self, keys):
+        """
+        :param keys: The keys to look up, with one BatchGetItem call per 100 keys.
+        :return: The keys added and not expired, a set. Expired items are skipped as
+        DynamoDB deletes them up to a few days late.
+        """
+        keys = list(dict.fromkeys(keys))
+        now = int(self.clock())
+        found = set()
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            request = {self.table: {
+                'Keys': [{'Key': {'S': key}} for key in keys[start:start + BATCH_GET_MAX_KEYS]],
+                'ProjectionExpression': '#key, ExpiresAt',
+                'ExpressionAttributeNames': {'#key': 'Key'}
+            }}
+            try:
+                response = self.client.batch_get_item(RequestItems=request)
+            except self.client.exceptions.ClientError as error:
+                logger.warning('Idempotency lookup failed: %s', error)
+                continue
+            for item in response['Responses'].get(self.table, []):
+                if int(item['ExpiresAt']['N']) > now:
+                    found.add(item['Key']['S'])
+        return found
+
+    def cached(self, keys):  # pylint: disable=unused-argument
+        """
+        :param keys: The keys to look up.
+        :return: An empty set, every lookup of the table is a call.
+        """
+        return set()
+
+    def add(self, keys):
+        """
+        :param keys: The keys to add, with one BatchWriteItem call per 25 keys.
+        """
+        keys = list(dict.fromkeys(keys))
+        expires_at = str(int(self.clock()) + self.ttl)
+        for start in range(0, len(keys), BATCH_WRITE_MAX_ITEMS):
+            requests = [{'PutRequest': {'Item': {'Key': {'S': key},
+                                                 'ExpiresAt': {'N': expires_at}}}}
+                        for key in keys[start:start + BATCH_WRITE_MAX_ITEMS]]
+            try:
+                response = self.client.batch_write_item(RequestItems={self.table: requests})
+            except self.client.exceptions.ClientError as error:
+                logger.warning('Idempotency update failed: %s', error)
+                continue
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table, [])
+            if unprocessed:
+                logger.warning('Idempotency update skipped %d keys', len(unprocessed))
+
+
+class TieredStore:
+    """
+    A local store in front of a shared store. Keys found in the shared store are added
+    to the local store, so the next lookup of a warm container makes no call.
+    """
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def seen(self, keys):
+        """
+        :param keys: The keys to look up.
+        :return: The keys added to either store, a set.
+        """
+        found = self.local.seen(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            shared = self.shared.seen(missing)
+            self.local.add(shared)
+            found |= shared
+        return found
+
+    def cached(self, keys):
+        """
+        :param keys: The keys to look up in the local store only.
+        :return: The keys added to the local store, a set.
+        """
+        return self.local.seen(keys)
+
+    def add(self, keys):
+        """
+        :param keys: The keys to add to both stores.
+        """
+        keys = list(keys)
+        self.local.add(keys)
+        self.shared.add(keys)
+
+
+# The store of the container, built on first use, see get_store
+_STORE = {'store': None}
+
+
+def get_store():
+    """
+    :return: The idempotency store, tiered over IDEMPOTENCY_TABLE when it is set.
+    """
+    if _STORE['store'] is None:
+        store = InMemoryStore()
+        if IDEMPOTENCY_TABLE:
+            store = TieredStore(store, DynamoDBStore(IDEMPOTENCY_TABLE))
+        _STORE['store'] = store
+    return _STORE['store']
+
+
+def set_store(store):
+    """
+    Replace the idempotency store, e.g. by a fake in tests.
+    :param store: An object with seen(keys), cached(keys) and add(keys), None to rebuild
+    the default.
+    """
+    _STORE['store'] = store
+
+
+def event_key(detail):
+    """
+    :param detail: The detail portion of the CloudTrail object.
+    :return: The idempotency key of the event, None when it has no eventID.
+    """
+    event_id = detail.get('eventID')
+    return None if event_id is None else f'event:{event_id}'
+
+
+def resource_key(resource_id, creator):
+    """
+    :param resource_id: The resource ID.
+    :param creator: The Creator tag value.
+    :return: The idempotency key of the resource tagged with the creator.
+    """
+    return f'tag:{resource_id}:{creator}'
+
+
+def is_cached_event(detail):
+    """
+    :param detail: The detail portion of the CloudTrail object.
+    :return: True when the event is known as processed without a call to the shared
+    store, e.g. a retried delivery to a warm container.
+    """
+    key = event_key(detail)
+    return key is not None and bool(get_store().cached([key]))
+
+
+def check_event(detail, ids, creator):
+    """
+    Look up the event and its resources with a single store lookup, one BatchGetItem
+    call when the store is shared.
+    :param detail: The detail portion of the CloudTrail object.
+    :param ids: The resource IDs of the event.
+    :param creator: The Creator tag value.
+    :return: The (duplicate, untagged IDs) tuple, the IDs in order.
+    """
+    key = event_key(detail)
+    keys = [resource_key(resource_id, creator) for resource_id in ids]
+    seen = get_store().seen(keys if key is None else [key] + keys)
+    return key in seen, [resource_id for resource_id in ids
+                         if resource_key(resource_id, creator) not in seen]
+
+
+def mark_processed(details, ids, creator):
+    """
+    Record events as processed and resources as tagged with a single store update, one
+    BatchWriteItem call per 25 keys when the store is shared.
+    :param details: The detail portions of the processed CloudTrail objects.
+    :param ids: The tagged resource IDs.
+    :param creator: The Creator tag value.
+    """
+    keys = [resource_key(resource_id, creator) for resource_id in ids]
+    keys += [key for key in map(event_key, details) if key is not None]
+    if keys:
+        get_store().add(keys)
@@ -0,0 +1,155 @@
+"""
+Per-invocation timing and counters of the Lambda handlers, emitted as one CloudWatch
+Embedded Metric Format (EMF) record per invocation when AUTOTAG_METRICS is "true".
+"""
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from registry import THROTTLED_ERROR_CODES
+
+METRICS_ENV = 'AUTOTAG_METRICS'
+NAMESPACE = os.environ.get('AUTOTAG_METRICS_NAMESPACE', 'AutoTag')
+
+# Metrics of the EMF record, with their units:
+#   ColdStart     - 1 for the first invocation of the execution environment
+#   DurationMs    - the handler
+#   ParseMs       - event parsing, registry lookup and creator resolution
+#   ClientBuildMs - boto3 client and resource construction
+#   ApiCalls      - AWS API calls
+#   ApiMs         - AWS API calls, including retries
+#   Retries       - retried API call attempts
+#   Throttles     - throttled API call attempts
+#   RateLimitWaitMs - waits for the client-side rate limits, see ratelimit.py
+METRICS = {
+    'ColdStart': 'Count',
+    'DurationMs': 'Milliseconds',
+    'ParseMs': 'Milliseconds',
+    'ClientBuildMs': 'Milliseconds',
+    'ApiCalls': 'Count',
+    'ApiMs': 'Milliseconds',
+    'Retries': 'Count',
+    'Throttles': 'Count',
+    'RateLimitWaitMs': 'Milliseconds',
+}
+
+# The record of the running invocation, None outside instrumented handlers or when
+# metrics are off. Cold is cleared by the first invocation.
+_STATE = {'cold': True, 'record': None}
+_LOCK = threading.Lock()
+
+
+def enabled():
+    """
+    :return: True when AUTOTAG_METRICS is "true".
+    """
+    return os.environ.get(METRICS_ENV, 'false').lower() == 'true'
+
+
+def add(name, value):
+    """
+    Add to a metric of the running invocation, a no-op when there is none.
+    :param name: The metric name, see METRICS.
+    :param value: The amount added.
+    """
+    record = _STATE['record']
+    if record is not None:
+        with _LOCK:
+            record[name] = record.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def timer(name):
+    """
+    Time a block into a millisecond metric of the running invocation.
+    :param name: The metric name, see METRICS.
+    """
+    if _STATE['record'] is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, (time.perf_counter() - start) * 1000)
+
+
+def _before_call(context, **_kwargs):
+    context['metrics_start'] = time.perf_counter()
+
+
+def _after_call(parsed, context, **_kwargs):
+    add('ApiCalls', 1)
+    if 'metrics_start' in context:
+        add('ApiMs', (time.perf_counter() - context['metrics_start']) * 1000)
+    add('Retries', parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+
+def _needs_retry(response=None, **_kwargs):
+    if response is not None and response[1].get('Error', {}).get('Code') in \
+            THROTTLED_ERROR_CODES:
+        add('Throttles', 1)
+
+
+def attach_client_hooks(client):
+    """
+    Count and time the API calls of a client with botocore event hooks. The hooks only
+    record while an instrumented invocation is running.
+    :param client: The boto3 client.
+    """
+    events = client.meta.events
+    events.register_first('before-call', _before_call)
+    events.register('after-call', _after_call)
+    events.register('needs-retry', _needs_retry)
+
+
+def emf_record(record, function_name, timestamp=None):
+    """
+    Build the EMF record of an invocation.
+    :param record: The metric values, see METRICS.
+    :param function_name: The Lambda function name, the metric dimension.
+    :param timestamp: The epoch time in seconds, now by default.
+    :return: The EMF record, a dict.
+    """
+    values = {name: round(record.get(name, 0), 3) for name in METRICS}
+    return dict(values, FunctionName=function_name, _aws={
+        'Timestamp': int((timestamp or time.time()) * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': NAMESPACE,
+            'Dimensions': [['FunctionName']],
+            'Metrics': [{'Name': name, 'Unit': unit} for name, unit in METRICS.items()]
+        }]
+    })
+
+
+def instrumented(handler):
+    """
+    Decorate a Lambda handler to emit one EMF record per invocation on stdout, when
+    metrics are enabled. Handlers called by an instrumented handler, e.g. by the batch
+    handler, add to the record of the outer invocation.
+    :param handler: The Lambda handler.
+    :return: The decorated handler.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context, *args):
+        cold = _STATE['cold']
+        _STATE['cold'] = False
+        if _STATE['record'] is not None or not enabled():
+            return handler(event, context, *args)
+
+        record = {'ColdStart': 1 if cold else 0}
+        _STATE['record'] = record
+        start = time.perf_counter()
+        try:
+            return handler(event, context, *args)
+        finally:
+            record['DurationMs'] = (time.perf_counter() - start) * 1000
+            _STATE['record'] = None
+            function_name = getattr(context, 'function_name', None) or os.environ.get(
+                'AWS_LAMBDA_FUNCTION_NAME', handler.__name__)
+            sys.stdout.write(json.dumps(emf_record(record, function_name)) + '\n')
+            sys.stdout.flush()
+    return wrapper
@@ -0,0 +1,368 @@
+"""
+Pending tag work: DynamoDB tables, DAX clusters and Redshift clusters waiting to finish
+creating before they can be tagged. With PENDING_MODE set to "sweeper", the creation event
+handlers put an item in the pending store instead of starting one state machine execution
+per resource, and the scheduled sweeper, see sweeper_function.py, checks and tags all
+pending resources in one pass. With PENDING_MODE set to "aggregate", the handlers buffer
+the state machine task of each resource instead, and start one execution of the Map state
+machine for all tasks buffered in the last AGGREGATE_WINDOW seconds, see flush. Flushes
+take a lease of their state machine in the store, so a single flush of a state machine
+reads the store and starts executions at a time.
+
+Items are dicts with ResourceArn (the store key), Tagging (the TAGGING_APIS entry name),
+Creator, EventName and EnqueuedAt (epoch seconds), or in aggregate
+mode ResourceArn, Tagging, Task (the state machine task) and EnqueuedAt. The store is a
+DynamoDB table when PENDING_TABLE is set, with a string partition key ResourceArn, else an
+SQLite database when PENDING_SQLITE names a file, else in memory, which is only shared
+by handlers running in the same container, e.g. through router_function.py. In the
+DynamoDB table, a lease is an item with LeasedUntil (epoch seconds) and no Item attribute.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from boto3wrapper import Boto3Wrapper
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PENDING_MODE_ENV = 'PENDING_MODE'
+PENDING_TABLE = os.environ.get('PENDING_TABLE', '')
+PENDING_SQLITE = os.environ.get('PENDING_SQLITE', '')
+
+# Seconds the oldest task is buffered before a handler flushes, and tasks per execution,
+# bounded by the 256 KB execution input and 25,000 history events of an execution
+AGGREGATE_WINDOW = float(os.environ.get('AGGREGATE_WINDOW', '10'))
+AGGREGATE_MAX_ITEMS = int(os.environ.get('AGGREGATE_MAX_ITEMS', '100'))
+
+# Shortest flush lease, in seconds, longer than a flush takes to start its executions
+FLUSH_LEASE = 10
+
+# DynamoDB batch limit
+BATCH_WRITE_MAX_ITEMS = 25
+
+
+def pending_mode(settings=None):
+    """
+    :param settings: The handler settings, defaults to the environment.
+    :return: How deferred resources are tagged, "sfn" (the default, one state machine
+    execution per resource), "sweeper" or "aggregate" (one Map state machine execution
+    per window).
+    """
+    settings = os.environ if settings is None else settings
+    return settings.get(PENDING_MODE_ENV, 'sfn').lower()
+
+
+class InMemoryPendingStore:
+    """
+    Pending items in a dict, kept across warm invocations of one container.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        """
+        Add or replace the item of a resource.
+        :param item: The pending item.
+        """
+        with self._lock:
+            self._items[item['ResourceArn']] = dict(item)
+
+    def items(self):
+        """
+        :return: The pending items, oldest first.
+        """
+        with self._lock:
+            return sorted((dict(item) for item in self._items.values()),
+                          key=lambda item: item['EnqueuedAt'])
+
+    def delete(self, arns):
+        """
+        :param arns: The ARNs of the resources whose items are removed.
+        """
+        with self._lock:
+            for arn in arns:
+                self._items.pop(arn, None)
+
+    def acquire(self, name, until, now):
+        """
+        Take a lease unless it is held.
+        :param name: The lease name.
+        :param until: The epoch seconds the lease is held until.
+        :param now: The current epoch seconds, the lease is held until then.
+        :return: True if the lease was taken.
+        """
+        with self._lock:
+            if self._leases.get(name, 0) > now:
+                return False
+            self._leases[name] = until
+            return True
+
+
+class SQLitePendingStore:
+    """
+    Pending items in an SQLite database, for local runs and tests.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS pending '
+                             '(resource_arn TEXT PRIMARY KEY, enqueued_at REAL, item TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS lease '
+                             '(name TEXT PRIMARY KEY, leased_until REAL)')
+
+    def put(self, item):
+        """
+        Add or replace the item of a resource.
+        :param item: The pending item.
+        """
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO pending VALUES (?, ?, ?)',
+                             (item['ResourceArn'], item['EnqueuedAt'], json.dumps(item)))
+
+    def items(self):
+        """
+        :return: The pending items, oldest first.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT item FROM pending ORDER BY enqueued_at').fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, arns):
+        """
+        :param arns: The ARNs of the resources whose items are removed.
+        """
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM pending WHERE resource_arn = ?',
+                                 [(arn,) for arn in arns])
+
+    def acquire(self, name, until, now):
+        """
+        Take a lease unless it is held, with one upsert, so the database may be shared by
+        processes.
+        :param name: The lease name.
+        :param until: The epoch seconds the lease is held until.
+        :param now: The current epoch seconds, the lease is held until then.
+        :return: True if the lease was taken.
+        """
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'INSERT INTO lease VALUES (?, ?) ON CONFLICT (name) DO UPDATE '
+                'SET leased_until = excluded.leased_until WHERE leased_until <= ?',
+                (name, until, now))
+        return cursor.rowcount == 1
+
+
+class DynamoDBPendingStore:
+    """
+    Pending items in a DynamoDB table, shared by the creation event handlers and the
+    sweeper. Each item is stored as JSON in the Item attribute, leases are stored next to
+    the items, see acquire.
+    """
+
+    def __init__(self, table, client=None):
+        self.table = table
+        self.client = client or Boto3Wrapper.get_client('dynamodb')
+
+    def put(self, item):
+        """
+        Add or replace the item of a resource.
+        :param item: The pending item.
+        """
+        self.client.put_item(TableName=self.table, Item={
+            'ResourceArn': {'S': item['ResourceArn']}, 'Item': {'S': json.dumps(item)}})
+
+    def items(self):
+        """
+        :return: The pending items, oldest first, read with a paginated Scan.
+        """
+        paginator = self.client.get_paginator('scan')
+        items = [json.loads(record['Item']['S'])
+                 for page in paginator.paginate(TableName=self.table)
+                 for record in page['Items'] if 'Item' in record]
+        return sorted(items, key=lambda item: item['EnqueuedAt'])
+
+    def delete(self, arns):
+        """
+        :param arns: The ARNs of the resources whose items are removed, with one
+        BatchWriteItem call per 25 items.
+        """
+        arns = list(arns)
+        for start in range(0, len(arns), BATCH_WRITE_MAX_ITEMS):
+            self.client.batch_write_item(RequestItems={self.table: [
+                {'DeleteRequest': {'Key': {'ResourceArn': {'S': arn}}}}
+                for arn in arns[start:start + BATCH_WRITE_MAX_ITEMS]]})
+
+    def acquire(self, name, until, now):
+        """
+        Take a lease unless it is held, with one conditional PutItem of the lease item,
+        keyed "lease:<name>".
+        :param name: The lease name.
+        :param until: The epoch seconds the lease is held until.
+        :param now: The current epoch seconds, the lease is held until then.
+        :return: True if the lease was taken.
+        """
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item={'ResourceArn': {'S': 'lease:' + name}, 'LeasedUntil': {'N': str(until)}},
+                ConditionExpression='attribute_not_exists(ResourceArn) OR LeasedUntil <= :now',
+                ExpressionAttributeValues={':now': {'N': str(now)}})
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+
+# The store of the container, built on first use, see get_store
+_STORE = {'store': None}
+
+
+def get_store():
+    """
+    :return: The pending store, see the module documentation.
+    """
+    if _STORE['store'] is None:
+        if PENDING_TABLE:
+            _STORE['store'] = DynamoDBPendingStore(PENDING_TABLE)
+        elif PENDING_SQLITE:
+            _STORE['store'] = SQLitePendingStore(PENDING_SQLITE)
+        else:
+            _STORE['store'] = InMemoryPendingStore()
+    return _STORE['store']
+
+
+def set_store(store):
+    """
+    Replace the pending store, e.g. by a local store in tests.
+    :param store: An object with put(item), items(), delete(arns) and
+    acquire(name, until, now), None to rebuild the default.
+    """
+    _STORE['store'] = store
+
+
+def defer(event_name, creator, resource_arn, tagging):
+    """
+    Put a resource in the pending store, to be tagged by the sweeper once created, or
+    expired once PENDING_MAX_AGE seconds old, see sweeper_function.py.
+
+    :param event_name: The creation event name.
+    :param creator: The Creator tag value.
+    :param resource_arn: The resource ARN.
+    :param tagging: The TAGGING_APIS entry name.
+    :return: The pending item.
+    """
+    item = {
+        'ResourceArn': resource_arn,
+        'Tagging': tagging,
+        'Creator': creator,
+        'EventName': event_name,
+        'EnqueuedAt': time.time()
+    }
+    get_store().put(item)
+    return item
+
+
+def buffer_task(resource_arn, tagging, task):
+    """
+    Put the state machine task of a resource in the pending store, to be started with the
+    other tasks of the window, see flush.
+
+    :param resource_arn: The resource ARN.
+    :param tagging: The TAGGING_APIS entry name.
+    :param task: The state machine task, as started in "sfn" mode.
+    :return: The pending item.
+    """
+    item = {'ResourceArn': resource_arn, 'Tagging': tagging, 'Task': task,
+            'EnqueuedAt': time.time()}
+    get_store().put(item)
+    return item
+
+
+def flush(state_machine_arn, taggings, window=0.0, now=None):
+    """
+    Start the buffered tasks of some services, once the oldest was buffered window seconds
+    ago, with one execution of the Map state machine per AGGREGATE_MAX_ITEMS tasks, input
+    {"Items": [task, ...]}.
+
+    A flush first takes the lease of the state machine for window seconds, at least
+    FLUSH_LEASE, and returns when another flush holds it. So a single flush reads the
+    store and starts executions at a time, as long as it ends within its lease, and the
+    store is scanned at most once per window however many tasks are buffered. The items
+    of an execution are deleted once it started, so a failed start is retried by the next
+    flush. The execution name is derived from the items, so items whose delete failed do
+    not start a second execution.
+
+    :param state_machine_arn: The Map state machine ARN.
+    :param taggings: The TAGGING_APIS entry names of the tasks to start.
+    :param window: The seconds to buffer the oldest task, 0 to start all tasks.
+    :param now: The current epoch seconds, defaults to the current time.
+    :return: The ARNs of the started executions.
+    """
+    store = get_store()
+    now = time.time() if now is None else now
+    if not store.acquire('flush:' + state_machine_arn, now + max(window, FLUSH_LEASE), now):
+        return []
+    items = [item for item in store.items() if 'Task' in item and item['Tagging'] in taggings]
+    if not items or items[0]['EnqueuedAt'] > now - window:
+        return []
+
+    sfn = Boto3Wrapper.get_client('stepfunctions')
+    executions = []
+    for start in range(0, len(items), AGGREGATE_MAX_ITEMS):
+        chunk = items[start:start + AGGREGATE_MAX_ITEMS]
+        digest = hashlib.sha1(json.dumps(
+            [(item['ResourceArn'], item['EnqueuedAt']) for item in chunk]).encode())
+        try:
+            response = sfn.start_execution(
+                stateMachineArn=state_machine_arn,
+                name='batch-' + digest.hexdigest(),
+                input=json.dumps({'Items': [item['Task'] for item in chunk]}))
+            executions.append(response['executionArn'])
+        except sfn.exceptions.ExecutionAlreadyExists:
+            pass
+        store.delete([item['ResourceArn'] for item in chunk])
+    return executions
+
+
+def aggregate(resource_arn, tagging, task, state_machine_arn, taggings):
+    """
+    Buffer the state machine task of a resource, and flush the tasks of the window when it
+    is over, to the Map state machine of the handler (its AGGREGATE_SFN_ARN).
+
+    :param resource_arn: The resource ARN.
+    :param tagging: The TAGGING_APIS entry name.
+    :param task: The state machine task.
+    :param state_machine_arn: The Map state machine ARN.
+    :param taggings: The TAGGING_APIS entry names of the tasks of the state machine.
+    """
+    buffer_task(resource_arn, tagging, task)
+    flush(state_machine_arn, taggings, AGGREGATE_WINDOW)
+
+
+def flush_requested(event, taggings, settings=None):
+    """
+    Start all buffered tasks when the event is a {"Flush": true} event, e.g. from a
+    schedule, so the tasks of the last window are not left waiting for the next creation
+    event. Outside aggregate mode the event is ignored.
+
+    :param event: The Lambda event.
+    :param taggings: The TAGGING_APIS entry names of the tasks of the state machine.
+    :param settings: The handler settings, PENDING_MODE and AGGREGATE_SFN_ARN, defaults to
+    the environment.
+    :return: True if the event was a flush event.
+    """
+    if not event.get('Flush'):
+        return False
+    settings = os.environ if settings is None else settings
+    if pending_mode(settings) == 'aggregate':
+        executions = flush(settings['AGGREGATE_SFN_ARN'], taggings)
+        logger.info('Started %d executions', len(executions))
+    return True
@@ -0,0 +1,237 @@
+"""
+Client-side token bucket rate limits per service and API, so bursts of events, e.g. a
+CloudFormation stack creating dozens of resources, stay under the API limits instead of
+falling into throttle and retry storms.
+
+Limits are read from AUTOTAG_RATE_LIMITS, a JSON object keyed by service or
+service.Operation, e.g. {"ec2.CreateTags": {"rate": 20, "burst": 40}, "rds": {"rate": 5}}.
+The service is the botocore service ID of the client events, lowercase and hyphenated,
+which differs from the boto3 client name of some services, e.g. "sfn" for stepfunctions
+and "cloudwatch-logs" for logs. Keys that are not of this form are logged and ignored.
+Rates are requests per second, burst defaults to the rate. A service key is one bucket
+shared by all operations of the service. Buckets are shared by all clients, threads and
+handlers of the process. Every HTTP attempt takes a token, including botocore retries.
+
+With AUTOTAG_RATE_LIMIT_MODE set to "adaptive" a throttled attempt halves the rate of its
+bucket, and each successful attempt restores a twentieth of the configured rate.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import metrics
+from registry import THROTTLED_ERROR_CODES
+
+logger = logging.getLogger()
+
+RATE_LIMITS_ENV = 'AUTOTAG_RATE_LIMITS'
+RATE_LIMIT_MODE_ENV = 'AUTOTAG_RATE_LIMIT_MODE'
+
+# Adaptive mode: rate multiplier on throttling, share of the configured rate restored per
+# success, and floor of the rate as a share of the configured rate
+ADAPTIVE_BACKOFF = 0.5
+ADAPTIVE_RECOVERY = 0.05
+ADAPTIVE_MIN_SHARE = 0.05
+
+# Botocore service IDs, keyed by boto3 client name, where they differ
+CLIENT_SERVICE_IDS = {
+    'stepfunctions': 'sfn',
+    'logs': 'cloudwatch-logs',
+    'events': 'eventbridge',
+    'resourcegroupstaggingapi': 'resource-groups-tagging-api',
+    'elbv2': 'elastic-load-balancing-v2',
+}
+
+# A service ID, optionally followed by an operation name
+_KEY_PATTERN = re.compile(r'[a-z0-9-]+(\.[A-Z][A-Za-z0-9]*)?')
+
+
+class TokenBucket:  # pylint: disable=too-many-instance-attributes
+    """
+    A thread safe token bucket. Callers that find it empty reserve a token ahead and sleep
+    until it is due, so waits are served in order. Waits and throttles are counted.
+    """
+
+    def __init__(self, rate, burst=None, adaptive=False, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.burst = float(burst or rate)
+        self.adaptive = adaptive
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated = clock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available.
+        :return: The seconds waited.
+        """
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait:
+                self.waits += 1
+                self.wait_seconds += wait
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def throttled(self):
+        """Count a throttled attempt, and in adaptive mode lower the rate."""
+        with self._lock:
+            self.throttles += 1
+            if self.adaptive:
+                self._refill(self.clock())
+                self.rate = max(self.rate * ADAPTIVE_BACKOFF, self.max_rate * ADAPTIVE_MIN_SHARE)
+                self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        """In adaptive mode, raise the rate back towards the configured rate."""
+        if self.adaptive and self.rate < self.max_rate:
+            with self._lock:
+                self._refill(self.clock())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * ADAPTIVE_RECOVERY)
+
+    def stats(self):
+        """
+        :return: The current rate and the wait and throttle counters, a dict.
+        """
+        return {'Rate': self.rate, 'Waits': self.waits,
+                'WaitSeconds': round(self.wait_seconds, 3), 'Throttles': self.throttles}
+
+
+# The limits of the process and their buckets, keyed by service or service.Operation,
+# built from the environment on first use, see configure
+_STATE = {'limits': None, 'adaptive': False, 'buckets': {}}
+_LOCK = threading.Lock()
+
+
+def valid_limits(rate_limits):
+    """
+    Drop the limits that no client event would match, logging a warning for each.
+
+    :param rate_limits: The limits, a dict keyed by service or service.Operation.
+    :return: The limits keyed by a service ID, or a service ID and operation, with a rate.
+    """
+    valid = {}
+    for key, limit in rate_limits.items():
+        service = key.split('.', 1)[0]
+        if service in CLIENT_SERVICE_IDS:
+            logger.warning('Rate limit [ %s ] ignored, the service ID of %s is %s',
+                           key, service, CLIENT_SERVICE_IDS[service])
+        elif not _KEY_PATTERN.fullmatch(key) or not isinstance(limit, dict) or 'rate' not in limit:
+            logger.warning('Rate limit [ %s ] ignored, expected a service ID or '
+                           'serviceId.Operation key and a rate', key)
+        else:
+            valid[key] = limit
+    return valid
+
+
+def configure(rate_limits=None, mode=None):
+    """
+    Set the rate limits and drop the buckets. Without arguments the limits are read from
+    AUTOTAG_RATE_LIMITS and AUTOTAG_RATE_LIMIT_MODE. Invalid limits are ignored, see
+    valid_limits.
+
+    :param rate_limits: The limits, a dict keyed by service or service.Operation of dicts
+    with rate and optionally burst.
+    :param mode: "static" or "adaptive".
+    :return: The limits.
+    """
+    if rate_limits is None:
+        rate_limits = json.loads(os.environ.get(RATE_LIMITS_ENV) or '{}')
+    rate_limits = valid_limits(rate_limits)
+    mode = mode or os.environ.get(RATE_LIMIT_MODE_ENV, 'static')
+    with _LOCK:
+        _STATE['limits'] = rate_limits
+        _STATE['adaptive'] = mode == 'adaptive'
+        _STATE['buckets'] = {}
+    return rate_limits
+
+
+def get_limits():
+    """
+    :return: The configured limits, read from the environment on first use, see configure.
+    """
+    rate_limits = _STATE['limits']
+    return configure() if rate_limits is None else rate_limits
+
+
+def bucket(service, operation):
+    """
+    :param service: The botocore service ID, e.g. 'ec2'.
+    :param operation: The operation name, e.g. 'CreateTags'.
+    :return: The TokenBucket of the operation, None when it is not limited.
+    """
+    configured = get_limits()
+    key = f'{service}.{operation}'
+    if key not in configured:
+        key = service
+        if key not in configured:
+            return None
+    with _LOCK:
+        if key not in _STATE['buckets']:
+            limit = configured[key]
+            _STATE['buckets'][key] = TokenBucket(limit['rate'], limit.get('burst'),
+                                                 _STATE['adaptive'])
+        return _STATE['buckets'][key]
+
+
+def stats():
+    """
+    :return: The rate and counters of each bucket used so far, keyed by service or
+    service.Operation.
+    """
+    with _LOCK:
+        return {key: limiter.stats() for key, limiter in _STATE['buckets'].items()}
+
+
+def _event_bucket(event_name):
+    # Event names are <event>.<service ID>.<operation>
+    _, service, operation = event_name.split('.', 2)
+    return bucket(service, operation)
+
+
+def _before_send(event_name, **_kwargs):
+    limiter = _event_bucket(event_name)
+    if limiter is not None:
+        wait = limiter.acquire()
+        if wait:
+            metrics.add('RateLimitWaitMs', wait * 1000)
+
+
+def _needs_retry(event_name, response=None, **_kwargs):
+    if response is None:
+        return
+    limiter = _event_bucket(event_name)
+    if limiter is None:
+        return
+    if response[1].get('Error', {}).get('Code') in THROTTLED_ERROR_CODES:
+        limiter.throttled()
+    elif response[0].status_code < 300:
+        limiter.succeeded()
+
+
+def attach_client_hooks(client):
+    """
+    Rate limit the HTTP attempts of a client with botocore event hooks, when limits are
+    configured.
+    :param client: The boto3 client.
+    """
+    if get_limits():
+        events = client.meta.events
+        events.register('before-send', _before_send)
+        events.register('needs-retry', _needs_retry)
@@ -0,0 +1,264 @@
+"""
+Find resources missing the Creator tag, e.g. after a failed Lambda, a state machine
+reaching max attempts or an unsupported event, and optionally tag them.
+
+Resources are listed with the Resource Groups Tagging API, one paged GetResources scan
+per region for all the resource types the project tags, instead of describe calls per
+service. GetResources only lists resources that have tags, or had tags once: resources
+that were never tagged are not found, see backfill.py for those. Untagged resources are
+streamed to the report as they are found, only their IDs are kept for a re-drive.
+
+A re-drive resolves the creator of each resource from its creation event in the CloudTrail
+event history. LookupEvents is limited to 2 requests per second per account and region, so
+lookups are paced to LOOKUP_EVENTS_RATE per target and throttled lookups are retried with
+backoff.
+
+Usage:
+    python3 reconcile.py [--regions REGIONS] [--accounts ACCOUNTS --role-name NAME]
+                         [--report FILE] [--redrive] [--placebo DIR]
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from boto3wrapper import Boto3Wrapper
+from fanout import fan_out, role_arns, available_regions
+from ratelimit import TokenBucket
+from registry import TAGGING_APIS, arn_resource_type, arn_resource_id, arn_resource_name
+from registry import is_creation_event, retry_delay, tag_resources
+from utils import CREATOR_TAG_NAME, is_err_detail, get_creator, creator_tags
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RESOURCES_PER_PAGE = 100
+
+# CloudTrail events read per resource when resolving its creator, newest first, in pages
+# of up to LOOKUP_PAGE_SIZE
+LOOKUP_MAX_EVENTS = 200
+LOOKUP_PAGE_SIZE = 50
+
+# LookupEvents requests per second per account and region, and attempts per request
+LOOKUP_EVENTS_RATE = float(os.environ.get('LOOKUP_EVENTS_RATE', '2'))
+LOOKUP_MAX_ATTEMPTS = 5
+
+
+def resource_type_filters(taggings=None):
+    """
+    :param taggings: The TAGGING_APIS entry names, all entries with resource types when None.
+    :return: The TAGGING_APIS entry names, keyed by Resource Groups Tagging API resource type.
+    """
+    taggings = taggings or [name for name, api in TAGGING_APIS.items() if 'resource_types' in api]
+    return {resource_type: tagging for tagging in taggings
+            for resource_type in TAGGING_APIS[tagging].get('resource_types', ())}
+
+
+def iter_untagged(client, filters):
+    """
+    Page through the resources of a region and keep the ones without a Creator tag.
+
+    :param client: The Resource Groups Tagging API client.
+    :param filters: The TAGGING_APIS entry names, keyed by resource type, see
+    resource_type_filters.
+    :return: A generator of (TAGGING_APIS entry name, ARN) pairs.
+    """
+    paginator = client.get_paginator('get_resources')
+    for page in paginator.paginate(ResourceTypeFilters=list(filters),
+                                   ResourcesPerPage=RESOURCES_PER_PAGE):
+        for mapping in page['ResourceTagMappingList']:
+            if any(tag['Key'] == CREATOR_TAG_NAME for tag in mapping.get('Tags', [])):
+                continue
+            arn = mapping['ResourceARN']
+            tagging = filters.get(arn_resource_type(arn))
+            if tagging is not None:
+                yield tagging, arn
+
+
+def lookup_creator(cloudtrail, arn, pacer):
+    """
+    Resolve the creator of a resource from its creation event in the CloudTrail event
+    history, which covers the last 90 days. Other supported events naming the resource,
+    e.g. StartInstances, are not taken as the creation.
+
+    :param cloudtrail: The CloudTrail client.
+    :param arn: The resource ARN.
+    :param pacer: The TokenBucket pacing the LookupEvents requests of the target.
+    :return: The creator, None if no creation event names the resource.
+    :raise ClientError: When a lookup still fails after LOOKUP_MAX_ATTEMPTS attempts.
+    """
+    kwargs = {'LookupAttributes': [{'AttributeKey': 'ResourceName',
+                                    'AttributeValue': arn_resource_name(arn)}],
+              'MaxResults': LOOKUP_PAGE_SIZE}
+    read = 0
+    while read < LOOKUP_MAX_EVENTS:
+        page = _lookup_events(cloudtrail, pacer, kwargs)
+        for event in page['Events']:
+            detail = json.loads(event['CloudTrailEvent'])
+            if is_creation_event(detail) and not is_err_detail(logger, detail, False):
+                return get_creator({'detail': detail})
+        read += len(page['Events'])
+        if not page.get('NextToken'):
+            break
+        kwargs['NextToken'] = page['NextToken']
+    return None
+
+
+def _lookup_events(cloudtrail, pacer, kwargs):
+    """
+    Request a page of events, paced, retrying throttled requests after registry.retry_delay.
+    :param cloudtrail: The CloudTrail client.
+    :param pacer: The TokenBucket pacing the requests.
+    :param kwargs: The LookupEvents arguments.
+    :return: The response.
+    """
+    attempts = 0
+    while True:
+        pacer.acquire()
+        attempts += 1
+        try:
+            return cloudtrail.lookup_events(**kwargs)
+        except cloudtrail.exceptions.ClientError as error:
+            delay = retry_delay(error, attempts, LOOKUP_MAX_ATTEMPTS)
+            if delay is None:
+                raise
+            logger.warning('LookupEvents attempt %d failed: %s', attempts, error)
+            time.sleep(delay)
+
+
+def redrive(role_arn, region, untagged):
+    """
+    Tag untagged resources whose creator is found in CloudTrail, with one tagging plan
+    per tagging API and creator. Bucket tags are merged into the current tag set, see
+    registry.TAGGING_APIS read_api.
+
+    :param role_arn: The role assumed in the target account, None for the current account.
+    :param region: The region.
+    :param untagged: The untagged ARNs, keyed by TAGGING_APIS entry name.
+    :return: The numbers of tagged, failed and unresolved resources, a dict.
+    """
+    cloudtrail = Boto3Wrapper.get_client('cloudtrail', role_arn, region)
+    pacer = TokenBucket(LOOKUP_EVENTS_RATE)
+    counts = {'tagged': 0, 'failed': 0, 'unresolved': 0}
+
+    for tagging, arns in untagged.items():
+        by_creator = {}
+        for arn in arns:
+            creator = _resolve_creator(cloudtrail, pacer, arn, counts)
+            if creator is not None:
+                by_creator.setdefault(creator, []).append(arn_resource_id(tagging, arn))
+
+        client = Boto3Wrapper.get_client(TAGGING_APIS[tagging]['service'], role_arn, region)
+        for creator, ids in by_creator.items():
+            for outcome in tag_resources(logger, client, tagging, ids,
+                                         creator_tags(creator)):
+                status = 'tagged' if outcome['Status'] == 'tagged' else 'failed'
+                counts[status] += len(outcome['Resources'])
+    return counts
+
+
+def _resolve_creator(cloudtrail, pacer, arn, counts):
+    """
+    Look up the creator of a resource, counting the failed and unresolved lookups.
+    :param cloudtrail: The CloudTrail client.
+    :param pacer: The TokenBucket pacing the LookupEvents requests.
+    :param arn: The resource ARN.
+    :param counts: The re-drive counts, see redrive.
+    :return: The creator, None when the lookup failed or found no creation event.
+    """
+    try:
+        creator = lookup_creator(cloudtrail, arn, pacer)
+    except cloudtrail.exceptions.ClientError as error:
+        logger.warning('Cannot look up the creator of [ %s ]: %s', arn, error)
+        counts['failed'] += 1
+        return None
+    if creator is None:
+        counts['unresolved'] += 1
+    return creator
+
+
+def reconcile(role_arn, region, report=None, redrive_tags=False, taggings=None):
+    """
+    Find the resources of an account and region missing the Creator tag.
+
+    :param role_arn: The role assumed in the target account, None for the current account.
+    :param region: The region.
+    :param report: Callable taking a report row dict, None for no report.
+    :param redrive_tags: If true tag the resources whose creator is found in CloudTrail.
+    :param taggings: The TAGGING_APIS entry names to check, see resource_type_filters.
+    :return: The numbers of untagged resources, and of tagged, failed and unresolved
+    resources when re-driven, a dict.
+    """
+    client = Boto3Wrapper.get_client('resourcegroupstaggingapi', role_arn, region)
+    untagged = {}
+    count = 0
+    for tagging, arn in iter_untagged(client, resource_type_filters(taggings)):
+        count += 1
+        if report is not None:
+            report({'Region': region, 'Tagging': tagging, 'ResourceARN': arn})
+        if redrive_tags:
+            untagged.setdefault(tagging, []).append(arn)
+
+    counts = {'untagged': count}
+    if redrive_tags:
+        counts.update(redrive(role_arn, region, untagged))
+    logger.info('%s %s: %s', role_arn or 'current account', region, counts)
+    return counts
+
+
+def json_lines_writer(stream):
+    """
+    :param stream: The report stream.
+    :return: A thread safe callable writing a report row as a JSON line.
+    """
+    lock = threading.Lock()
+
+    def write(row):
+        line = json.dumps(row) + '\n'
+        with lock:
+            stream.write(line)
+    return write
+
+
+def main(argv):
+    """
+    Parse the command line and reconcile every account and region.
+    :param argv: The command line arguments.
+    :return: The process exit code, 1 when a target failed or resources failed to be tagged.
+    """
+    parser = argparse.ArgumentParser(description='Find resources missing the Creator tag')
+    parser.add_argument('--regions', default='us-east-1',
+                        help='comma separated regions, or "all"')
+    parser.add_argument('--accounts', help='comma separated account IDs, needs --role-name')
+    parser.add_argument('--role-name', help='role assumed in every account')
+    parser.add_argument('--report', help='JSON lines report of untagged resources, - for stdout')
+    parser.add_argument('--redrive', action='store_true',
+                        help='tag resources whose creator is found in CloudTrail')
+    parser.add_argument('--placebo', help='play back recorded AWS responses from this directory')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig()
+    if args.placebo:
+        import placebo  # pylint: disable=import-outside-toplevel
+        placebo.attach(Boto3Wrapper.get_session(), data_path=args.placebo).playback()
+
+    regions = available_regions() if args.regions == 'all' else args.regions.split(',')
+    roles = role_arns(args.accounts.split(','), args.role_name) if args.accounts else [None]
+
+    with (contextlib.nullcontext(sys.stdout) if args.report in (None, '-') else
+          open(args.report, 'w', encoding='utf-8')) as stream:
+        report = json_lines_writer(stream) if args.report else None
+        outcomes = fan_out(lambda _session, role_arn, region:
+                           reconcile(role_arn, region, report, args.redrive),
+                           roles, regions)
+
+    failed = [outcome for outcome in outcomes.values()
+              if outcome['Status'] == 'failed' or outcome['Result'].get('failed')]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
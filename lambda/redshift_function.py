@@ -3,56 +3,87 @@ import json
 import logging
 import os
 from boto3wrapper import Boto3Wrapper
-from utils import is_err_detail, get_creator
+from metrics import instrumented
+from pending import pending_mode, defer, aggregate, flush_requested
+from registry import extract_resource_ids
+from utils import preflight, tag_immediately, backoff_seconds
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Services whose tasks are started by the Map state machine of this handler in aggregate mode
+AGGREGATED_TAGGINGS = ('redshift',)
 
-def redshift_lambda_handler(event, context):
+
+@instrumented
+def redshift_lambda_handler(event, context, settings=None):
     """
     Fires on Redshift cluster creation, parses the event, starts and passes event summary to
     the Step Function state machine that will arrange for the Creator tag to be added.
+    With TAG_IMMEDIATE set to "true", a cluster that is already taggable is tagged directly.
+    With PENDING_MODE set to "sweeper", the cluster is put in the pending store for the sweeper.
+    With PENDING_MODE set to "aggregate", its task is buffered and started with the tasks of
+    other clusters by one Map state machine execution. A {"Flush": true} event starts all
+    buffered tasks.
 
     :param event: The CloudWatch event.
     :param context: Provides information about the invocation, function, and execution environment.
-    :return: True if the input event is not describing an error.
+    :param settings: SFN_ARN, AGGREGATE_SFN_ARN and PENDING_MODE, defaults to the environment,
+    e.g. given per route by router_function.py.
+    :return: True if the cluster was tagged, deferred or the state machine execution started,
+    False if the input event is describing an error or is not supported.
     """
-    logging.debug('event: %s', event)
+    logger.debug('event: %s', event)
+
+    settings = os.environ if settings is None else settings
+    if flush_requested(event, AGGREGATED_TAGGINGS, settings):
+        return True
 
     detail = event['detail']
     event_name = detail['eventName']
-    creator = get_creator(event)
 
     logger.info('Event type: %s', event_name)
 
-    if is_err_detail(logger, detail):
+    creator, spec = preflight(logger, event)
+    if spec is None:
         return False
 
-    if event_name == 'CreateCluster':
-        logger.debug('%s is creating cluster: %s',
-                     creator, detail['requestParameters']['clusterIdentifier'])
-
-        # https://docs.aws.amazon.com/general/latest/gr/aws-arns-and-namespaces.html
-        cluster_arn = 'arn:aws:redshift:' + detail['awsRegion'] + ':'\
-                      + detail['userIdentity']['accountId'] + ':cluster:'\
-                      + detail['requestParameters']['clusterIdentifier']
-        short_msg = {
-            "EventName": event_name,
-            "Creator": creator,
-            "ResourceArn": cluster_arn,
-            "TagStatus": "pending",
-            "MaxRetries": int(os.environ['SFN_MAX_RETRIES']),
-            "Retries": 0
-        }
-
-        sfn = Boto3Wrapper.get_client('stepfunctions')
-        response = sfn.start_execution(
-            stateMachineArn=os.environ['SFN_ARN'],
-            name=creator+'-'+event_name+'-'+detail['eventID'],
-            input=json.dumps(short_msg)
-        )
-
-        logger.info('Step Functions start execution: %s', response)
+    logger.debug('%s is creating cluster: %s',
+                 creator, detail['requestParameters']['clusterIdentifier'])
+
+    # https://docs.aws.amazon.com/general/latest/gr/aws-arns-and-namespaces.html
+    cluster_arn = extract_resource_ids(detail, spec)[0]
+
+    if tag_immediately(logger, spec, cluster_arn, creator):
+        return True
+
+    if pending_mode(settings) == 'sweeper':
+        defer(event_name, creator, cluster_arn, spec['tagging'])
+        logger.info('[ %s ] left to the sweeper', cluster_arn)
+        return True
+
+    short_msg = {
+        "EventName": event_name,
+        "Creator": creator,
+        "ResourceArn": cluster_arn,
+        "TagStatus": "pending",
+        "MaxRetries": int(os.environ['SFN_MAX_RETRIES']),
+        "Retries": 0,
+        "WaitSeconds": backoff_seconds(0)
+    }
+
+    if pending_mode(settings) == 'aggregate':
+        aggregate(cluster_arn, spec['tagging'], short_msg, settings['AGGREGATE_SFN_ARN'],
+                  AGGREGATED_TAGGINGS)
+        return True
+
+    sfn = Boto3Wrapper.get_client('stepfunctions')
+    response = sfn.start_execution(
+        stateMachineArn=settings['SFN_ARN'],
+        name=creator+'-'+event_name+'-'+detail['eventID'],
+        input=json.dumps(short_msg)
+    )
+
+    logger.debug('Step Functions start execution: %s', response)
 
     return True
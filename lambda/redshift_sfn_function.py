@@ -1,20 +1,23 @@
 """Redshift creation queue reader Lambda"""
 import logging
-from botocore.exceptions import ClientError
 from boto3wrapper import Boto3Wrapper
+from metrics import instrumented
+from utils import creator_tags, schedule_retry
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+@instrumented
 def redshift_sfn_lambda_handler(event, context):
     """
     Assigns Creator tag to a new Redshift cluster, if the resource has completed creation.
 
     @param event: The input event from the Step Function state machine.
     @param context: Provides information about the invocation, function, and execution environment.
-    @return: The event with possible update to 'Retries' and 'TagStatus'.
-    'TagStatus' of "complete" or "max retries reached" cause the state machine to exit.
+    @return: The event with possible update to 'Retries', 'TagStatus' and 'WaitSeconds', the
+    exponential backoff, with jitter, before the next attempt.
+    'TagStatus' of "complete", "failed" or "max retries reached" cause the state machine to exit.
     """
 
     if event['MaxRetries'] <= event['Retries']:
@@ -22,24 +25,18 @@ def redshift_sfn_lambda_handler(event, context):
         return event
 
     event['Retries'] = event['Retries'] + 1
-    logging.info('Tag attempt for event: %s', event)
+    logger.debug('Tag attempt for event: %s', event)
 
     redshift = Boto3Wrapper.get_client('redshift')
 
     try:
         redshift.create_tags(
             ResourceName=event['ResourceArn'],
-            Tags=[
-                {
-                    'Key': 'Creator',
-                    'Value': event['Creator']
-                }
-            ]
+            Tags=creator_tags(event['Creator'])
         )
-        logging.info('Cluster has been tagged with Creator: %s', event['Creator'])
-    except ClientError as error:  # fails when resource not ready
-        logger.warning(error)
-        return event
+        logger.info('Cluster has been tagged with Creator: %s', event['Creator'])
+    except redshift.exceptions.ClientError as error:  # fails when resource not ready
+        return schedule_retry(logger, event, error, event['Retries'])
 
     event['TagStatus'] = 'complete'
     return event
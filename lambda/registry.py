@@ -0,0 +1,448 @@
+"""
+Supported CloudTrail events, where to find their resource IDs and how to tag them.
+Adding support for a new event is a change to EVENT_REGISTRY.
+"""
+import os
+import random
+import time
+
+TAG_MAX_ATTEMPTS = 3
+
+# Wait ceiling, in seconds, before the second attempt at a chunk, doubled for each further
+# attempt up to TAG_BACKOFF_CAP, see retry_delay
+TAG_BACKOFF_BASE = float(os.environ.get('TAG_BACKOFF_BASE', '0.5'))
+TAG_BACKOFF_CAP = float(os.environ.get('TAG_BACKOFF_CAP', '5'))
+
+# Tagging error classes, see classify_client_error
+ERROR_NOT_READY = 'not ready'
+ERROR_THROTTLED = 'throttled'
+ERROR_FATAL = 'fatal'
+
+# Error codes returned while a resource is still being created, or not yet visible to the
+# tagging API, e.g. EC2 resources named by CreateTags right after RunInstances
+NOT_READY_ERROR_CODES = frozenset([
+    'InvalidInstanceID.NotFound',          # EC2
+    'InvalidVolume.NotFound',              # EC2
+    'InvalidNetworkInterfaceID.NotFound',  # EC2
+    'InvalidSnapshot.NotFound',            # EC2
+    'InvalidAMIID.NotFound',               # EC2
+    'DBInstanceNotFound',                  # RDS
+    'DBSnapshotNotFound',                  # RDS
+    'DBClusterSnapshotNotFoundFault',      # RDS
+    'DBParameterGroupNotFound',            # RDS
+    'DBSubnetGroupNotFoundFault',          # RDS
+    'OptionGroupNotFoundFault',            # RDS
+    'ResourceNotFoundException',           # DynamoDB
+    'ResourceInUseException',              # DynamoDB
+    'ClusterNotFoundFault',                # DAX
+    'InvalidClusterStateFault',            # DAX, Redshift
+    'ResourceNotFound',                    # Redshift
+    'ResourceNotFoundFault',               # Redshift
+    'InvalidClusterState',                 # Redshift
+])
+
+# Error codes of reading the tags of a resource that has none
+NO_TAGS_ERROR_CODES = frozenset([
+    'NoSuchTagSet',                # S3
+])
+
+# Error codes of throttled or transiently failing requests
+THROTTLED_ERROR_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'TooManyRequestsException',
+    'SlowDown',
+    'InternalError',
+    'InternalFailure',
+    'InternalServerError',
+    'ServiceUnavailable',
+])
+
+# Tagging operations, keyed by name:
+#   service  - the boto3 client that makes the call
+#   api      - the client method
+#   id_param - the request parameter naming the resource
+#   max_ids  - for APIs taking a list of resources, the per-request limit
+#   tag_set  - the tags are passed as Tagging={'TagSet': tags} rather than Tags=tags
+#   bucket   - the resource ID is "bucket/key", the bucket is passed as Bucket
+#   resource_types - the Resource Groups Tagging API resource types tagged with this API
+#   name_id  - the resource ID is the name part of the ARN rather than the ARN
+#   read_api - the call replaces the whole tag set of the resource, so the current tags are
+#              read first with this client method, taking id_param (and Bucket), and kept,
+#              see merge_tags
+TAGGING_APIS = {
+    'ec2': {'service': 'ec2', 'api': 'create_tags', 'id_param': 'Resources', 'max_ids': 1000,
+            'resource_types': ('ec2:instance', 'ec2:volume', 'ec2:snapshot', 'ec2:image',
+                               'ec2:network-interface'),
+            'name_id': True},
+    'rds': {'service': 'rds', 'api': 'add_tags_to_resource', 'id_param': 'ResourceName',
+            'resource_types': ('rds:db', 'rds:snapshot', 'rds:cluster-snapshot', 'rds:pg',
+                               'rds:subgrp', 'rds:og')},
+    's3_bucket': {'service': 's3', 'api': 'put_bucket_tagging', 'id_param': 'Bucket',
+                  'tag_set': True, 'resource_types': ('s3',), 'name_id': True,
+                  'read_api': 'get_bucket_tagging'},
+    's3_object': {'service': 's3', 'api': 'put_object_tagging', 'id_param': 'Key',
+                  'tag_set': True, 'bucket': True, 'read_api': 'get_object_tagging'},
+    'dynamodb': {'service': 'dynamodb', 'api': 'tag_resource', 'id_param': 'ResourceArn',
+                 'resource_types': ('dynamodb:table',)},
+    'dax': {'service': 'dax', 'api': 'tag_resource', 'id_param': 'ResourceName',
+            'resource_types': ('dax:cache',)},
+    'redshift': {'service': 'redshift', 'api': 'create_tags', 'id_param': 'ResourceName',
+                 'resource_types': ('redshift:cluster',)},
+}
+
+# Supported events creating their resource besides the Create* events, see is_creation_event
+CREATION_EVENTS = ('RunInstances', 'PutObject')
+
+# Supported events, keyed by (eventSource, eventName):
+#   path     - keys leading from the event detail to the resource ID, or to a list of items
+#   item_key - when path leads to a list of items, the resource ID key of each item
+#   format   - format string building the resource ID, e.g. an ARN, from the ID found at
+#              path (id), the event region (region), account (account) and request
+#              parameters (request)
+#   tagging  - the TAGGING_APIS entry used to tag the resource
+#   attachments - the IDs are EC2 instances, their volumes and network interfaces are
+#              tagged too
+#   deferred - the resource is tagged through a Step Functions state machine once created
+_INSTANCES_SET = {'item_key': 'instanceId', 'tagging': 'ec2', 'attachments': True}
+
+EVENT_REGISTRY = {
+    ('ec2.amazonaws.com', 'CreateVolume'): {
+        'path': ('responseElements', 'volumeId'), 'tagging': 'ec2'},
+    ('ec2.amazonaws.com', 'RunInstances'): dict(
+        _INSTANCES_SET, path=('responseElements', 'instancesSet', 'items')),
+    ('ec2.amazonaws.com', 'StartInstances'): dict(
+        _INSTANCES_SET, path=('responseElements', 'instancesSet', 'items')),
+    ('ec2.amazonaws.com', 'RebootInstances'): dict(
+        _INSTANCES_SET, path=('requestParameters', 'instancesSet', 'items')),
+    ('ec2.amazonaws.com', 'CreateImage'): {
+        'path': ('responseElements', 'imageId'), 'tagging': 'ec2'},
+    ('ec2.amazonaws.com', 'CreateSnapshot'): {
+        'path': ('responseElements', 'snapshotId'), 'tagging': 'ec2'},
+
+    ('rds.amazonaws.com', 'CreateDBInstance'): {
+        'path': ('responseElements', 'dBInstanceArn'), 'tagging': 'rds'},
+    ('rds.amazonaws.com', 'CreateDBSnapshot'): {
+        'path': ('responseElements', 'dBSnapshotArn'), 'tagging': 'rds'},
+    ('rds.amazonaws.com', 'CreateDBClusterSnapshot'): {
+        'path': ('responseElements', 'dBClusterSnapshotArn'), 'tagging': 'rds'},
+    ('rds.amazonaws.com', 'CreateDBParameterGroup'): {
+        'path': ('responseElements', 'dBParameterGroupArn'), 'tagging': 'rds'},
+    ('rds.amazonaws.com', 'CreateDBSubnetGroup'): {
+        'path': ('responseElements', 'dBSubnetGroupArn'), 'tagging': 'rds'},
+    ('rds.amazonaws.com', 'CreateOptionGroup'): {
+        'path': ('responseElements', 'optionGroupArn'), 'tagging': 'rds'},
+
+    ('s3.amazonaws.com', 'CreateBucket'): {
+        'path': ('requestParameters', 'bucketName'), 'tagging': 's3_bucket'},
+    ('s3.amazonaws.com', 'PutObject'): {
+        'path': ('requestParameters', 'key'), 'tagging': 's3_object',
+        'format': '{request[bucketName]}/{id}'},
+
+    ('dynamodb.amazonaws.com', 'CreateTable'): {
+        'path': ('responseElements', 'tableDescription', 'tableArn'), 'tagging': 'dynamodb',
+        'deferred': True},
+    ('dax.amazonaws.com', 'CreateCluster'): {
+        'path': ('responseElements', 'cluster', 'clusterArn'), 'tagging': 'dax',
+        'deferred': True},
+
+    ('redshift.amazonaws.com', 'CreateCluster'): {
+        'path': ('requestParameters', 'clusterIdentifier'), 'tagging': 'redshift',
+        'format': 'arn:aws:redshift:{region}:{account}:cluster:{id}', 'deferred': True},
+}
+
+
+def classify_client_error(error):
+    """
+    Classify a failed tagging call.
+
+    :param error: The botocore ClientError.
+    :return: ERROR_NOT_READY when the resource is still being created, ERROR_THROTTLED when
+    the request was throttled or failed transiently, otherwise ERROR_FATAL (access denied,
+    validation errors and the like), which retrying will not fix.
+    """
+    code = error.response.get('Error', {}).get('Code')
+    if code in NOT_READY_ERROR_CODES:
+        return ERROR_NOT_READY
+    if code in THROTTLED_ERROR_CODES:
+        return ERROR_THROTTLED
+    return ERROR_FATAL
+
+
+def plan_tag_chunks(resource_ids, chunk_size):
+    """
+    Plan the tagging requests for a list of resource IDs. Duplicate IDs are
+    dropped, keeping the first occurrence, and the remainder is split into
+    chunks no larger than the per-request limit of the tagging API.
+
+    :param resource_ids: The resource IDs to tag, possibly with duplicates.
+    :param chunk_size: The maximum number of resources allowed in one request.
+    :return: A list of resource ID lists, one per tagging request.
+    """
+    unique_ids = list(dict.fromkeys(resource_ids))
+    return [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+
+
+def retry_delay(error, attempts, max_attempts):
+    """
+    Decide whether a failed tagging attempt is retried, and when. Throttled and not ready
+    chunks wait with exponential backoff and full jitter, so retries of concurrent callers
+    spread out rather than adding to the throttling.
+
+    :param error: The ClientError raised by the attempt.
+    :param attempts: The number of attempts made so far.
+    :param max_attempts: The number of times a chunk is tried before giving up.
+    :return: The seconds to wait before the next attempt, None when the error is fatal or
+    the attempts are used up.
+    """
+    if attempts >= max_attempts or classify_client_error(error) == ERROR_FATAL:
+        return None
+    return random.uniform(0, min(TAG_BACKOFF_CAP, TAG_BACKOFF_BASE * 2 ** (attempts - 1)))
+
+
+def apply_tag_chunks(logger, tag_call, chunks, max_attempts):
+    """
+    Issue one tagging request per chunk. Chunks that fail are retried, on their own,
+    until they succeed or max_attempts is used up, after the wait of retry_delay. Fatal
+    errors are not retried.
+
+    :param logger: The application logger.
+    :param tag_call: Callable taking a list of resource IDs and tagging them.
+    :param chunks: The resource ID chunks, see plan_tag_chunks.
+    :param max_attempts: The number of times a chunk is tried before giving up.
+    :return: The per-chunk outcomes, a list of dicts with Resources, Status ('tagged' or
+    'failed'), Attempts and, for failed chunks, the last Error.
+    """
+    from botocore.exceptions import ClientError  # pylint: disable=import-outside-toplevel
+
+    outcomes = [{'Resources': chunk, 'Status': 'pending', 'Attempts': 0} for chunk in chunks]
+
+    pending = [(outcome, 0) for outcome in outcomes]
+    while pending:
+        failed = []
+        for outcome, delay in pending:
+            if delay:
+                time.sleep(delay)
+            outcome['Attempts'] = outcome['Attempts'] + 1
+            try:
+                tag_call(outcome['Resources'])
+                outcome['Status'] = 'tagged'
+                outcome.pop('Error', None)
+            except ClientError as error:
+                logger.warning('tagging attempt %d failed for %d resources: %s',
+                               outcome['Attempts'], len(outcome['Resources']), error)
+                outcome['Status'] = 'failed'
+                outcome['Error'] = str(error)
+                delay = retry_delay(error, outcome['Attempts'], max_attempts)
+                if delay is not None:
+                    failed.append((outcome, delay))
+        pending = failed
+
+    return outcomes
+
+
+def is_creation_event(detail):
+    """
+    Check whether a supported event created its resources, rather than naming existing
+    ones, e.g. StartInstances. The creator of a resource is the identity of its creation
+    event.
+
+    :param detail: The detail portion of the CloudTrail object.
+    :return: True for supported Create* events, RunInstances and PutObject.
+    """
+    name = detail.get('eventName', '')
+    return ((name.startswith('Create') or name in CREATION_EVENTS)
+            and lookup_event(detail) is not None)
+
+
+def lookup_event(detail):
+    """
+    Find the registry entry of a CloudTrail event.
+
+    :param detail: The detail portion of the CloudTrail object.
+    :return: The event spec, None if the event is not supported.
+    """
+    return EVENT_REGISTRY.get((detail.get('eventSource'), detail.get('eventName')))
+
+
+def extract_resource_ids(detail, spec):
+    """
+    Read the IDs of the resources named in the event, formatted when the spec has a format.
+
+    :param detail: The detail portion of the CloudTrail object.
+    :param spec: The event spec, see lookup_event.
+    :return: The list of resource IDs.
+    """
+    value = detail
+    for key in spec['path']:
+        value = value[key]
+
+    if 'item_key' in spec:
+        ids = [item[spec['item_key']] for item in value]
+    else:
+        ids = [value]
+
+    if 'format' in spec:
+        ids = [spec['format'].format(id=resource_id,
+                                     region=detail.get('awsRegion'),
+                                     account=detail['userIdentity'].get('accountId'),
+                                     request=detail.get('requestParameters') or {})
+               for resource_id in ids]
+    return ids
+
+
+def arn_resource_type(arn):
+    """
+    Get the Resource Groups Tagging API resource type of an ARN, e.g. "ec2:instance" for
+    arn:aws:ec2:us-east-1:123456789012:instance/i-1234 and "s3" for arn:aws:s3:::bucket.
+
+    :param arn: The resource ARN.
+    :return: The resource type.
+    """
+    _, _, service, _, _, resource = arn.split(':', 5)
+    for separator in (':', '/'):
+        if separator in resource:
+            return service + ':' + resource.split(separator, 1)[0]
+    return service
+
+
+def arn_resource_id(tagging, arn):
+    """
+    Get the ID a tagging API names a resource by.
+
+    :param tagging: The TAGGING_APIS entry name.
+    :param arn: The resource ARN.
+    :return: The ARN, or its name part for APIs with name_id, e.g. i-1234 or bucket.
+    """
+    if not TAGGING_APIS[tagging].get('name_id'):
+        return arn
+    return arn.split(':', 5)[5].split('/', 1)[-1]
+
+
+def arn_resource_name(arn):
+    """
+    Get the name of a resource from its ARN, e.g. "my-table" for
+    arn:aws:dynamodb:us-east-1:123456789012:table/my-table and "my-cluster" for
+    arn:aws:redshift:us-east-1:123456789012:cluster:my-cluster.
+
+    :param arn: The resource ARN.
+    :return: The last part of the resource of the ARN.
+    """
+    return arn.split(':', 5)[5].split('/')[-1].split(':')[-1]
+
+
+def tag_request(tagging, resource_ids, tags):
+    """
+    Build the keyword arguments of a tagging call.
+
+    :param tagging: The TAGGING_APIS entry name.
+    :param resource_ids: The resources tagged by the call, a single one unless the API
+    has max_ids.
+    :param tags: The tags.
+    :return: The (client method name, keyword arguments) pair.
+    """
+    api = TAGGING_APIS[tagging]
+    kwargs = {}
+    if 'max_ids' in api:
+        kwargs[api['id_param']] = list(resource_ids)
+    elif api.get('bucket'):
+        kwargs['Bucket'], kwargs[api['id_param']] = resource_ids[0].split('/', 1)
+    else:
+        kwargs[api['id_param']] = resource_ids[0]
+    if api.get('tag_set'):
+        kwargs['Tagging'] = {'TagSet': tags}
+    else:
+        kwargs['Tags'] = tags
+    return api['api'], kwargs
+
+
+def read_request(tagging, resource_id):
+    """
+    Build the keyword arguments of the call reading the current tags of a resource.
+
+    :param tagging: The TAGGING_APIS entry name, of an API with read_api.
+    :param resource_id: The resource.
+    :return: The (client method name, keyword arguments) pair.
+    """
+    api = TAGGING_APIS[tagging]
+    if api.get('bucket'):
+        bucket, key = resource_id.split('/', 1)
+        return api['read_api'], {'Bucket': bucket, api['id_param']: key}
+    return api['read_api'], {api['id_param']: resource_id}
+
+
+def merge_tags(current, tags):
+    """
+    Merge tags into the current tag set of a resource, for APIs replacing the whole set.
+
+    :param current: The current tags.
+    :param tags: The tags to set.
+    :return: The current tags whose keys are not set by tags, then tags.
+    """
+    keys = {tag['Key'] for tag in tags}
+    return [tag for tag in current if tag['Key'] not in keys] + list(tags)
+
+
+def read_tags(client, tagging, resource_id):
+    """
+    Read the current tags of a resource, for APIs with read_api.
+
+    :param client: The client of the tagging API service.
+    :param tagging: The TAGGING_APIS entry name.
+    :param resource_id: The resource.
+    :return: The tags, empty when the resource has none.
+    """
+    api, kwargs = read_request(tagging, resource_id)
+    try:
+        return getattr(client, api)(**kwargs)['TagSet']
+    except client.exceptions.ClientError as error:
+        if error.response.get('Error', {}).get('Code') in NO_TAGS_ERROR_CODES:
+            return []
+        raise
+
+
+def try_tag(client, tagging, resource_id, tags):
+    """
+    Make a single attempt at tagging a resource, without retries.
+
+    :param client: The client of the tagging API service.
+    :param tagging: The TAGGING_APIS entry name.
+    :param resource_id: The resource to tag.
+    :param tags: The tags.
+    :return: None if the resource was tagged, otherwise the ClientError raised by the call.
+    """
+    api, kwargs = tag_request(tagging, [resource_id], tags)
+    try:
+        getattr(client, api)(**kwargs)
+    except client.exceptions.ClientError as error:
+        return error
+    return None
+
+
+def tag_resources(logger, client, tagging, resource_ids, tags):
+    """
+    Tag resources with one call per resource, or, for APIs taking a list of resources,
+    one call per chunk of up to max_ids unique resources. Failed calls are retried alone,
+    up to TAG_MAX_ATTEMPTS times. For APIs replacing the whole tag set, the tags are merged
+    into the current tags of the resource, see read_api.
+
+    :param logger: The application logger.
+    :param client: The client of the tagging API service.
+    :param tagging: The TAGGING_APIS entry name.
+    :param resource_ids: The resources to tag, duplicates are ignored.
+    :param tags: The tags.
+    :return: The per-call outcomes, see apply_tag_chunks.
+    """
+    chunks = plan_tag_chunks(resource_ids, TAGGING_APIS[tagging].get('max_ids', 1))
+
+    def call(chunk):
+        chunk_tags = tags
+        if 'read_api' in TAGGING_APIS[tagging]:
+            chunk_tags = merge_tags(read_tags(client, tagging, chunk[0]), tags)
+        api, kwargs = tag_request(tagging, chunk, chunk_tags)
+        getattr(client, api)(**kwargs)
+
+    return apply_tag_chunks(logger, call, chunks, TAG_MAX_ATTEMPTS)
@@ -0,0 +1,118 @@
+"""
+Single entry point for all services, an optional alternative to one Lambda per service.
+Events are routed to the existing handlers:
+    o EventBridge events - by detail.eventSource, or by source, e.g. "aws.ec2"
+    o SQS batches - to batch_function.sqs_batch_handler
+    o State machine payloads - by shape, MaxAttempts for DynamoDB and MaxRetries for
+      Redshift
+    o {"Flush": true} events - to the DynamoDB and Redshift handlers, see pending.py
+
+Handler modules are imported on first use, so a container only loads the services it
+receives events for, and all of them share the warm Boto3Wrapper cache of the container.
+"""
+import importlib
+import logging
+import os
+from metrics import instrumented
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Handlers as (module, function), keyed by route
+ROUTES = {
+    'ec2.amazonaws.com': ('ec2_function', 'ec2_lambda_handler'),
+    'rds.amazonaws.com': ('rds_function', 'rds_lambda_handler'),
+    's3.amazonaws.com': ('s3_function', 's3_lambda_handler'),
+    'dynamodb.amazonaws.com': ('dynamodb_cloudwatch_function', 'dynamodb_cloudwatch_handler'),
+    'dax.amazonaws.com': ('dynamodb_cloudwatch_function', 'dynamodb_cloudwatch_handler'),
+    'redshift.amazonaws.com': ('redshift_function', 'redshift_lambda_handler'),
+    'sqs': ('batch_function', 'sqs_batch_handler'),
+    'sfn.MaxAttempts': ('dynamodb_sfn_function', 'dynamodb_sfn_handler'),
+    'sfn.MaxRetries': ('redshift_sfn_function', 'redshift_sfn_lambda_handler'),
+}
+
+# The DynamoDB and Redshift handlers both read these settings, with one function each route
+# gets them from its own variables, e.g. SFN_ARN from DYNAMODB_SFN_ARN. They are passed to
+# the handler, the environment is shared by all routes of a warm container.
+ROUTE_SETTINGS = ('SFN_ARN', 'AGGREGATE_SFN_ARN', 'PENDING_MODE')
+
+# Prefix of the variables of the route settings, keyed by route
+ROUTE_PREFIXES = {
+    'dynamodb.amazonaws.com': 'DYNAMODB_',
+    'dax.amazonaws.com': 'DYNAMODB_',
+    'redshift.amazonaws.com': 'REDSHIFT_',
+}
+
+# Route of {"Flush": true} events, sent to the handler of each of FLUSH_ROUTES
+FLUSH = 'flush'
+FLUSH_ROUTES = ('dynamodb.amazonaws.com', 'redshift.amazonaws.com')
+
+# Imported handlers, keyed by (module, function)
+_HANDLERS = {}
+
+
+def route(event):
+    """
+    :param event: The Lambda event.
+    :return: The ROUTES key of the event, FLUSH for a flush event, None if no handler
+    takes it.
+    """
+    if event.get('Flush'):
+        return FLUSH
+    if 'Records' in event:
+        return 'sqs'
+    if 'detail' in event:
+        source = event['detail'].get('eventSource')
+        if source is None and event.get('source', '').startswith('aws.'):
+            source = event['source'][len('aws.'):] + '.amazonaws.com'
+        return source if source in ROUTES else None
+    for shape in ('MaxAttempts', 'MaxRetries'):
+        if shape in event:
+            return 'sfn.' + shape
+    return None
+
+
+def load_handler(key):
+    """
+    Import the handler of a route on first use.
+    :param key: The ROUTES key.
+    :return: The handler function.
+    """
+    target = ROUTES[key]
+    if target not in _HANDLERS:
+        _HANDLERS[target] = getattr(importlib.import_module(target[0]), target[1])
+    return _HANDLERS[target]
+
+
+def route_settings(key):
+    """
+    :param key: The ROUTES key.
+    :return: The settings of the route set in the environment, a dict.
+    """
+    prefix = ROUTE_PREFIXES[key]
+    return {name: os.environ[prefix + name] for name in ROUTE_SETTINGS
+            if prefix + name in os.environ}
+
+
+@instrumented
+def router_handler(event, context):
+    """
+    Route an event to the handler of its service.
+
+    :param event: An EventBridge event, an SQS batch or a state machine payload.
+    :param context: This object provides methods and properties that provide information
+    about the invocation, function, and execution environment.
+    :return: The response of the handler, False if the event has no route.
+    """
+    key = route(event)
+    if key is None:
+        logger.warning('No route for event: %s', sorted(event))
+        return False
+
+    if key == FLUSH:
+        for flushed in FLUSH_ROUTES:
+            load_handler(flushed)(event, context, route_settings(flushed))
+        return True
+    if key in ROUTE_PREFIXES:
+        return load_handler(key)(event, context, route_settings(key))
+    return load_handler(key)(event, context)
@@ -1,8 +1,12 @@
 """S3 tagging Lambda"""
+import functools
+import json
 import logging
-from botocore.exceptions import ClientError
+import os
 from boto3wrapper import Boto3Wrapper
-from utils import is_err_detail, get_creator, load_creator_tag
+from metrics import instrumented
+from registry import extract_resource_ids, tag_resources, merge_tags
+from utils import preflight, creator_tags, TTLCache, CREATOR_TAG_NAME, CREATOR_TAGS_FAILURE_TTL
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -11,7 +15,18 @@ logger.setLevel(logging.INFO)
 BUCKET_EVENTS = ['CreateBucket']
 OBJECT_EVENTS = ['PutObject']
 
+# Object tagging modes, set with the S3_OBJECT_TAGGING_MODE environment variable:
+#   standard   - put_object_tagging replaces the object tag set with the Creator tag
+#   throughput - see tag_objects
+THROUGHPUT_MODE = 'throughput'
 
+# Bucket Creator tags looked up in throughput mode, kept across warm invocations
+BUCKET_TAG_CACHE = TTLCache(int(os.environ.get('S3_BUCKET_TAG_CACHE_SIZE', '256')),
+                            int(os.environ.get('S3_BUCKET_TAG_CACHE_TTL', '300')))
+_NOT_CACHED = object()
+
+
+@instrumented
 def s3_lambda_handler(event, context):
     """
     Assign owner tag to new buckets and objects added to buckets. Object creation event
@@ -30,48 +45,166 @@ def s3_lambda_handler(event, context):
     detail = event['detail']
     event_name = detail['eventName']
     bucket_name = detail['requestParameters']['bucketName']
-    creator = get_creator(event)
 
-    logger.info('email: %s', creator)
-    logger.info('bucket name: %s', bucket_name)
+    creator, spec = preflight(logger, event, expect_resp_elems=False)
+    if spec is None:
+        return False
+
+    logger.debug('email: %s', creator)
+    logger.debug('bucket name: %s', bucket_name)
 
     # gets an S3.Client object
     s3 = Boto3Wrapper.get_client('s3')
 
-    if is_err_detail(logger, detail, expect_resp_elems=False):
-        return False
-
-    tag_set = {
-        'TagSet': [load_creator_tag(creator)]
-    }
+    if event_name in OBJECT_EVENTS and throughput_mode():
+        outcomes = tag_objects(s3, coalesce_object_events([(creator, detail)]))
+        return all(status != 'failed' for status in outcomes.values())
 
     if event_name in BUCKET_EVENTS:
-        logger.info('adding bucket Creator tag: [ %s ] to bucket [ %s ]',
-                    creator, bucket_name)
-        try:
-            logger.info('tagging bucket')
-            s3.put_bucket_tagging(
-                Bucket=bucket_name,
-                Tagging=tag_set
-            )
-        except ClientError as error:
-            logger.error(error)
-            return False
+        logger.debug('adding bucket Creator tag: [ %s ] to bucket [ %s ]',
+                     creator, bucket_name)
     elif event_name in OBJECT_EVENTS:
-        object_key = detail['requestParameters']['key']
-        logger.info('adding object Creator tag: [ %s ] to bucket [ %s ] object [ %s ]',
-                    creator, bucket_name, object_key)
-        try:
-            s3.put_object_tagging(
-                Bucket=bucket_name,
-                Key=object_key,
-                Tagging=tag_set
-            )
-        except ClientError as error:
-            logger.error(error)
-            return False
-    else:
-        logger.warning('Not supported action: %s', event_name)
-        return False
+        logger.debug('adding object Creator tag: [ %s ] to bucket [ %s ] object [ %s ]',
+                     creator, bucket_name, detail['requestParameters']['key'])
+
+    outcomes = tag_resources(logger, s3, spec['tagging'], extract_resource_ids(detail, spec),
+                             creator_tags(creator))
+
+    return all(outcome['Status'] == 'tagged' for outcome in outcomes)
+
+
+def throughput_mode():
+    """
+    :return: True when S3_OBJECT_TAGGING_MODE is "throughput".
+    """
+    return os.environ.get('S3_OBJECT_TAGGING_MODE', 'standard').lower() == THROUGHPUT_MODE
+
+
+@functools.lru_cache(maxsize=8)
+def compile_prefix_rules(raw_rules):
+    """
+    Compile the per-bucket object key prefix rules of the S3_OBJECT_PREFIX_RULES environment
+    variable, e.g. {"my-bucket": {"include": ["uploads/"], "exclude": ["uploads/tmp/"]}}.
+    Rules are compiled once per distinct value.
+
+    :param raw_rules: The rules, a JSON string.
+    :return: The (include prefixes, exclude prefixes) tuple pairs, keyed by bucket.
+    """
+    return {bucket: (tuple(rules.get('include', ())), tuple(rules.get('exclude', ())))
+            for bucket, rules in json.loads(raw_rules).items()}
+
+
+def object_selected(bucket, key):
+    """
+    Check an object key against the prefix rules of its bucket. Buckets without rules
+    have every object selected, an empty include list includes every key.
+
+    :param bucket: The bucket name.
+    :param key: The object key.
+    :return: True if the object should be tagged.
+    """
+    rules = compile_prefix_rules(os.environ.get('S3_OBJECT_PREFIX_RULES', '{}')).get(bucket)
+    if rules is None:
+        return True
+    include, exclude = rules
+    return (not include or key.startswith(include)) and not key.startswith(exclude)
+
 
-    return True
+def object_key(detail):
+    """
+    :param detail: The detail portion of a PutObject CloudTrail object.
+    :return: The (bucket, key) pair of the object.
+    """
+    return detail['requestParameters']['bucketName'], detail['requestParameters']['key']
+
+
+def coalesce_object_events(events):
+    """
+    Coalesce PutObject events for the same object, the creator of the latest event wins.
+
+    :param events: The (creator, event detail) pairs, oldest first.
+    :return: The creators, keyed by (bucket, key).
+    """
+    objects = {}
+    for creator, detail in events:
+        objects[object_key(detail)] = creator
+    return objects
+
+
+def bucket_creator(s3, bucket):
+    """
+    Get the Creator tag of a bucket, cached in BUCKET_TAG_CACHE. When the tags cannot be
+    read, e.g. AccessDenied or throttling, None is cached for CREATOR_TAGS_FAILURE_TTL
+    seconds, so the bucket is not looked up on every event.
+
+    :param s3: The S3 client.
+    :param bucket: The bucket name.
+    :return: The Creator tag value, None if the bucket has none or its tags cannot be read.
+    """
+    creator = BUCKET_TAG_CACHE.get(bucket, _NOT_CACHED)
+    if creator is not _NOT_CACHED:
+        return creator
+
+    try:
+        tag_set = s3.get_bucket_tagging(Bucket=bucket)['TagSet']
+    except s3.exceptions.ClientError as error:
+        if error.response.get('Error', {}).get('Code') != 'NoSuchTagSet':
+            logger.warning('Cannot read bucket [ %s ] tags: %s', bucket, error)
+            BUCKET_TAG_CACHE.put(bucket, None, CREATOR_TAGS_FAILURE_TTL)
+            return None
+        tag_set = []
+
+    creator = next((tag['Value'] for tag in tag_set if tag['Key'] == CREATOR_TAG_NAME), None)
+    BUCKET_TAG_CACHE.put(bucket, creator)
+    return creator
+
+
+def merge_creator_tag(tag_set, creator):
+    """
+    Add or update the Creator tag and the tags derived from the creator in an object tag
+    set, keeping the other tags.
+
+    :param tag_set: The current object tag set.
+    :param creator: The Creator tag value.
+    :return: The new tag set, None if the tag set already has these tags.
+    """
+    tags = creator_tags(creator)
+    if all(tag in tag_set for tag in tags):
+        return None
+    return merge_tags(tag_set, tags)
+
+
+def tag_objects(s3, objects):
+    """
+    Tag objects in throughput mode. Per object:
+        o objects excluded by the bucket prefix rules are not tagged
+        o objects whose creator matches the bucket Creator tag are not tagged
+        o otherwise the object tag set is read and written back with the Creator tag
+          added, keeping the tags set by the uploader
+
+    :param s3: The S3 client.
+    :param objects: The creators, keyed by (bucket, key), see coalesce_object_events.
+    :return: The status of each object, keyed by (bucket, key): 'excluded', 'skipped',
+    'tagged' or 'failed'.
+    """
+    outcomes = {}
+    for (bucket, key), creator in objects.items():
+        if not object_selected(bucket, key):
+            outcomes[(bucket, key)] = 'excluded'
+        elif bucket_creator(s3, bucket) == creator:
+            outcomes[(bucket, key)] = 'skipped'
+        else:
+            try:
+                tag_set = s3.get_object_tagging(Bucket=bucket, Key=key)['TagSet']
+                merged = merge_creator_tag(tag_set, creator)
+                if merged is None:
+                    outcomes[(bucket, key)] = 'skipped'
+                else:
+                    s3.put_object_tagging(Bucket=bucket, Key=key, Tagging={'TagSet': merged})
+                    outcomes[(bucket, key)] = 'tagged'
+            except s3.exceptions.ClientError as error:
+                logger.error('Cannot tag object [ %s/%s ]: %s', bucket, key, error)
+                outcomes[(bucket, key)] = 'failed'
+        logger.debug('object [ %s/%s ] Creator [ %s ]: %s',
+                     bucket, key, creator, outcomes[(bucket, key)])
+    return outcomes
@@ -0,0 +1,138 @@
+"""
+Scheduled sweeper of the pending store, see pending.py. Each invocation checks the readiness
+of all pending resources, rather than one state machine execution and tag attempt per
+resource:
+    o DynamoDB tables - DescribeTable per pending table, TableStatus "ACTIVE"
+    o DAX clusters    - one paginated DescribeClusters, Status "available"
+    o Redshift        - one paginated DescribeClusters, ClusterStatus "available"
+Ready resources are tagged in the same pass. Resources still being created stay pending
+until their item is PENDING_MAX_AGE seconds old, then it expires, whatever the schedule.
+"""
+import logging
+import os
+import time
+from boto3wrapper import Boto3Wrapper
+from metrics import instrumented
+from pending import get_store
+from registry import TAGGING_APIS, ERROR_FATAL, arn_resource_name, classify_client_error
+from registry import try_tag
+from utils import creator_tags
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Seconds a resource may stay pending, about the longest the state machines wait: 20 to 30
+# attempts with a backoff capped at SFN_BACKOFF_CAP (300) seconds
+PENDING_MAX_AGE = int(os.environ.get('PENDING_MAX_AGE', '7200'))
+
+
+def _dynamodb_ready(client, names):
+    # ListTables also lists tables still CREATING, only DescribeTable has the status
+    ready = set()
+    for name in names:
+        try:
+            status = client.describe_table(TableName=name)['Table']['TableStatus']
+        except client.exceptions.ClientError as error:
+            logger.info('DescribeTable [ %s ] failed: %s', name, error)
+            continue
+        if status == 'ACTIVE':
+            ready.add(name)
+    return ready
+
+
+def _dax_ready(client, _names):
+    paginator = client.get_paginator('describe_clusters')
+    return {cluster['ClusterName'] for page in paginator.paginate()
+            for cluster in page['Clusters'] if cluster['Status'] == 'available'}
+
+
+def _redshift_ready(client, _names):
+    paginator = client.get_paginator('describe_clusters')
+    return {cluster['ClusterIdentifier'] for page in paginator.paginate()
+            for cluster in page['Clusters'] if cluster['ClusterStatus'] == 'available'}
+
+
+# Readiness checks, keyed by TAGGING_APIS entry name, each given the names of the pending
+# resources of the service and returning the names of its taggable resources
+READINESS = {
+    'dynamodb': _dynamodb_ready,
+    'dax': _dax_ready,
+    'redshift': _redshift_ready,
+}
+
+
+def ready_resources(items):
+    """
+    List the taggable resources of services with pending items.
+
+    :param items: The pending items.
+    :return: The resource names, keyed by TAGGING_APIS entry name.
+    """
+    names = {}
+    for item in items:
+        names.setdefault(item['Tagging'], []).append(arn_resource_name(item['ResourceArn']))
+    return {tagging: READINESS[tagging](
+        Boto3Wrapper.get_client(TAGGING_APIS[tagging]['service']), tagging_names)
+            for tagging, tagging_names in names.items()}
+
+
+def sweep(store, now=None):
+    """
+    Tag the ready resources of the pending store and expire the items older than
+    PENDING_MAX_AGE. Items are only written when deleted, a pending item costs no write per
+    sweep. The buffered tasks of aggregate mode are left to pending.flush.
+
+    :param store: The pending store.
+    :param now: The current epoch seconds, defaults to the current time.
+    :return: The number of items still pending, tagged, failed and expired, a dict.
+    """
+    # Aggregate mode tasks share the store, they are started by pending.flush
+    items = [item for item in store.items() if 'Task' not in item]
+    now = time.time() if now is None else now
+    ready = ready_resources(items)
+    counts = {'pending': 0, 'tagged': 0, 'failed': 0, 'expired': 0}
+    done = []
+    for item in items:
+        arn = item['ResourceArn']
+        error = None
+        if arn_resource_name(arn) in ready[item['Tagging']]:
+            tagging = item['Tagging']
+            client = Boto3Wrapper.get_client(TAGGING_APIS[tagging]['service'])
+            error = try_tag(client, tagging, arn, creator_tags(item['Creator']))
+            if error is None:
+                logger.info('Tagged [ %s ] with Creator [ %s ]', arn, item['Creator'])
+                counts['tagged'] += 1
+                done.append(arn)
+                continue
+            if classify_client_error(error) == ERROR_FATAL:
+                logger.warning('Tagging [ %s ] failed: %s', arn, error)
+                counts['failed'] += 1
+                done.append(arn)
+                continue
+
+        if now - item['EnqueuedAt'] >= PENDING_MAX_AGE:
+            logger.warning('[ %s ] not tagged after %d seconds: %s', arn,
+                           now - item['EnqueuedAt'], error or 'not ready')
+            counts['expired'] += 1
+            done.append(arn)
+        else:
+            counts['pending'] += 1
+
+    if done:
+        store.delete(done)
+    return counts
+
+
+@instrumented
+def sweeper_handler(_event, context):
+    """
+    Lambda function run on a schedule, sweeps the pending store.
+
+    :param _event: The scheduled event, not used.
+    :param context: This object provides methods and properties that provide information
+    about the invocation, function, and execution environment.
+    :return: The counts of the sweep, see sweep.
+    """
+    counts = sweep(get_store())
+    logger.info('Sweep: %s', counts)
+    return counts
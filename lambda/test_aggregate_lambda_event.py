@@ -0,0 +1,122 @@
+"""Aggregate mode unit tests, one Map state machine execution per window."""
+import unittest
+import os.path
+import json
+import time
+
+from unittest.mock import patch
+from dynamodb_cloudwatch_function import dynamodb_cloudwatch_handler
+from redshift_function import redshift_lambda_handler
+from pending import InMemoryPendingStore, set_store, get_store, flush, AGGREGATE_WINDOW
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+
+MAP_ARN = 'arn:aws:states:us-east-1:292909299215:stateMachine:AutoTag-DynamoDB-Map-SFN'
+ENVIRONMENT = {
+    'PENDING_MODE': 'aggregate',
+    'AGGREGATE_SFN_ARN': MAP_ARN,
+    'SFN_MAX_ATTEMPTS': '20',
+    'SFN_MAX_RETRIES': '30',
+}
+
+
+def load_event(file_name):
+    """
+    @param file_name: The test event data file name.
+    @return: The EventBridge event.
+    """
+    with open('../test_event_data/' + file_name) as event_data:
+        return {'account': ACCOUNT, 'region': REGION, 'detail': json.load(event_data)}
+
+
+class TestAggregate(unittest.TestCase):
+    """
+    Test buffering tasks and starting them with one execution.
+    """
+    def setUp(self):
+        set_store(InMemoryPendingStore())
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/aggregate')
+        self.calls = attach_local_aws_response(path)
+        patcher = patch.dict(os.environ, ENVIRONMENT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_window(self):
+        """
+        Verify tasks are buffered until the window of the oldest is over, then started by
+        one execution with a Map item per resource.
+        """
+        self.assertEqual(dynamodb_cloudwatch_handler(load_event('dynamodb_CreateTable.json'), ''),
+                         True)
+        self.assertEqual(self.calls.count(), 0)
+        self.assertEqual(len(get_store().items()), 1)
+
+        with patch('pending.time.time', return_value=time.time() + AGGREGATE_WINDOW):
+            self.assertEqual(dynamodb_cloudwatch_handler(
+                load_event('dynamodb_DAX_CreateCluster.json'), ''), True)
+        params = self.calls.params('StartExecution')
+        self.assertEqual(len(params), 1)
+        self.assertEqual(params[0]['stateMachineArn'], MAP_ARN)
+        items = json.loads(params[0]['input'])['Items']
+        self.assertEqual([(item['EventName'], item['TagStatus'], item['MaxAttempts'])
+                          for item in items],
+                         [('CreateTable', 'pending', 20), ('CreateCluster', 'pending', 20)])
+        self.assertEqual(get_store().items(), [])
+
+    def test_flush_event(self):
+        """
+        Verify a flush event starts the buffered tasks of its handler only, in executions of
+        up to AGGREGATE_MAX_ITEMS items.
+        """
+        for file_name in ('dynamodb_CreateTable.json', 'dynamodb_DAX_CreateCluster.json',
+                          'redshift_CreateCluster.json'):
+            handler = dynamodb_cloudwatch_handler if 'dynamodb' in file_name \
+                else redshift_lambda_handler
+            self.assertEqual(handler(load_event(file_name), ''), True)
+        self.assertEqual(self.calls.count(), 0)
+
+        with patch('pending.AGGREGATE_MAX_ITEMS', 1), \
+                patch('pending.time.time', return_value=time.time() + AGGREGATE_WINDOW):
+            self.assertEqual(dynamodb_cloudwatch_handler({'Flush': True}, ''), True)
+        self.assertEqual(self.calls.count('StartExecution'), 2)
+        self.assertEqual([item['Tagging'] for item in get_store().items()], ['redshift'])
+
+    def test_flush_ignored(self):
+        """
+        Verify flush events start nothing outside aggregate mode.
+        """
+        with patch.dict(os.environ, {'PENDING_MODE': 'sfn'}):
+            self.assertEqual(redshift_lambda_handler({'Flush': True}, ''), True)
+        self.assertEqual(self.calls.count(), 0)
+
+    def test_flush_names(self):
+        """
+        Verify the execution name is derived from the items, so flushing the same items
+        twice names the same execution.
+        """
+        get_store().put({'ResourceArn': 'arn:aws:redshift:us-east-1:292909299215:cluster:a',
+                         'Tagging': 'redshift', 'Task': {}, 'EnqueuedAt': 1})
+        item = get_store().items()[0]
+        flush(MAP_ARN, ('redshift',), now=100)
+        get_store().put(item)
+        flush(MAP_ARN, ('redshift',), now=200)
+        names = [params['name'] for params in self.calls.params('StartExecution')]
+        self.assertEqual(len(names), 2)
+        self.assertEqual(names[0], names[1])
+
+    def test_flush_lease(self):
+        """
+        Verify a flush holding the lease of the state machine keeps other flushes from
+        reading the store until the lease ends.
+        """
+        get_store().put({'ResourceArn': 'arn:aws:redshift:us-east-1:292909299215:cluster:a',
+                         'Tagging': 'redshift', 'Task': {}, 'EnqueuedAt': 100})
+        with patch.object(get_store(), 'items', wraps=get_store().items) as items_mock:
+            self.assertEqual(flush(MAP_ARN, ('redshift',), AGGREGATE_WINDOW, now=100), [])
+            self.assertEqual(flush(MAP_ARN, ('redshift',), now=100 + AGGREGATE_WINDOW - 1), [])
+            self.assertEqual(items_mock.call_count, 1)
+            self.assertEqual(len(flush(MAP_ARN, ('redshift',), now=100 + AGGREGATE_WINDOW)), 1)
+        self.assertEqual(get_store().items(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""Async tagging unit tests, against a local HTTP stand-in for the EC2 and RDS APIs."""
+import unittest
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, patch
+from urllib.parse import parse_qs
+from async_tagging import aiobotocore_available, tag_requests
+from registry import TAG_BACKOFF_BASE
+
+CREATE_TAGS_RESPONSE = b'''<CreateTagsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">
+<requestId>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</requestId><return>true</return>
+</CreateTagsResponse>'''
+
+ADD_TAGS_RESPONSE = b'''<AddTagsToResourceResponse xmlns="http://rds.amazonaws.com/doc/2014-10-31/">
+<ResponseMetadata><RequestId>b194d9ca-a664-11e4-b688-194eaf8658fa</RequestId></ResponseMetadata>
+</AddTagsToResourceResponse>'''
+
+UNAUTHORIZED_RESPONSE = b'''<Response><Errors><Error><Code>UnauthorizedOperation</Code>
+<Message>You are not authorized to perform this operation.</Message></Error></Errors>
+<RequestID>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</RequestID></Response>'''
+
+NOT_FOUND_RESPONSE = b'''<Response><Errors><Error><Code>InvalidVolume.NotFound</Code>
+<Message>The volume 'vol-new' does not exist.</Message></Error></Errors>
+<RequestID>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</RequestID></Response>'''
+
+# Resource the stand-in refuses to tag
+DENIED_ID = 'vol-denied'
+
+# Resource the stand-in reports as not found, i.e. not ready, on its first request
+NEW_ID = 'vol-new'
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answer CreateTags and AddTagsToResource after a short delay, recording the requests
+    and the highest number of requests in flight.
+    """
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer a query API request."""
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        body = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        time.sleep(0.05)
+        with server.lock:
+            server.in_flight -= 1
+            server.requests.append(body)
+
+        status, response = 200, ADD_TAGS_RESPONSE
+        if body['Action'] == ['CreateTags']:
+            response = CREATE_TAGS_RESPONSE
+            if DENIED_ID in body.get('ResourceId.1', []):
+                status, response = 400, UNAUTHORIZED_RESPONSE
+            elif NEW_ID in body.get('ResourceId.1', []) and not server.not_ready:
+                server.not_ready = True
+                status, response = 400, NOT_FOUND_RESPONSE
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@unittest.skipUnless(aiobotocore_available(), 'aiobotocore is not installed')
+class TestAsyncTagging(unittest.TestCase):
+    """
+    Test concurrent tagging with aiobotocore.
+    """
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        self.server.lock = threading.Lock()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.requests = []
+        self.server.not_ready = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint_url = f'http://127.0.0.1:{self.server.server_port}'
+        self.credentials = patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing',
+                                                   'AWS_SECRET_ACCESS_KEY': 'testing'})
+        self.credentials.start()
+
+    def tearDown(self):
+        self.credentials.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_tag_requests(self):
+        """
+        Verify requests of several services are tagged concurrently, with at most
+        max_in_flight calls at a time.
+        """
+        tags = [{'Key': 'Creator', 'Value': 'Admin'}]
+        requests = [{'Tagging': 'rds', 'Tags': tags, 'Resources': [
+            f'arn:aws:rds:us-east-1:292909299215:db:autotag-{index}' for index in range(8)]},
+                    {'Tagging': 'ec2', 'Tags': tags, 'Resources': ['i-1', 'vol-1', 'i-1']}]
+        outcomes = tag_requests(requests, max_in_flight=4, endpoint_url=self.endpoint_url)
+
+        self.assertEqual([len(request_outcomes) for request_outcomes in outcomes], [8, 1])
+        self.assertEqual(outcomes[1][0]['Resources'], ['i-1', 'vol-1'])
+        self.assertTrue(all(outcome['Status'] == 'tagged'
+                            for request_outcomes in outcomes for outcome in request_outcomes))
+        self.assertEqual(len(self.server.requests), 9)
+        self.assertEqual(self.server.max_in_flight, 4)
+
+    def test_fatal_error_not_retried(self):
+        """
+        Verify a chunk failing with a fatal error is reported after one attempt.
+        """
+        requests = [{'Tagging': 'ec2', 'Tags': [{'Key': 'Creator', 'Value': 'Admin'}],
+                     'Resources': [DENIED_ID]}]
+        outcomes = tag_requests(requests, endpoint_url=self.endpoint_url)
+        self.assertEqual(outcomes[0][0]['Status'], 'failed')
+        self.assertEqual(outcomes[0][0]['Attempts'], 1)
+        self.assertIn('UnauthorizedOperation', outcomes[0][0]['Error'])
+
+
+    def test_not_ready_chunk_backs_off(self):
+        """
+        Verify a chunk not ready to be tagged is retried after the backoff of
+        registry.retry_delay.
+        """
+        requests = [{'Tagging': 'ec2', 'Tags': [{'Key': 'Creator', 'Value': 'Admin'}],
+                     'Resources': [NEW_ID]}]
+        with patch('async_tagging.asyncio.sleep', new_callable=AsyncMock) as sleep_mock:
+            outcomes = tag_requests(requests, endpoint_url=self.endpoint_url)
+        self.assertEqual(outcomes[0][0]['Status'], 'tagged')
+        self.assertEqual(outcomes[0][0]['Attempts'], 2)
+        sleep_mock.assert_awaited_once()
+        self.assertLessEqual(sleep_mock.await_args[0][0], TAG_BACKOFF_BASE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""CloudTrail log backfill unit tests."""
+import unittest
+import os.path
+import gzip
+import json
+import shutil
+import tempfile
+
+from backfill import backfill
+from test_utils import attach_local_aws_response
+
+EMPTY_SUMMARY = {'files': 0, 'groups': 0, 'tagged': 0, 'missing': 0, 'failed': 0}
+
+
+def load_detail(file_name):
+    """
+    Load a test event detail, the same as a CloudTrail log record.
+    @param file_name: The test event data file name.
+    @return: The record.
+    """
+    with open('../test_event_data/' + file_name) as event_data:
+        return json.load(event_data)
+
+
+class TestBackfill(unittest.TestCase):
+    """
+    Test the CloudTrail log backfill.
+    """
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        error = dict(load_detail('ec2_CreateVolume.json'), errorCode='Client.UnauthorizedOperation')
+        records = [
+            load_detail('ec2_CreateVolume.json'),
+            load_detail('rds_CreateDBInstance.json'),
+            load_detail('ec2_StartInstances.json'),
+            error
+        ]
+        self.write_log(records)
+        self.checkpoint = os.path.join(self.log_dir, 'checkpoint')
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/sqs_batch')
+        attach_local_aws_response(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir)
+
+    def write_log(self, records, name='trail_20191211T1755Z.json.gz'):
+        """
+        Write a CloudTrail log file to the log directory.
+        @param records: The CloudTrail records.
+        @param name: The log file name.
+        """
+        day_dir = os.path.join(self.log_dir, 'CloudTrail', 'us-east-1', '2019', '12', '11')
+        os.makedirs(day_dir, exist_ok=True)
+        with gzip.open(os.path.join(day_dir, name), 'wt') as log:
+            json.dump({'Records': records}, log)
+
+    def test_backfill(self):
+        """
+        Verify creation events are tagged once per service and creator, and other events
+        are skipped.
+        """
+        self.assertEqual(backfill(self.log_dir, self.checkpoint),
+                         dict(EMPTY_SUMMARY, files=1, groups=2, tagged=2))
+
+    def test_backfill_resume(self):
+        """
+        Verify log files in the checkpoint are not read again.
+        """
+        backfill(self.log_dir, self.checkpoint)
+        self.assertEqual(backfill(self.log_dir, self.checkpoint), EMPTY_SUMMARY)
+
+    def test_backfill_window(self):
+        """
+        Verify each window of log files is checkpointed once tagged.
+        """
+        self.write_log([load_detail('rds_CreateDBInstance.json')], 'trail_20191211T1800Z.json.gz')
+        self.assertEqual(backfill(self.log_dir, self.checkpoint, {'window': 1}),
+                         dict(EMPTY_SUMMARY, files=2, groups=3, tagged=3))
+        with open(self.checkpoint) as checkpoint:
+            self.assertEqual(len(checkpoint.readlines()), 2)
+
+    def test_backfill_dry_run(self):
+        """
+        Verify a dry run groups the events without tagging or checkpointing.
+        """
+        self.assertEqual(backfill(self.log_dir, self.checkpoint, dry_run=True),
+                         dict(EMPTY_SUMMARY, files=1, groups=2))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_backfill_missing_and_attachments(self):
+        """
+        Verify instances are tagged with their attachments, resources deleted since their
+        event are dropped from the chunk without failing the window, and bucket tags are
+        merged into the current tags.
+        """
+        shutil.rmtree(self.log_dir)
+        run_instances = dict(load_detail('ec2_StartInstances.json'), eventName='RunInstances')
+        self.write_log([load_detail('ec2_CreateVolume.json'), run_instances,
+                        load_detail('s3_CreateBucket.json')])
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/backfill')
+        calls = attach_local_aws_response(path)
+
+        self.assertEqual(backfill(self.log_dir, self.checkpoint),
+                         dict(EMPTY_SUMMARY, files=1, groups=2, tagged=4, missing=1))
+        self.assertTrue(os.path.exists(self.checkpoint))
+        self.assertEqual(calls.params('DescribeInstances')[0]['Filters'],
+                         [{'Name': 'instance-id', 'Values': ['i-0d10990e156e7ca84']}])
+        self.assertEqual([params['Resources'] for params in calls.params('CreateTags')], [
+            ['vol-02f81edd0d0411bbb', 'i-0d10990e156e7ca84', 'vol-0cbe5fd9676b5eb3b',
+             'eni-09c39dd6cccca6370'],
+            ['i-0d10990e156e7ca84', 'vol-0cbe5fd9676b5eb3b', 'eni-09c39dd6cccca6370']])
+        self.assertEqual(calls.params('PutBucketTagging')[0]['Tagging']['TagSet'],
+                         [{'Key': 'Project', 'Value': 'autotag'},
+                          {'Key': 'Creator', 'Value': 'AutoTester'}])
+
+    def test_backfill_object_tags(self):
+        """
+        Verify object tags are merged into the current tags of the object, as the
+        PutObjectTagging call replaces them.
+        """
+        shutil.rmtree(self.log_dir)
+        self.write_log([load_detail('s3_PutObject.json')])
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/backfill')
+        calls = attach_local_aws_response(path)
+
+        self.assertEqual(backfill(self.log_dir, self.checkpoint),
+                         dict(EMPTY_SUMMARY, files=1, groups=1, tagged=1))
+        self.assertEqual(calls.params('PutObjectTagging')[0]['Tagging']['TagSet'],
+                         [{'Key': 'Project', 'Value': 'pipeline'},
+                          {'Key': 'Creator', 'Value': 'Admin'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""SQS batch Lambda unit tests."""
+import unittest
+import os.path
+import json
+
+from unittest.mock import MagicMock, patch
+from batch_function import sqs_batch_handler
+from idempotency import InMemoryStore, set_store
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+
+
+def load_record(message_id, file_name):
+    """
+    Wrap a test event detail in an EventBridge event and an SQS record.
+    @param message_id: The SQS message ID.
+    @param file_name: The test event data file name.
+    @return: The SQS record.
+    """
+    with open('../test_event_data/' + file_name) as event_data:
+        detail = json.load(event_data)
+    event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+    return {'messageId': message_id, 'body': json.dumps(event)}
+
+
+class TestBatch(unittest.TestCase):
+    """
+    Test SQS batch tagging Lambda function.
+    """
+    def setUp(self):
+        set_store(InMemoryStore())
+        self.event = {
+            'Records': [
+                load_record('1', 'ec2_CreateVolume.json'),
+                load_record('2', 'ec2_CreateSnapshot.json'),
+                load_record('3', 's3_PutObject.json'),
+                load_record('4', 's3_PutObject.json'),
+                load_record('5', 'rds_CreateDBInstance.json'),
+                {'messageId': '6', 'body': 'not an event'}
+            ]
+        }
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/sqs_batch')
+        attach_local_aws_response(path)
+
+    def test_batch_tagged(self):
+        """
+        Verify a mixed batch is tagged with no failed records.
+        """
+        self.assertEqual(sqs_batch_handler(self.event, ''), {'batchItemFailures': []})
+
+    def test_batch_coalesced(self):
+        """
+        Verify EC2 events from one creator share a tagging plan and duplicate
+        S3 events are tagged once.
+        """
+        s3_handler = MagicMock(return_value=True)
+        with patch('batch_function.tag_resources', return_value=[]) as tag_mock, \
+                patch.dict('batch_function.RECORD_HANDLERS', {'s3.amazonaws.com': s3_handler}):
+            sqs_batch_handler(self.event, '')
+        self.assertEqual(tag_mock.call_count, 1)
+        self.assertEqual(len(tag_mock.call_args[0][1]), 2)
+        self.assertEqual(s3_handler.call_count, 1)
+
+    def test_batch_item_failures(self):
+        """
+        Verify only the records whose resources failed to be tagged are reported.
+        """
+        def tag_failed(_ec2, ids, _creator):
+            return [{'Resources': ids, 'Status': 'failed', 'Attempts': 3}]
+
+        with patch('batch_function.tag_resources', side_effect=tag_failed):
+            response = sqs_batch_handler(self.event, '')
+        self.assertEqual(response['batchItemFailures'],
+                         [{'itemIdentifier': '1'}, {'itemIdentifier': '2'}])
+
+    def test_batch_handler_error(self):
+        """
+        Verify a handler raising fails only the records of its group.
+        """
+        rds_handler = MagicMock(side_effect=RuntimeError('unexpected'))
+        with patch.dict('batch_function.RECORD_HANDLERS', {'rds.amazonaws.com': rds_handler}):
+            response = sqs_batch_handler(self.event, '')
+        self.assertEqual(response['batchItemFailures'], [{'itemIdentifier': '5'}])
+
+    def test_batch_s3_objects_coalesced(self):
+        """
+        Verify PutObject events for the same object are tagged once in S3 throughput mode.
+        """
+        with patch('batch_function.tag_objects',
+                   return_value={('Admin-autotag-test', 'pipeline-6515-rollback.drawio'):
+                                 'tagged'}) as tag_mock, \
+                patch.dict(os.environ, {'S3_OBJECT_TAGGING_MODE': 'throughput'}):
+            response = sqs_batch_handler(self.event, '')
+        self.assertEqual(response, {'batchItemFailures': []})
+        self.assertEqual(tag_mock.call_count, 1)
+        self.assertEqual(tag_mock.call_args[0][1],
+                         {('Admin-autotag-test', 'pipeline-6515-rollback.drawio'): 'Admin'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""Boto3Wrapper unit tests."""
+import unittest
+import os.path
+
+from boto3wrapper import Boto3Wrapper
+from test_utils import attach_local_aws_response
+
+ROLE_ARN = 'arn:aws:iam::292909299215:role/AutoTagBackfill'
+
+
+class TestBoto3Wrapper(unittest.TestCase):
+    """
+    Test the client and resource cache of the Boto3Wrapper.
+    """
+    def test_client_is_reused(self):
+        """
+        Verify a client is built once per service and session.
+        """
+        Boto3Wrapper.get_session()
+        self.assertIs(Boto3Wrapper.get_client('ec2'), Boto3Wrapper.get_client('ec2'))
+        self.assertIsNot(Boto3Wrapper.get_client('ec2'), Boto3Wrapper.get_client('rds'))
+        self.assertIs(Boto3Wrapper.get_resource('ec2'), Boto3Wrapper.get_resource('ec2'))
+
+    def test_new_session_invalidates_cache(self):
+        """
+        Verify re-creating the session drops clients built on the previous session.
+        """
+        Boto3Wrapper.get_session()
+        client = Boto3Wrapper.get_client('s3')
+        session = Boto3Wrapper.get_session()
+        self.assertIsNot(Boto3Wrapper.get_client('s3'), client)
+        self.assertEqual(Boto3Wrapper.get_client('s3').meta.region_name, session.region_name)
+
+    def test_prewarm(self):
+        """
+        Verify pre-warmed clients are served from the cache.
+        """
+        Boto3Wrapper.get_session()
+        Boto3Wrapper.prewarm(['dynamodb', 'dax'])
+        client = Boto3Wrapper.get_client('dax')
+        self.assertIs(Boto3Wrapper.get_client('dax'), client)
+
+    def test_pooled_sessions(self):
+        """
+        Verify sessions are pooled per role and region, and the current session serves
+        its own region.
+        """
+        session = Boto3Wrapper.get_session()
+        self.assertIs(Boto3Wrapper.get_pooled_session(None, 'us-east-1'), session)
+        other = Boto3Wrapper.get_pooled_session(None, 'eu-west-1')
+        self.assertIs(Boto3Wrapper.get_pooled_session(None, 'eu-west-1'), other)
+        self.assertEqual(Boto3Wrapper.get_client('ec2', region_name='eu-west-1').meta.region_name,
+                         'eu-west-1')
+
+    def test_assumed_role_session(self):
+        """
+        Verify a role session uses the credentials returned by STS AssumeRole.
+        """
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/sts_assume_role')
+        attach_local_aws_response(path)
+        session = Boto3Wrapper.get_pooled_session(ROLE_ARN, 'eu-west-1')
+        self.assertIsNot(session, Boto3Wrapper.get_pooled_session(None, 'eu-west-1'))
+        self.assertIs(session, Boto3Wrapper.get_pooled_session(ROLE_ARN, 'eu-west-1'))
+        self.assertEqual(session.get_credentials().access_key, 'ASIATVPVOWKXASSUMED1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Creator resolution cache unit tests."""
+import unittest
+import json
+
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import TTLCache, CREATOR_CACHE, get_creator
+from test_utils import ACCOUNT, REGION
+
+
+class FakeClock:
+    """
+    A settable clock for cache expiry.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+        @param seconds: The number of seconds.
+        """
+        self.now += seconds
+
+
+class TestCreatorCache(unittest.TestCase):
+    """
+    Test the LRU and TTL creator cache.
+    """
+    def test_repeated_identity_is_a_hit(self):
+        """
+        Verify a second event from the same identity is served from the cache.
+        """
+        with open('../test_event_data/ec2_iam_user.json') as iam_user:
+            detail = json.load(iam_user)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        CREATOR_CACHE.clear()
+        self.assertEqual(get_creator(event), get_creator(event))
+        self.assertEqual((CREATOR_CACHE.hits, CREATOR_CACHE.misses), (1, 1))
+
+    def test_least_recently_used_evicted(self):
+        """
+        Verify the least recently used entry is evicted when the cache is full.
+        """
+        cache = TTLCache(2, 60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+    def test_entry_expires(self):
+        """
+        Verify an entry is a miss once its TTL has passed.
+        """
+        clock = FakeClock()
+        cache = TTLCache(2, 60, clock=clock)
+        cache.put('a', 1)
+        clock.advance(59)
+        self.assertEqual(cache.get('a'), 1)
+        clock.advance(2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (1, 1, 0))
+
+    def test_shared_between_threads(self):
+        """
+        Verify concurrent gets and puts keep the cache bounded and its counters exact.
+        """
+        cache = TTLCache(16, 60)
+
+        def work(worker):
+            for index in range(2000):
+                cache.put((worker, index % 32), index)
+                cache.get((worker, (index + 1) % 32))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(work, range(8)))
+        self.assertEqual(len(cache), 16)
+        self.assertEqual(cache.hits + cache.misses, 8 * 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ from unittest.mock import patch
 from dynamodb_cloudwatch_function import dynamodb_cloudwatch_handler
 from dynamodb_sfn_function import dynamodb_sfn_handler
 from test_utils import attach_local_aws_response, ACCOUNT, REGION
+from utils import SFN_BACKOFF_BASE
 
 
 class TestDynamoDB(unittest.TestCase):
@@ -106,3 +107,73 @@ class TestDynamoDB(unittest.TestCase):
                             '../local-aws-response/create_DynamoDBCluster_SFN')
         attach_local_aws_response(path)
         self.assertEqual(dynamodb_sfn_handler(detail, '')['TagStatus'], 'complete')
+
+    def test_create_table_tag_immediately(self):
+        """
+        Verifies a table that is ready when the creation event arrives is tagged
+        without starting the state machine.
+
+        @return: True if the Lambda returns True.
+        """
+        with open('../test_event_data/dynamodb_CreateTable.json') as table:
+            detail = json.load(table)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/create_DynamoDBTable_SFN')
+        attach_local_aws_response(path)
+        with patch.dict(os.environ, {'TAG_IMMEDIATE': 'true'}):
+            self.assertEqual(dynamodb_cloudwatch_handler(event, ''), True)
+
+    def test_create_table_not_ready_starts_state_machine(self):
+        """
+        Verifies the state machine starts, with a backoff wait, when the immediate tag fails.
+
+        @return: True if the Lambda returns True and the execution input has a wait.
+        """
+        with open('../test_event_data/dynamodb_CreateTable.json') as table:
+            detail = json.load(table)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/create_DynamoDBTable_not_ready')
+        attach_local_aws_response(path)
+        with patch.dict(os.environ, {
+                'TAG_IMMEDIATE': 'true',
+                'SFN_MAX_ATTEMPTS': '30',
+                'SFN_ARN': 'arn:aws:states:us-east-1:292909299215:stateMachine:AutoTag-DynamoDB-SFN'
+        }):
+            self.assertEqual(dynamodb_cloudwatch_handler(event, ''), True)
+
+    def test_create_table_sfn_backoff(self):
+        """
+        Verifies a failed tag attempt leaves the table pending with an exponential backoff wait.
+
+        @return: True if the event response from the Lambda has the proper tag status and wait.
+        """
+        with open('../test_event_data/dynamodb_SFN_CreateTable.json') as sfn_event:
+            detail = json.load(sfn_event)
+        detail['MaxAttempts'] = 10
+        detail['Attempts'] = 3
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/create_DynamoDBTable_not_ready')
+        attach_local_aws_response(path)
+        response = dynamodb_sfn_handler(detail, '')
+        self.assertEqual(response['TagStatus'], 'pending')
+        self.assertTrue(1 <= response['WaitSeconds'] <= SFN_BACKOFF_BASE * 2 ** 4)
+
+    def test_create_table_sfn_fatal_error(self):
+        """
+        Verifies an error that retrying will not fix ends the state machine as "failed".
+
+        @return: True if the event response from the Lambda has the proper tag status.
+        """
+        with open('../test_event_data/dynamodb_SFN_CreateTable.json') as sfn_event:
+            detail = json.load(sfn_event)
+        detail['MaxAttempts'] = 10
+        detail['Attempts'] = 3
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/create_DynamoDBTable_access_denied')
+        attach_local_aws_response(path)
+        response = dynamodb_sfn_handler(detail, '')
+        self.assertEqual(response['TagStatus'], 'failed')
+        self.assertIn('AccessDeniedException', response['Error'])
+        self.assertNotIn('WaitSeconds', response)
@@ -3,14 +3,21 @@ import unittest
 import os.path
 import json
 
-from ec2_function import ec2_lambda_handler
-from test_utils import attach_local_aws_response, ACCOUNT, REGION
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from ec2_function import ec2_lambda_handler, tag_resources, CREATE_TAGS_MAX_RESOURCES
+from idempotency import InMemoryStore, set_store
+from registry import TAG_BACKOFF_BASE
+from test_utils import attach_local_aws_response, assert_max_api_calls, ACCOUNT, REGION
 
 
 class TestEC2(unittest.TestCase):
     """
     Test EC2 Lambda function.
     """
+    def setUp(self):
+        set_store(InMemoryStore())
+
     def test_root_account(self):
         """
         Verify setting an EC2 tag when the creator is the root user.
@@ -19,8 +26,10 @@ class TestEC2(unittest.TestCase):
             detail = json.load(root_account)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/root_account')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 2)
+        assert_max_api_calls(self, calls, 1, 'CreateTags')
 
     def test_iam_user(self):
         """
@@ -30,8 +39,10 @@ class TestEC2(unittest.TestCase):
             detail = json.load(iam_user)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/iam_user')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 2)
+        assert_max_api_calls(self, calls, 1, 'CreateTags')
 
     def test_create_volume(self):
         """
@@ -41,8 +52,9 @@ class TestEC2(unittest.TestCase):
             detail = json.load(create_volume)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_volume')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 1)
 
     def test_create_snapshot(self):
         """
@@ -52,8 +64,9 @@ class TestEC2(unittest.TestCase):
             detail = json.load(create_snapshot)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_snapshot')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 1)
 
     def test_start_instances(self):
         """
@@ -64,8 +77,10 @@ class TestEC2(unittest.TestCase):
             detail = json.load(start_instances)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/start_instances')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 2)
+        assert_max_api_calls(self, calls, 1, 'CreateTags')
 
     def test_reboot_instances(self):
         """
@@ -76,8 +91,109 @@ class TestEC2(unittest.TestCase):
             detail = json.load(reboot_instances)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/reboot_instances')
+        calls = attach_local_aws_response(path)
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        assert_max_api_calls(self, calls, 2)
+        assert_max_api_calls(self, calls, 1, 'CreateTags')
+
+    def test_start_instances_attachments(self):
+        """
+        Verify the attached volume and network interface IDs are read from DescribeInstances,
+        and the instance already tagged by the same creator is left out.
+        """
+        with open('../test_event_data/ec2_StartInstances.json') as start_instances:
+            detail = json.load(start_instances)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/start_instances')
         attach_local_aws_response(path)
+        with patch('ec2_function.tag_resources', return_value=[]) as tag_mock:
+            self.assertEqual(ec2_lambda_handler(event, ''), True)
+        self.assertEqual(tag_mock.call_args[0][1],
+                         ['vol-0cbe5fd9676b5eb3b', 'eni-09c39dd6cccca6370'])
+
+    def test_start_instances_single_create_tags(self):
+        """
+        Verify the volume and network interface of the instance are tagged with one
+        CreateTags call, after one DescribeInstances call.
+        """
+        with open('../test_event_data/ec2_StartInstances.json') as start_instances:
+            detail = json.load(start_instances)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/start_instances')
+        calls = attach_local_aws_response(path)
         self.assertEqual(ec2_lambda_handler(event, ''), True)
+        self.assertEqual(calls.operations(), {'DescribeInstances': 1, 'CreateTags': 1})
+        self.assertEqual(calls.params('CreateTags')[0]['Resources'],
+                         ['vol-0cbe5fd9676b5eb3b', 'eni-09c39dd6cccca6370'])
+
+    def test_tag_resources_chunks_unique_ids(self):
+        """
+        Verify duplicate IDs are dropped and one CreateTags call is made per chunk.
+        """
+        ids = ['i-%05d' % i for i in range(CREATE_TAGS_MAX_RESOURCES + 5)]
+        ec2 = MagicMock()
+        outcomes = tag_resources(ec2, ids + ids[:10], 'Admin')
+        self.assertEqual(ec2.create_tags.call_count, 2)
+        self.assertEqual([len(outcome['Resources']) for outcome in outcomes],
+                         [CREATE_TAGS_MAX_RESOURCES, 5])
+        self.assertTrue(all(outcome['Status'] == 'tagged' for outcome in outcomes))
+
+    def test_tag_resources_retries_failed_chunk(self):
+        """
+        Verify only the chunk that failed is retried.
+        """
+        throttled = ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'CreateTags')
+        ids = ['vol-%05d' % i for i in range(CREATE_TAGS_MAX_RESOURCES + 1)]
+        ec2 = MagicMock()
+        ec2.create_tags.side_effect = [None, throttled, None]
+        with patch('registry.time.sleep') as sleep:
+            outcomes = tag_resources(ec2, ids, 'Admin')
+        self.assertEqual(ec2.create_tags.call_count, 3)
+        self.assertEqual(sleep.call_count, 1)
+        self.assertTrue(0 <= sleep.call_args[0][0] <= TAG_BACKOFF_BASE)
+        self.assertEqual([outcome['Attempts'] for outcome in outcomes], [1, 2])
+        self.assertEqual(ec2.create_tags.call_args[1]['Resources'], ids[-1:])
+
+    def test_duplicate_event(self):
+        """
+        Verify a redelivered event makes no AWS call.
+        """
+        with open('../test_event_data/ec2_StartInstances.json') as start_instances:
+            detail = json.load(start_instances)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/start_instances')
+        calls = attach_local_aws_response(path)
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        self.assertEqual(calls.operations(), {'DescribeInstances': 1, 'CreateTags': 1})
+
+    def test_restarted_instance_not_tagged_again(self):
+        """
+        Verify resources tagged with the same creator are skipped when the instance
+        is started again, with a new event.
+        """
+        with open('../test_event_data/ec2_StartInstances.json') as start_instances:
+            detail = json.load(start_instances)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/start_instances')
+        calls = attach_local_aws_response(path)
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        event['detail'] = dict(detail, eventID='0e5b3a67-9b8e-4cf5-a4f4-1c1d3c2f9a10')
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        self.assertEqual(calls.operations(), {'DescribeInstances': 2, 'CreateTags': 1})
+
+    def test_failed_event_not_recorded(self):
+        """
+        Verify an event whose resources failed to be tagged is processed again.
+        """
+        with open('../test_event_data/ec2_CreateVolume.json') as create_volume:
+            detail = json.load(create_volume)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        failed = [{'Resources': ['vol-00000'], 'Status': 'failed', 'Attempts': 3}]
+        with patch('ec2_function.tag_resources', return_value=failed) as tag_mock:
+            self.assertEqual(ec2_lambda_handler(event, ''), False)
+            self.assertEqual(ec2_lambda_handler(event, ''), False)
+        self.assertEqual(tag_mock.call_count, 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+"""Creator tag enrichment unit tests."""
+import unittest
+import os.path
+import json
+
+from unittest.mock import patch
+from enrichment import FileBackend, IAMUserTagsBackend, set_backend
+from rds_function import rds_lambda_handler
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+from utils import CREATOR_TAGS_CACHE, CREATOR_TAGS_FAILURE_TTL, creator_tags
+
+ADMIN_TAGS = [{'Key': 'Creator', 'Value': 'Admin'}, {'Key': 'CostCenter', 'Value': '4711'},
+              {'Key': 'Team', 'Value': 'platform'}]
+
+
+class CountingBackend:  # pylint: disable=too-few-public-methods
+    """
+    Wrap a backend and count its lookups.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.lookups = 0
+
+    def lookup(self, creator):
+        """
+        @param creator: The Creator tag value.
+        @return: The derived tags of the wrapped backend.
+        """
+        self.lookups += 1
+        return self.backend.lookup(creator)
+
+
+class TestEnrichment(unittest.TestCase):
+    """
+    Test the tag set builder and its lookup backends.
+    """
+    def setUp(self):
+        CREATOR_TAGS_CACHE.clear()
+        self.addCleanup(set_backend, None)
+        self.addCleanup(CREATOR_TAGS_CACHE.clear)
+
+    def test_no_backend(self):
+        """
+        Verify only the Creator tag is added without a backend.
+        """
+        self.assertEqual(creator_tags('Admin'), [{'Key': 'Creator', 'Value': 'Admin'}])
+
+    def test_file_backends(self):
+        """
+        Verify the JSON and CSV files give the same tags, and unknown creators none.
+        """
+        for name in ('creator_tags.json', 'creator_tags.csv'):
+            CREATOR_TAGS_CACHE.clear()
+            set_backend(FileBackend('../test_event_data/' + name))
+            self.assertEqual(creator_tags('Admin'), ADMIN_TAGS)
+            self.assertEqual(creator_tags('ops'), [{'Key': 'Creator', 'Value': 'ops'},
+                                                   {'Key': 'Team', 'Value': 'operations'}])
+            self.assertEqual(creator_tags('root_account'),
+                             [{'Key': 'Creator', 'Value': 'root_account'}])
+
+    def test_iam_backend(self):
+        """
+        Verify the IAM user tags are filtered by key, and creators that are not IAM users
+        get no tags.
+        """
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/creator_tags_iam')
+        attach_local_aws_response(path)
+        set_backend(IAMUserTagsBackend(['Team', 'CostCenter']))
+        self.assertEqual(creator_tags('Admin'), ADMIN_TAGS)
+        self.assertEqual(creator_tags('signin.amazonaws.com'),
+                         [{'Key': 'Creator', 'Value': 'signin.amazonaws.com'}])
+
+    def test_lookup_failure(self):
+        """
+        Verify a failing lookup falls back to the Creator tag, cached for
+        CREATOR_TAGS_FAILURE_TTL seconds only.
+        """
+        backend = CountingBackend(FileBackend('../test_event_data/creator_tags.json'))
+        backend.backend = None
+        set_backend(backend)
+        now = [0]
+        with patch.object(CREATOR_TAGS_CACHE, 'clock', lambda: now[0]):
+            self.assertEqual(creator_tags('Admin'), [{'Key': 'Creator', 'Value': 'Admin'}])
+            self.assertEqual(creator_tags('Admin'), [{'Key': 'Creator', 'Value': 'Admin'}])
+            self.assertEqual(backend.lookups, 1)
+            now[0] = CREATOR_TAGS_FAILURE_TTL
+            self.assertEqual(creator_tags('Admin'), [{'Key': 'Creator', 'Value': 'Admin'}])
+        self.assertEqual(backend.lookups, 2)
+
+    def test_handler_lookup_once(self):
+        """
+        Verify handlers tag with the derived tags and look a creator up once across warm
+        invocations.
+        """
+        backend = CountingBackend(FileBackend('../test_event_data/creator_tags.json'))
+        set_backend(backend)
+        with open('../test_event_data/rds_CreateDBInstance.json') as db_instance:
+            detail = json.load(db_instance)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_DBInstance')
+        calls = attach_local_aws_response(path)
+
+        self.assertEqual(rds_lambda_handler(event, ''), True)
+        self.assertEqual(rds_lambda_handler(event, ''), True)
+        self.assertEqual(backend.lookups, 1)
+        self.assertEqual([params['Tags'] for params in calls.params('AddTagsToResource')],
+                         [ADMIN_TAGS, ADMIN_TAGS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""Fault-injecting local AWS stand-in unit tests."""
+import unittest
+import os
+import json
+import random
+import statistics
+import time
+
+from unittest.mock import patch
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3wrapper import Boto3Wrapper, ENDPOINT_URL_ENV
+from ec2_function import ec2_lambda_handler
+from fake_aws import FakeAWS, sample_latency
+from idempotency import InMemoryStore, set_store
+from pending import InMemoryPendingStore, defer
+from registry import ERROR_NOT_READY, ERROR_THROTTLED, classify_client_error
+from s3_function import s3_lambda_handler
+from sweeper_function import sweep
+from test_utils import ACCOUNT, REGION
+
+TABLE_ARN = 'arn:aws:dynamodb:us-east-1:292909299215:table/Orders'
+NO_RETRIES = Config(retries={'max_attempts': 0})
+
+
+class FakeClock:  # pylint: disable=too-few-public-methods
+    """
+    A clock advanced by the test.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestFakeAWS(unittest.TestCase):
+    """
+    Test the stand-in through the clients of Boto3Wrapper.
+    """
+    def start(self, profile=None, **kwargs):
+        """
+        Start a stand-in and point the Boto3Wrapper clients at it.
+        @param profile: The fault profile.
+        @return: The stand-in.
+        """
+        fake = FakeAWS(profile, seed=7, **kwargs)
+        fake.start()
+        self.addCleanup(fake.stop)
+        patcher = patch.dict(os.environ, {ENDPOINT_URL_ENV: fake.endpoint_url,
+                                          'AWS_ACCESS_KEY_ID': 'fake',
+                                          'AWS_SECRET_ACCESS_KEY': 'fake'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Boto3Wrapper.get_session()
+        self.addCleanup(Boto3Wrapper.get_session)
+        return fake
+
+    def client(self, service):
+        """
+        @param service: The service name.
+        @return: A client of the stand-in that does not retry.
+        """
+        return Boto3Wrapper.get_session().client(
+            service, endpoint_url=os.environ[ENDPOINT_URL_ENV], config=NO_RETRIES)
+
+    def test_ec2_handler(self):
+        """
+        Verify the EC2 handler tags the instance, its volume and network interface.
+        """
+        set_store(InMemoryStore())
+        self.addCleanup(set_store, None)
+        fake = self.start()
+        with open('../test_event_data/ec2_StartInstances.json') as start_instances:
+            detail = json.load(start_instances)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+
+        self.assertEqual(ec2_lambda_handler(event, ''), True)
+        for resource_id in ('i-0d10990e156e7ca84', 'vol-0d10990e156e7ca84',
+                            'eni-0d10990e156e7ca84'):
+            self.assertEqual(fake.tags(resource_id), {'Creator': 'Admin'})
+        self.assertEqual(fake.calls[('ec2.CreateTags', 'ok')], 1)
+
+    def test_throttle_rate(self):
+        """
+        Verify the share of throttled requests follows the profile, with the throttling
+        error of the service.
+        """
+        fake = self.start({'ec2.CreateTags': {'throttle_rate': 0.3}})
+        client = self.client('ec2')
+        throttled = 0
+        for _ in range(200):
+            try:
+                client.create_tags(Resources=['i-1'], Tags=[{'Key': 'Creator', 'Value': 'a'}])
+            except ClientError as error:
+                self.assertEqual(error.response['Error']['Code'], 'RequestLimitExceeded')
+                self.assertEqual(classify_client_error(error), ERROR_THROTTLED)
+                throttled += 1
+        self.assertEqual(fake.calls[('ec2.CreateTags', 'throttled')], throttled)
+        self.assertTrue(40 <= throttled <= 80, throttled)
+
+    def test_not_ready_window(self):
+        """
+        Verify a table can be tagged and is listed only after its not ready window.
+        """
+        clock = FakeClock()
+        fake = self.start({'dynamodb': {'not_ready_seconds': 30}}, clock=clock)
+        client = self.client('dynamodb')
+        tags = [{'Key': 'Creator', 'Value': 'Admin'}]
+
+        with self.assertRaises(ClientError) as raised:
+            client.tag_resource(ResourceArn=TABLE_ARN, Tags=tags)
+        self.assertEqual(classify_client_error(raised.exception), ERROR_NOT_READY)
+        self.assertEqual(client.list_tables()['TableNames'], [])
+
+        clock.now = 30
+        client.tag_resource(ResourceArn=TABLE_ARN, Tags=tags)
+        self.assertEqual(client.list_tables()['TableNames'], ['Orders'])
+        self.assertEqual(fake.tags(TABLE_ARN), {'Creator': 'Admin'})
+        self.assertEqual(fake.calls[('dynamodb.TagResource', 'not ready')], 1)
+
+    def test_sweeper(self):
+        """
+        Verify the sweeper leaves a table pending during its not ready window, without
+        trying to tag it, then tags it.
+        """
+        clock = FakeClock()
+        fake = self.start({'dynamodb': {'not_ready_seconds': 30}}, clock=clock)
+        fake.create('Orders')
+        store = InMemoryPendingStore()
+        with patch('pending.get_store', return_value=store):
+            defer('CreateTable', 'Admin', TABLE_ARN, 'dynamodb')
+
+        self.assertEqual(sweep(store)['pending'], 1)
+        clock.now = 60
+        self.assertEqual(sweep(store), {'pending': 0, 'tagged': 1, 'failed': 0, 'expired': 0})
+        self.assertEqual(fake.tags(TABLE_ARN), {'Creator': 'Admin'})
+        self.assertEqual(fake.calls[('dynamodb.TagResource', 'ok')], 1)
+        self.assertEqual(fake.calls[('dynamodb.TagResource', 'not ready')], 0)
+
+    def test_bucket_tagging_replaced(self):
+        """
+        Verify PutBucketTagging replaces the tag set of the bucket, as S3 does, and the S3
+        handler keeps the tags of the bucket.
+        """
+        fake = self.start()
+        client = self.client('s3')
+        client.put_bucket_tagging(Bucket='bucket', Tagging={
+            'TagSet': [{'Key': 'Project', 'Value': 'autotag'}]})
+        client.put_bucket_tagging(Bucket='bucket', Tagging={
+            'TagSet': [{'Key': 'Creator', 'Value': 'Admin'}]})
+        self.assertEqual(fake.tags('bucket'), {'Creator': 'Admin'})
+
+        with open('../test_event_data/s3_CreateBucket.json') as create_bucket:
+            detail = json.load(create_bucket)
+        bucket = detail['requestParameters']['bucketName']
+        client.put_bucket_tagging(Bucket=bucket, Tagging={
+            'TagSet': [{'Key': 'Project', 'Value': 'autotag'}]})
+        s3_lambda_handler({'account': ACCOUNT, 'region': REGION, 'detail': detail}, '')
+        self.assertEqual(fake.tags(bucket), {'Project': 'autotag', 'Creator': 'AutoTester'})
+
+    def test_latency(self):
+        """
+        Verify answers take the latency of the profile, and sampled latencies follow the
+        lognormal median.
+        """
+        self.start({'default': {'latency_ms': 50}})
+        client = self.client('s3')
+        start = time.perf_counter()
+        client.put_object_tagging(Bucket='bucket', Key='a/b.txt',
+                                  Tagging={'TagSet': [{'Key': 'Creator', 'Value': 'Admin'}]})
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertEqual(client.get_object_tagging(Bucket='bucket', Key='a/b.txt')['TagSet'],
+                         [{'Key': 'Creator', 'Value': 'Admin'}])
+
+        rng = random.Random(7)
+        samples = [sample_latency({'median': 20, 'p99': 200}, rng) for _ in range(2000)]
+        self.assertAlmostEqual(statistics.median(samples), 0.02, delta=0.003)
+
+
+if __name__ == '__main__':
+    unittest.main()
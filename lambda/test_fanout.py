@@ -0,0 +1,66 @@
+"""Multi-account and multi-region fan-out unit tests."""
+import unittest
+import threading
+import time
+
+from boto3wrapper import Boto3Wrapper
+from fanout import fan_out, role_arns
+
+REGIONS = ['us-east-1', 'us-west-2']
+
+
+class TestFanOut(unittest.TestCase):
+    """
+    Test running a job across accounts and regions.
+    """
+    def setUp(self):
+        Boto3Wrapper.get_session()
+
+    def test_role_arns(self):
+        """
+        Verify a role ARN is built per account.
+        """
+        self.assertEqual(role_arns(['111111111111'], 'AutoTag'),
+                         ['arn:aws:iam::111111111111:role/AutoTag'])
+
+    def test_region_concurrency(self):
+        """
+        Verify every target runs, in its own region, within the per-region limit.
+        """
+        lock = threading.Lock()
+        running = dict.fromkeys(REGIONS, 0)
+        peak = dict.fromkeys(REGIONS, 0)
+
+        def job(session, _role_arn, region):
+            with lock:
+                running[region] += 1
+                peak[region] = max(peak[region], running[region])
+            time.sleep(0.01)
+            with lock:
+                running[region] -= 1
+            return session.region_name
+
+        roles = [None] + role_arns(['111111111111', '222222222222', '333333333333'], 'AutoTag')
+        outcomes = fan_out(job, roles, REGIONS, max_workers=8, region_concurrency=2)
+        self.assertEqual(len(outcomes), 8)
+        self.assertTrue(all(outcome == {'Status': 'complete', 'Result': region}
+                            for (_, region), outcome in outcomes.items()))
+        self.assertTrue(all(count <= 2 for count in peak.values()))
+
+    def test_failed_target(self):
+        """
+        Verify a failed job is reported without stopping the others.
+        """
+        def job(_session, _role_arn, region):
+            if region == 'us-west-2':
+                raise ValueError('region disabled')
+            return 'done'
+
+        outcomes = fan_out(job, [None], REGIONS)
+        self.assertEqual(outcomes[(None, 'us-east-1')], {'Status': 'complete', 'Result': 'done'})
+        self.assertEqual(outcomes[(None, 'us-west-2')],
+                         {'Status': 'failed', 'Error': 'region disabled'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Idempotency store unit tests."""
+import unittest
+
+from unittest.mock import MagicMock
+from botocore.exceptions import ClientError
+from idempotency import InMemoryStore, DynamoDBStore, TieredStore, set_store
+from idempotency import is_cached_event, check_event, mark_processed
+
+
+class TestIdempotency(unittest.TestCase):
+    """
+    Test the idempotency stores.
+    """
+    def setUp(self):
+        set_store(InMemoryStore())
+
+    def tearDown(self):
+        set_store(None)
+
+    def test_duplicate_event(self):
+        """
+        Verify an event is a duplicate once marked, and events without an ID never are.
+        """
+        detail = {'eventID': '42db9259-bf7a-408c-aa21-49042fe867a1'}
+        self.assertEqual(check_event(detail, [], 'Admin'), (False, []))
+        self.assertFalse(is_cached_event(detail))
+        mark_processed([detail, {}], [], 'Admin')
+        self.assertEqual(check_event(detail, [], 'Admin'), (True, []))
+        self.assertTrue(is_cached_event(detail))
+        self.assertEqual(check_event({}, [], 'Admin'), (False, []))
+        self.assertFalse(is_cached_event({}))
+
+    def test_untagged(self):
+        """
+        Verify resources are skipped only for the creator they were tagged with.
+        """
+        mark_processed([], ['i-1', 'vol-1'], 'Admin')
+        self.assertEqual(check_event({}, ['i-1', 'vol-1', 'eni-1'], 'Admin'), (False, ['eni-1']))
+        self.assertEqual(check_event({}, ['i-1'], 'root_account'), (False, ['i-1']))
+
+    def test_single_shared_call(self):
+        """
+        Verify the event and its resources are read with one shared lookup and written
+        with one shared update, and only the local store is asked whether the event is
+        cached.
+        """
+        shared = MagicMock()
+        shared.seen.return_value = set()
+        set_store(TieredStore(InMemoryStore(), shared))
+        detail = {'eventID': '42db9259-bf7a-408c-aa21-49042fe867a1'}
+
+        self.assertFalse(is_cached_event(detail))
+        self.assertEqual(check_event(detail, ['i-1', 'vol-1'], 'Admin'),
+                         (False, ['i-1', 'vol-1']))
+        mark_processed([detail], ['i-1', 'vol-1'], 'Admin')
+        self.assertEqual(shared.seen.call_count, 1)
+        self.assertEqual(shared.add.call_count, 1)
+        self.assertEqual(set(shared.add.call_args[0][0]), {
+            'event:42db9259-bf7a-408c-aa21-49042fe867a1', 'tag:i-1:Admin', 'tag:vol-1:Admin'})
+        self.assertTrue(is_cached_event(detail))
+
+    def test_in_memory_expiry(self):
+        """
+        Verify keys expire after the time to live.
+        """
+        store = InMemoryStore(10, ttl=0)
+        store.add(['event:1'])
+        self.assertEqual(store.seen(['event:1']), set())
+
+    def test_dynamodb_store(self):
+        """
+        Verify keys are read and written in batches, and expired items are not seen.
+        """
+        client = MagicMock()
+        client.batch_get_item.return_value = {'Responses': {'AutoTag-Idempotency': [
+            {'Key': {'S': 'tag:i-1:Admin'}, 'ExpiresAt': {'N': '2000'}},
+            {'Key': {'S': 'tag:i-2:Admin'}, 'ExpiresAt': {'N': '500'}}
+        ]}}
+        client.batch_write_item.return_value = {'UnprocessedItems': {}}
+        store = DynamoDBStore('AutoTag-Idempotency', ttl=60, client=client, clock=lambda: 1000)
+
+        keys = [f'tag:i-{index}:Admin' for index in range(30)]
+        self.assertEqual(store.seen(keys), {'tag:i-1:Admin'})
+        self.assertEqual(client.batch_get_item.call_count, 1)
+
+        store.add(keys)
+        self.assertEqual(client.batch_write_item.call_count, 2)
+        item = client.batch_write_item.call_args[1]['RequestItems']['AutoTag-Idempotency'][0]
+        self.assertEqual(item['PutRequest']['Item']['ExpiresAt'], {'N': '1060'})
+
+    def test_dynamodb_store_errors(self):
+        """
+        Verify a failed lookup treats the keys as not seen.
+        """
+        client = MagicMock()
+        client.exceptions.ClientError = ClientError
+        client.batch_get_item.side_effect = ClientError(
+            {'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'BatchGetItem')
+        store = DynamoDBStore('AutoTag-Idempotency', client=client)
+        self.assertEqual(store.seen(['event:1']), set())
+
+    def test_tiered_store(self):
+        """
+        Verify keys found in the shared store are cached locally.
+        """
+        shared = MagicMock()
+        shared.seen.return_value = {'event:2'}
+        store = TieredStore(InMemoryStore(), shared)
+        store.add(['event:1'])
+        self.assertEqual(store.seen(['event:1', 'event:2']), {'event:1', 'event:2'})
+        self.assertEqual(shared.seen.call_args[0][0], ['event:2'])
+        self.assertEqual(store.seen(['event:2']), {'event:2'})
+        self.assertEqual(shared.seen.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+"""Invocation metrics unit tests."""
+import unittest
+import io
+import os.path
+import json
+
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest.mock import patch
+from botocore.hooks import HierarchicalEmitter
+from metrics import attach_client_hooks, instrumented, METRICS
+from rds_function import rds_lambda_handler
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+
+ENABLED = {'AUTOTAG_METRICS': 'true'}
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Test the per-invocation EMF record.
+    """
+    def setUp(self):
+        with open('../test_event_data/rds_CreateDBInstance.json') as rds_db:
+            detail = json.load(rds_db)
+        self.event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_DBInstance')
+        attach_local_aws_response(path)
+
+    def invoke(self, handler):
+        """
+        Invoke a handler and capture its stdout.
+        @param handler: The Lambda handler.
+        @return: The handler result and the stdout lines.
+        """
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            result = handler(self.event, '')
+        return result, stdout.getvalue().splitlines()
+
+    def test_disabled_by_default(self):
+        """
+        Verify no record is emitted unless AUTOTAG_METRICS is "true".
+        """
+        with patch.dict(os.environ, {'AUTOTAG_METRICS': 'false'}):
+            self.assertEqual(self.invoke(rds_lambda_handler), (True, []))
+
+    def test_emf_record(self):
+        """
+        Verify one EMF record is emitted per invocation with the API call and timings.
+        """
+        with patch.dict(os.environ, ENABLED):
+            result, lines = self.invoke(rds_lambda_handler)
+            _, warm_lines = self.invoke(rds_lambda_handler)
+        self.assertTrue(result)
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['FunctionName'], 'rds_lambda_handler')
+        self.assertEqual(record['ApiCalls'], 1)
+        self.assertGreater(record['ClientBuildMs'], 0)
+        self.assertGreater(record['DurationMs'], 0)
+        self.assertEqual([metric['Name'] for metric in
+                          record['_aws']['CloudWatchMetrics'][0]['Metrics']], list(METRICS))
+        self.assertEqual(json.loads(warm_lines[0])['ColdStart'], 0)
+
+    def test_throttles(self):
+        """
+        Verify throttled attempts are counted from the needs-retry event.
+        """
+        events = HierarchicalEmitter()
+        attach_client_hooks(SimpleNamespace(meta=SimpleNamespace(events=events)))
+
+        def handler(_event, _context):
+            events.emit('needs-retry.ec2.CreateTags',
+                        response=(None, {'Error': {'Code': 'RequestLimitExceeded'}}))
+            events.emit('needs-retry.ec2.CreateTags', response=(None, {}))
+            return True
+
+        with patch.dict(os.environ, ENABLED):
+            _, lines = self.invoke(instrumented(handler))
+        self.assertEqual(json.loads(lines[0])['Throttles'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""Rate limiter unit tests."""
+import unittest
+import os
+
+from unittest.mock import patch
+from botocore.awsrequest import AWSResponse
+from boto3wrapper import Boto3Wrapper
+from ratelimit import TokenBucket, configure, bucket, stats
+
+CREATE_TAGS_RESPONSE = b'''<CreateTagsResponse xmlns="http://ec2.amazonaws.com/doc/2016-11-15/">
+<requestId>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</requestId><return>true</return>
+</CreateTagsResponse>'''
+
+THROTTLED_RESPONSE = b'''<Response><Errors><Error><Code>RequestLimitExceeded</Code>
+<Message>Request limit exceeded.</Message></Error></Errors>
+<RequestID>7a62c49f-347e-4fc4-9331-6e8eEXAMPLE</RequestID></Response>'''
+
+
+class FakeClock:
+    """
+    A clock advanced by the sleeps of the bucket.
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        """
+        @param seconds: The time to advance the clock by.
+        """
+        self.now += seconds
+
+
+class RawBody:  # pylint: disable=too-few-public-methods
+    """
+    The raw HTTP body of a canned response.
+    """
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self):
+        """
+        @return: The body chunks.
+        """
+        return iter([self.body])
+
+
+class TestRateLimit(unittest.TestCase):
+    """
+    Test the token bucket rate limiter.
+    """
+    def tearDown(self):
+        configure({})
+
+    def test_bucket_waits(self):
+        """
+        Verify the burst is served at once and later calls wait for their token.
+        """
+        clock = FakeClock()
+        limiter = TokenBucket(2, 2, clock=clock, sleep=clock.sleep)
+        self.assertEqual([limiter.acquire() for _ in range(4)], [0.0, 0.0, 0.5, 0.5])
+        self.assertEqual(clock.now, 1.0)
+        self.assertEqual(limiter.stats(), {'Rate': 2.0, 'Waits': 2, 'WaitSeconds': 1.0,
+                                           'Throttles': 0})
+
+    def test_adaptive_rate(self):
+        """
+        Verify throttling halves the rate down to a floor, and successes restore it.
+        """
+        clock = FakeClock()
+        limiter = TokenBucket(10, adaptive=True, clock=clock, sleep=clock.sleep)
+        limiter.throttled()
+        self.assertEqual(limiter.rate, 5.0)
+        for _ in range(10):
+            limiter.throttled()
+        self.assertEqual(limiter.rate, 0.5)
+        for _ in range(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, 10.0)
+        self.assertEqual(limiter.throttles, 11)
+
+    def test_static_rate(self):
+        """
+        Verify throttling is counted but does not change the rate in static mode.
+        """
+        limiter = TokenBucket(10)
+        limiter.throttled()
+        self.assertEqual((limiter.rate, limiter.throttles), (10.0, 1))
+
+    def test_bucket_keys(self):
+        """
+        Verify operation limits take precedence and a service limit is shared by its
+        operations.
+        """
+        configure({'ec2.CreateTags': {'rate': 20}, 'rds': {'rate': 5, 'burst': 10}})
+        self.assertEqual(bucket('ec2', 'CreateTags').max_rate, 20.0)
+        self.assertIsNone(bucket('ec2', 'DescribeInstances'))
+        self.assertIs(bucket('rds', 'AddTagsToResource'), bucket('rds', 'DescribeDBInstances'))
+        self.assertEqual(bucket('rds', 'AddTagsToResource').burst, 10.0)
+
+    def test_invalid_keys(self):
+        """
+        Verify keys that are not botocore service IDs, or have no rate, are ignored.
+        """
+        with self.assertLogs(level='WARNING') as logs:
+            limits = configure({'stepfunctions.StartExecution': {'rate': 5},
+                                'sfn.StartExecution': {'rate': 5}, 'EC2': {'rate': 5},
+                                'ec2.createTags': {'rate': 5}, 'rds': {'burst': 5}})
+        self.assertEqual(limits, {'sfn.StartExecution': {'rate': 5}})
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn('the service ID of stepfunctions is sfn', logs.output[0])
+
+    def test_client_hooks(self):
+        """
+        Verify each HTTP attempt of a Boto3Wrapper client takes a token and throttled
+        attempts lower the rate in adaptive mode.
+        """
+        configure({'ec2.CreateTags': {'rate': 10}}, 'adaptive')
+        credentials = patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing',
+                                              'AWS_SECRET_ACCESS_KEY': 'testing'})
+        credentials.start()
+        self.addCleanup(credentials.stop)
+        Boto3Wrapper.get_session()
+        self.addCleanup(Boto3Wrapper.get_session)
+        ec2 = Boto3Wrapper.get_client('ec2')
+        responses = [(503, THROTTLED_RESPONSE), (200, CREATE_TAGS_RESPONSE)]
+
+        def send(request, **_kwargs):
+            status, body = responses.pop(0)
+            return AWSResponse(request.url, status, {}, RawBody(body))
+
+        ec2.meta.events.register('before-send', send)
+        ec2.create_tags(Resources=['i-1'], Tags=[{'Key': 'Creator', 'Value': 'Admin'}])
+
+        self.assertEqual(stats()['ec2.CreateTags']['Throttles'], 1)
+        self.assertEqual(stats()['ec2.CreateTags']['Rate'], 5.5)
+        self.assertLess(bucket('ec2', 'CreateTags').tokens, 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
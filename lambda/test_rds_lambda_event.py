@@ -3,7 +3,9 @@ import unittest
 import os.path
 import json
 
+from unittest.mock import patch
 from rds_function import rds_lambda_handler
+from utils import PREFLIGHT_COUNTERS
 from test_utils import attach_local_aws_response, ACCOUNT, REGION
 
 
@@ -68,6 +70,20 @@ class TestRDS(unittest.TestCase):
         attach_local_aws_response(path)
         self.assertEqual(rds_lambda_handler(event, ''), True)
 
+    def test_unsupported_event_builds_no_client(self):
+        """
+        Verify an unsupported action exits before the RDS client is built.
+        """
+        with open('../test_event_data/rds_CreateDBInstance.json') as db_instance:
+            detail = json.load(db_instance)
+        detail['eventName'] = 'DeleteDBInstance'
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        unsupported = PREFLIGHT_COUNTERS['unsupported_events']
+        with patch('rds_function.Boto3Wrapper.get_client') as get_client:
+            self.assertEqual(rds_lambda_handler(event, ''), False)
+        get_client.assert_not_called()
+        self.assertEqual(PREFLIGHT_COUNTERS['unsupported_events'], unsupported + 1)
+
 
 if __name__ == '__main__':
     unittest.main()
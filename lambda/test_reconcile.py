@@ -0,0 +1,96 @@
+"""Creator tag reconciliation unit tests."""
+import unittest
+import os.path
+import json
+
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from reconcile import reconcile, resource_type_filters, lookup_creator
+from test_utils import attach_local_aws_response, REGION
+
+VOLUME_ARN = 'arn:aws:ec2:us-east-1:292909299215:volume/vol-02f81edd0d0411bbb'
+
+
+def cloudtrail_event(file_name, **changes):
+    """
+    @param file_name: The test event data file name.
+    @param changes: Event detail keys to change.
+    @return: The LookupEvents event of the CloudTrail record.
+    """
+    with open('../test_event_data/' + file_name) as event_data:
+        detail = dict(json.load(event_data), **changes)
+    return {'EventName': detail['eventName'], 'CloudTrailEvent': json.dumps(detail)}
+
+
+class TestReconcile(unittest.TestCase):
+    """
+    Test finding and tagging resources missing the Creator tag.
+    """
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/reconcile')
+        self.calls = attach_local_aws_response(path)
+
+    def test_report(self):
+        """
+        Verify every page is scanned and only resources without a Creator tag are reported.
+        """
+        rows = []
+        self.assertEqual(reconcile(None, REGION, rows.append), {'untagged': 3})
+        self.assertEqual([row['ResourceARN'] for row in rows], [
+            'arn:aws:ec2:us-east-1:292909299215:volume/vol-02f81edd0d0411bbb',
+            'arn:aws:rds:us-east-1:292909299215:db:autotag-test',
+            'arn:aws:s3:::autotag-test-bucket'
+        ])
+        self.assertEqual([row['Tagging'] for row in rows], ['ec2', 'rds', 's3_bucket'])
+
+    def test_redrive(self):
+        """
+        Verify untagged resources are tagged with the creator found in CloudTrail.
+        """
+        self.assertEqual(reconcile(None, REGION, redrive_tags=True),
+                         {'untagged': 3, 'tagged': 3, 'failed': 0, 'unresolved': 0})
+        self.assertEqual(self.calls.params('PutBucketTagging')[0]['Tagging']['TagSet'],
+                         [{'Key': 'Project', 'Value': 'autotag'},
+                          {'Key': 'Creator', 'Value': 'Admin'}])
+
+    def test_lookup_creation_event_only(self):
+        """
+        Verify the creator is taken from the creation event, not from a later event
+        naming the resource.
+        """
+        cloudtrail = MagicMock()
+        cloudtrail.lookup_events.side_effect = [
+            {'Events': [cloudtrail_event('ec2_StartInstances.json',
+                                         userIdentity={'type': 'Root'})],
+             'NextToken': 'page-2'},
+            {'Events': [cloudtrail_event('ec2_CreateVolume.json')]}]
+        pacer = MagicMock()
+        self.assertEqual(lookup_creator(cloudtrail, VOLUME_ARN, pacer), 'Admin')
+        self.assertEqual(pacer.acquire.call_count, 2)
+        self.assertEqual(cloudtrail.lookup_events.call_args[1]['NextToken'], 'page-2')
+
+    def test_lookup_throttled(self):
+        """
+        Verify a throttled lookup is retried after a backoff.
+        """
+        cloudtrail = MagicMock()
+        cloudtrail.exceptions.ClientError = ClientError
+        throttled = ClientError({'Error': {'Code': 'ThrottlingException'}}, 'LookupEvents')
+        cloudtrail.lookup_events.side_effect = [
+            throttled, {'Events': [cloudtrail_event('ec2_CreateVolume.json')]}]
+        with patch('reconcile.time.sleep') as sleep:
+            self.assertEqual(lookup_creator(cloudtrail, VOLUME_ARN, MagicMock()), 'Admin')
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_resource_type_filters(self):
+        """
+        Verify the scanned resource types cover the tagging APIs, except S3 objects.
+        """
+        filters = resource_type_filters()
+        self.assertEqual(filters['ec2:volume'], 'ec2')
+        self.assertEqual(filters['dax:cache'], 'dax')
+        self.assertNotIn('s3_object', filters.values())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Event registry unit tests."""
+import unittest
+import glob
+import json
+
+from botocore.exceptions import ClientError
+from registry import EVENT_REGISTRY, TAGGING_APIS, lookup_event, extract_resource_ids, tag_request
+from registry import classify_client_error, ERROR_NOT_READY, ERROR_THROTTLED, ERROR_FATAL
+from registry import arn_resource_type, arn_resource_id, retry_delay, TAG_BACKOFF_BASE
+from registry import merge_tags
+
+
+class TestRegistry(unittest.TestCase):
+    """
+    Test the supported event registry.
+    """
+    def test_test_events_supported(self):
+        """
+        Verify every CloudTrail test event is found in the registry and yields resource IDs.
+        """
+        for file_name in glob.glob('../test_event_data/*.json'):
+            with open(file_name) as event_data:
+                detail = json.load(event_data)
+            if 'eventSource' not in detail:
+                continue  # state machine input
+            spec = lookup_event(detail)
+            self.assertIsNotNone(spec, file_name)
+            self.assertTrue(extract_resource_ids(detail, spec), file_name)
+
+    def test_entries_reference_tagging_apis(self):
+        """
+        Verify every registry entry names a tagging API.
+        """
+        for spec in EVENT_REGISTRY.values():
+            self.assertIn(spec['tagging'], TAGGING_APIS)
+
+    def test_unsupported_event(self):
+        """
+        Verify an unknown event is not found.
+        """
+        self.assertIsNone(lookup_event({'eventSource': 'rds.amazonaws.com',
+                                        'eventName': 'DeleteDBInstance'}))
+
+    def test_redshift_arn(self):
+        """
+        Verify the Redshift cluster ARN is built from the event.
+        """
+        with open('../test_event_data/redshift_CreateCluster.json') as cluster:
+            detail = json.load(cluster)
+        self.assertEqual(extract_resource_ids(detail, lookup_event(detail)),
+                         ['arn:aws:redshift:us-east-1:292909299215:cluster:autotag-cluster-9'])
+
+    def test_s3_object_request(self):
+        """
+        Verify the object tagging request names the bucket and the key.
+        """
+        tags = [{'Key': 'Creator', 'Value': 'Admin'}]
+        self.assertEqual(tag_request('s3_object', ['bucket/path/key'], tags),
+                         ('put_object_tagging',
+                          {'Bucket': 'bucket', 'Key': 'path/key', 'Tagging': {'TagSet': tags}}))
+
+    def test_classify_client_error(self):
+        """
+        Verify tagging errors are classified by their error code.
+        """
+        def error(code):
+            return ClientError({'Error': {'Code': code, 'Message': code}}, 'TagResource')
+
+        self.assertEqual(classify_client_error(error('ResourceNotFoundException')),
+                         ERROR_NOT_READY)
+        self.assertEqual(classify_client_error(error('InvalidClusterState')), ERROR_NOT_READY)
+        self.assertEqual(classify_client_error(error('InvalidInstanceID.NotFound')),
+                         ERROR_NOT_READY)
+        self.assertEqual(classify_client_error(error('DBInstanceNotFound')), ERROR_NOT_READY)
+        self.assertEqual(classify_client_error(error('ThrottlingException')), ERROR_THROTTLED)
+        self.assertEqual(classify_client_error(error('AccessDeniedException')), ERROR_FATAL)
+
+    def test_merge_tags(self):
+        """
+        Verify merged tags keep the current tags and replace the ones set again.
+        """
+        current = [{'Key': 'Project', 'Value': 'autotag'}, {'Key': 'Creator', 'Value': 'old'}]
+        self.assertEqual(merge_tags(current, [{'Key': 'Creator', 'Value': 'Admin'}]),
+                         [{'Key': 'Project', 'Value': 'autotag'},
+                          {'Key': 'Creator', 'Value': 'Admin'}])
+
+    def test_retry_delay(self):
+        """
+        Verify throttled attempts wait a jittered, growing backoff, and fatal errors and
+        the last attempt are not retried.
+        """
+        throttled = ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'CreateTags')
+        denied = ClientError({'Error': {'Code': 'UnauthorizedOperation'}}, 'CreateTags')
+        self.assertTrue(0 <= retry_delay(throttled, 1, 3) <= TAG_BACKOFF_BASE)
+        self.assertTrue(0 <= retry_delay(throttled, 2, 3) <= 2 * TAG_BACKOFF_BASE)
+        self.assertIsNone(retry_delay(throttled, 3, 3))
+        self.assertIsNone(retry_delay(denied, 1, 3))
+
+    def test_arn_resource_id(self):
+        """
+        Verify ARNs are mapped to the resource type and to the ID named by the tagging API.
+        """
+        volume = 'arn:aws:ec2:us-east-1:292909299215:volume/vol-02f81edd0d0411bbb'
+        database = 'arn:aws:rds:us-east-1:292909299215:db:autotag-test'
+        self.assertEqual(arn_resource_type(volume), 'ec2:volume')
+        self.assertEqual(arn_resource_id('ec2', volume), 'vol-02f81edd0d0411bbb')
+        self.assertEqual(arn_resource_type(database), 'rds:db')
+        self.assertEqual(arn_resource_id('rds', database), database)
+        self.assertEqual(arn_resource_type('arn:aws:s3:::bucket'), 's3')
+        self.assertEqual(arn_resource_id('s3_bucket', 'arn:aws:s3:::bucket'), 'bucket')
+
+
+if __name__ == '__main__':
+    unittest.main()
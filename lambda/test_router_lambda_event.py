@@ -0,0 +1,114 @@
+"""Router Lambda unit tests."""
+import unittest
+import os.path
+import json
+import time
+
+from unittest.mock import MagicMock, patch
+from idempotency import InMemoryStore, set_store
+from pending import InMemoryPendingStore, get_store, AGGREGATE_WINDOW
+from router_function import router_handler, route, load_handler, FLUSH
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+
+MAP_ARN = 'arn:aws:states:us-east-1:292909299215:stateMachine:AutoTag-DynamoDB-Map-SFN'
+
+
+def load_event(file_name):
+    """
+    Load a test event, wrapped in an EventBridge event unless it is a state machine payload.
+    @param file_name: The test event data file name.
+    @return: The event.
+    """
+    with open('../test_event_data/' + file_name) as event_data:
+        detail = json.load(event_data)
+    if 'eventSource' not in detail:
+        return detail
+    return {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+
+
+class TestRouter(unittest.TestCase):
+    """
+    Test the router Lambda function.
+    """
+    def test_routes(self):
+        """
+        Verify events are routed by event source, batch and state machine payload shape.
+        """
+        self.assertEqual(route(load_event('ec2_CreateVolume.json')), 'ec2.amazonaws.com')
+        self.assertEqual(route(load_event('dynamodb_DAX_CreateCluster.json')),
+                         'dax.amazonaws.com')
+        self.assertEqual(route({'source': 'aws.rds', 'detail': {}}), 'rds.amazonaws.com')
+        self.assertEqual(route({'Records': []}), 'sqs')
+        self.assertEqual(route(load_event('dynamodb_SFN_CreateTable.json')), 'sfn.MaxAttempts')
+        self.assertEqual(route(load_event('redshift_SFN_CreateCluster.json')), 'sfn.MaxRetries')
+        self.assertEqual(route({'Flush': True}), FLUSH)
+        self.assertIsNone(route({'source': 'aws.lambda', 'detail': {}}))
+
+    def test_create_volume(self):
+        """
+        Verify an EC2 event is tagged by the EC2 handler.
+        """
+        set_store(InMemoryStore())
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_volume')
+        calls = attach_local_aws_response(path)
+        self.assertEqual(router_handler(load_event('ec2_CreateVolume.json'), ''), True)
+        self.assertEqual(calls.operations(), {'CreateTags': 1})
+
+    def test_handler_loaded_once(self):
+        """
+        Verify a handler module is imported on first use only.
+        """
+        with patch.dict('router_function._HANDLERS', clear=True), \
+                patch('importlib.import_module',
+                      return_value=MagicMock(redshift_sfn_lambda_handler='handler')) as import_mock:
+            self.assertEqual(load_handler('sfn.MaxRetries'), 'handler')
+            self.assertEqual(load_handler('sfn.MaxRetries'), 'handler')
+        self.assertEqual(import_mock.call_count, 1)
+
+    def test_route_settings(self):
+        """
+        Verify the Redshift handler is given the Redshift settings, leaving the environment
+        unchanged.
+        """
+        handler = MagicMock(return_value=True)
+        arn = 'arn:aws:states:us-east-1:292909299215:stateMachine:AutoTag-Redshift-SFN'
+        with patch('router_function.load_handler', return_value=handler), \
+                patch.dict(os.environ, {'REDSHIFT_SFN_ARN': arn, 'REDSHIFT_PENDING_MODE': 'sfn',
+                                        'DYNAMODB_PENDING_MODE': 'aggregate'}):
+            self.assertEqual(router_handler(load_event('redshift_CreateCluster.json'), ''), True)
+            self.assertNotIn('SFN_ARN', os.environ)
+        self.assertEqual(handler.call_args[0][2], {'SFN_ARN': arn, 'PENDING_MODE': 'sfn'})
+
+    def test_aggregate_mode(self):
+        """
+        Verify a route in aggregate mode buffers its task, and a flush event starts it with
+        the Map state machine of the route only.
+        """
+        set_store(InMemoryStore())
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/aggregate')
+        calls = attach_local_aws_response(path)
+        environment = {'DYNAMODB_PENDING_MODE': 'aggregate', 'DYNAMODB_AGGREGATE_SFN_ARN': MAP_ARN,
+                       'REDSHIFT_PENDING_MODE': 'sfn', 'SFN_MAX_ATTEMPTS': '20'}
+        with patch.dict('pending._STORE', {'store': InMemoryPendingStore()}), \
+                patch.dict(os.environ, environment):
+            self.assertEqual(router_handler(load_event('dynamodb_CreateTable.json'), ''), True)
+            self.assertEqual(calls.count(), 0)
+            self.assertEqual(len(get_store().items()), 1)
+
+            with patch('pending.time.time', return_value=time.time() + AGGREGATE_WINDOW):
+                self.assertEqual(router_handler({'Flush': True}, ''), True)
+            self.assertEqual(get_store().items(), [])
+        params = calls.params('StartExecution')
+        self.assertEqual([param['stateMachineArn'] for param in params], [MAP_ARN])
+        self.assertEqual(json.loads(params[0]['input'])['Items'][0]['EventName'], 'CreateTable')
+
+    def test_no_route(self):
+        """
+        Verify an event no handler takes is dropped.
+        """
+        self.assertEqual(router_handler({'detail': {'eventSource': 'iam.amazonaws.com'}}, ''),
+                         False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,14 +3,22 @@ import unittest
 import os.path
 import json
 
-from s3_function import s3_lambda_handler
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from s3_function import s3_lambda_handler, coalesce_object_events, merge_creator_tag
+from s3_function import BUCKET_TAG_CACHE, bucket_creator
 from test_utils import attach_local_aws_response, ACCOUNT, REGION
 
+THROUGHPUT = {'S3_OBJECT_TAGGING_MODE': 'throughput'}
+
 
 class TestS3(unittest.TestCase):
     """
     Test S3 tagging Lambda function.
     """
+    def setUp(self):
+        BUCKET_TAG_CACHE.clear()
+
     def test_create_s3_bucket(self):
         """
         Verifies setting an S3 Bucket Creator tag.
@@ -19,20 +27,26 @@ class TestS3(unittest.TestCase):
             detail = json.load(s3_bucket)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/create_S3Bucket')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(s3_lambda_handler(event, ''), True)
+        self.assertEqual(calls.operations(), {'GetBucketTagging': 1, 'PutBucketTagging': 1})
 
     def test_put_s3_object(self):
         """
-        Verifies setting an S3 Object Creator tag.
+        Verifies setting an S3 Object Creator tag, keeping the other tags of the object.
         Object uploaded by IAM user.
         """
         with open('../test_event_data/s3_PutObject.json') as s3_object:
             detail = json.load(s3_object)
         event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
         path = os.path.join(os.path.dirname(__file__), '../local-aws-response/put_S3Object')
-        attach_local_aws_response(path)
+        calls = attach_local_aws_response(path)
         self.assertEqual(s3_lambda_handler(event, ''), True)
+        self.assertEqual(calls.params('GetObjectTagging'),
+                         [{'Bucket': 'Admin-autotag-test', 'Key': 'pipeline-6515-rollback.drawio'}])
+        self.assertEqual(calls.params('PutObjectTagging')[0]['Tagging']['TagSet'],
+                         [{'Key': 'Project', 'Value': 'pipeline'},
+                          {'Key': 'Creator', 'Value': 'Admin'}])
 
     def test_put_s3_object_aws_service(self):
         """
@@ -47,6 +61,87 @@ class TestS3(unittest.TestCase):
         attach_local_aws_response(path)
         self.assertEqual(s3_lambda_handler(event, ''), True)
 
+    def test_put_s3_object_throughput(self):
+        """
+        Verifies setting an S3 Object Creator tag in throughput mode, with a read of the
+        bucket tags and a read-modify-write of the object tags.
+        """
+        with open('../test_event_data/s3_PutObject.json') as s3_object:
+            detail = json.load(s3_object)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/put_S3Object_throughput')
+        attach_local_aws_response(path)
+        with patch.dict(os.environ, THROUGHPUT):
+            self.assertEqual(s3_lambda_handler(event, ''), True)
+        self.assertEqual(BUCKET_TAG_CACHE.get('Admin-autotag-test'), 'ops')
+
+    def test_put_s3_object_bucket_creator(self):
+        """
+        Verifies an object whose creator is the bucket Creator is not tagged in throughput
+        mode. The fixture has no object tagging responses.
+        """
+        with open('../test_event_data/s3_PutObject.json') as s3_object:
+            detail = json.load(s3_object)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        path = os.path.join(os.path.dirname(__file__),
+                            '../local-aws-response/put_S3Object_bucket_creator')
+        attach_local_aws_response(path)
+        with patch.dict(os.environ, THROUGHPUT):
+            self.assertEqual(s3_lambda_handler(event, ''), True)
+
+    def test_bucket_creator_failure_cached(self):
+        """
+        Verifies a bucket whose tags cannot be read is not looked up again until the failure
+        TTL is over.
+        """
+        s3 = MagicMock()
+        s3.exceptions.ClientError = ClientError
+        s3.get_bucket_tagging.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'GetBucketTagging')
+        self.assertIsNone(bucket_creator(s3, 'Admin-autotag-test'))
+        self.assertIsNone(bucket_creator(s3, 'Admin-autotag-test'))
+        self.assertEqual(s3.get_bucket_tagging.call_count, 1)
+        with patch('s3_function.CREATOR_TAGS_FAILURE_TTL', 0):
+            BUCKET_TAG_CACHE.clear()
+            bucket_creator(s3, 'Admin-autotag-test')
+            self.assertIsNone(bucket_creator(s3, 'Admin-autotag-test'))
+        self.assertEqual(s3.get_bucket_tagging.call_count, 3)
+
+    def test_put_s3_object_excluded_prefix(self):
+        """
+        Verifies an object excluded by the bucket prefix rules is not tagged, no call is made.
+        """
+        with open('../test_event_data/s3_PutObject.json') as s3_object:
+            detail = json.load(s3_object)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        attach_local_aws_response(path='')
+        rules = {'Admin-autotag-test': {'include': ['uploads/'], 'exclude': ['pipeline-']}}
+        with patch.dict(os.environ, dict(THROUGHPUT, S3_OBJECT_PREFIX_RULES=json.dumps(rules))):
+            self.assertEqual(s3_lambda_handler(event, ''), True)
+
+    def test_coalesce_object_events(self):
+        """
+        Verifies events for the same object are coalesced, the latest creator winning.
+        """
+        def put(key):
+            return {'requestParameters': {'bucketName': 'bucket', 'key': key}}
+
+        self.assertEqual(coalesce_object_events([('alice', put('a')), ('bob', put('b')),
+                                                 ('carol', put('a'))]),
+                         {('bucket', 'a'): 'carol', ('bucket', 'b'): 'bob'})
+
+    def test_merge_creator_tag(self):
+        """
+        Verifies the Creator tag is added to the object tags, keeping the uploader's tags.
+        """
+        project = {'Key': 'Project', 'Value': 'pipeline'}
+        creator = {'Key': 'Creator', 'Value': 'Admin'}
+        self.assertEqual(merge_creator_tag([project], 'Admin'), [project, creator])
+        self.assertEqual(merge_creator_tag([{'Key': 'Creator', 'Value': 'ops'}, project],
+                                           'Admin'), [project, creator])
+        self.assertIsNone(merge_creator_tag([creator, project], 'Admin'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,189 @@
+"""Pending store and sweeper Lambda unit tests."""
+import unittest
+import os.path
+import json
+import shutil
+import tempfile
+import time
+
+from unittest.mock import MagicMock, patch
+from botocore.exceptions import ClientError
+from dynamodb_cloudwatch_function import dynamodb_cloudwatch_handler
+from pending import InMemoryPendingStore, SQLitePendingStore, DynamoDBPendingStore
+from pending import set_store, get_store, defer
+from sweeper_function import sweeper_handler, sweep, PENDING_MAX_AGE
+from test_utils import attach_local_aws_response, ACCOUNT, REGION
+
+ARN_PREFIX = 'arn:aws:{}:us-east-1:292909299215:'
+
+
+def pending_item(tagging, resource, creator='Admin', enqueued_at=0):
+    """
+    @param tagging: The TAGGING_APIS entry name.
+    @param resource: The resource part of the ARN.
+    @param creator: The Creator tag value.
+    @param enqueued_at: The enqueue time.
+    @return: A pending item.
+    """
+    return {'ResourceArn': ARN_PREFIX.format(tagging) + resource, 'Tagging': tagging,
+            'Creator': creator, 'EventName': 'CreateTable',
+            'EnqueuedAt': enqueued_at}
+
+
+class TestPendingStore(unittest.TestCase):
+    """
+    Test the local pending stores.
+    """
+    def check_store(self, store):
+        """
+        Verify items are replaced by ARN, listed oldest first and deleted, and a lease is
+        taken only once the last one ended.
+        @param store: The pending store.
+        """
+        self.assertTrue(store.acquire('flush:a', 10, 0))
+        self.assertFalse(store.acquire('flush:a', 19, 9))
+        self.assertTrue(store.acquire('flush:b', 10, 9))
+        self.assertTrue(store.acquire('flush:a', 20, 10))
+        store.put(pending_item('dynamodb', 'table/b', enqueued_at=2))
+        store.put(pending_item('dynamodb', 'table/a', enqueued_at=1))
+        store.put(pending_item('dynamodb', 'table/b', creator='Dev', enqueued_at=2))
+        self.assertEqual([(item['ResourceArn'][-1], item['Creator']) for item in store.items()],
+                         [('a', 'Admin'), ('b', 'Dev')])
+        store.delete([ARN_PREFIX.format('dynamodb') + 'table/a'])
+        self.assertEqual(len(store.items()), 1)
+
+    def test_in_memory(self):
+        """
+        Verify the in memory store.
+        """
+        self.check_store(InMemoryPendingStore())
+
+    def test_sqlite(self):
+        """
+        Verify the SQLite store, and that its items outlive the connection.
+        """
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.check_store(SQLitePendingStore(os.path.join(path, 'pending.db')))
+        self.assertEqual(len(SQLitePendingStore(os.path.join(path, 'pending.db')).items()), 1)
+
+    def test_dynamodb_lease(self):
+        """
+        Verify the DynamoDB store takes a lease with a conditional put, and skips lease
+        items when listing.
+        """
+        client = MagicMock()
+        client.exceptions.ConditionalCheckFailedException = ClientError
+        client.get_paginator.return_value.paginate.return_value = [{'Items': [
+            {'ResourceArn': {'S': 'lease:flush:a'}, 'LeasedUntil': {'N': '10'}},
+            {'ResourceArn': {'S': 'arn'}, 'Item': {'S': json.dumps({'EnqueuedAt': 1})}}]}]
+        store = DynamoDBPendingStore('AutoTag-Pending', client=client)
+
+        self.assertTrue(store.acquire('flush:a', 10, 0))
+        self.assertEqual(client.put_item.call_args[1]['ExpressionAttributeValues'],
+                         {':now': {'N': '0'}})
+        client.put_item.side_effect = ClientError(
+            {'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.assertFalse(store.acquire('flush:a', 19, 9))
+        self.assertEqual(store.items(), [{'EnqueuedAt': 1}])
+
+
+class TestSweeper(unittest.TestCase):
+    """
+    Test the sweeper Lambda function.
+    """
+    def setUp(self):
+        set_store(InMemoryPendingStore())
+
+    def test_sweep(self):
+        """
+        Verify the table status and one cluster listing per service decide which items are
+        tagged, and that items end tagged, failed, expired or stay pending.
+        """
+        store = get_store()
+        now = time.time()
+        for item in (pending_item('dynamodb', 'table/autotag-ready', enqueued_at=now),
+                     pending_item('dynamodb', 'table/autotag-creating', enqueued_at=now),
+                     pending_item('dax', 'cache/autotag-dax', enqueued_at=now),
+                     pending_item('redshift', 'cluster:autotag-ready', enqueued_at=now),
+                     pending_item('redshift', 'cluster:autotag-creating',
+                                  enqueued_at=now - PENDING_MAX_AGE)):
+            store.put(item)
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/sweeper')
+        calls = attach_local_aws_response(path)
+
+        self.assertEqual(sweeper_handler({}, ''),
+                         {'pending': 1, 'tagged': 2, 'failed': 1, 'expired': 1})
+        self.assertEqual(calls.operations(), {'DescribeTable': 2, 'DescribeClusters': 2,
+                                              'TagResource': 2, 'CreateTags': 1})
+        self.assertEqual([item['ResourceArn'] for item in store.items()],
+                         [ARN_PREFIX.format('dynamodb') + 'table/autotag-creating'])
+
+    def test_expiry_by_age(self):
+        """
+        Verify an item expires once PENDING_MAX_AGE seconds old, and is not rewritten while
+        pending.
+        """
+        store = get_store()
+        store.put(pending_item('redshift', 'cluster:autotag-creating'))
+        path = os.path.join(os.path.dirname(__file__), '../local-aws-response/sweeper')
+        attach_local_aws_response(path)
+
+        with patch.object(store, 'put') as put:
+            self.assertEqual(sweep(store, now=PENDING_MAX_AGE - 1)['pending'], 1)
+        put.assert_not_called()
+        self.assertEqual(sweep(store, now=PENDING_MAX_AGE)['expired'], 1)
+        self.assertEqual(store.items(), [])
+
+    def test_aggregate_tasks_skipped(self):
+        """
+        Verify the buffered tasks of aggregate mode are left in the store.
+        """
+        task = {'ResourceArn': ARN_PREFIX.format('redshift') + 'cluster:a', 'Tagging': 'redshift',
+                'Task': {}, 'EnqueuedAt': 0}
+        get_store().put(task)
+        calls = attach_local_aws_response(path='')
+        self.assertEqual(sweep(get_store()),
+                         {'pending': 0, 'tagged': 0, 'failed': 0, 'expired': 0})
+        self.assertEqual(calls.count(), 0)
+        self.assertEqual(get_store().items(), [task])
+
+    def test_empty_store(self):
+        """
+        Verify an empty store makes no calls.
+        """
+        calls = attach_local_aws_response(path='')
+        self.assertEqual(sweep(get_store()),
+                         {'pending': 0, 'tagged': 0, 'failed': 0, 'expired': 0})
+        self.assertEqual(calls.count(), 0)
+
+    def test_create_table_deferred(self):
+        """
+        Verify the DynamoDB event handler puts the table in the pending store in sweeper
+        mode, without starting a state machine execution.
+        """
+        with open('../test_event_data/dynamodb_CreateTable.json') as table:
+            detail = json.load(table)
+        event = {'account': ACCOUNT, 'region': REGION, 'detail': detail}
+        calls = attach_local_aws_response(path='')
+        with patch.dict(os.environ, {'PENDING_MODE': 'sweeper'}):
+            self.assertEqual(dynamodb_cloudwatch_handler(event, ''), True)
+        self.assertEqual(calls.count(), 0)
+        items = get_store().items()
+        self.assertEqual([item['Tagging'] for item in items], ['dynamodb'])
+        self.assertEqual(items[0]['ResourceArn'],
+                         detail['responseElements']['tableDescription']['tableArn'])
+
+    def test_defer(self):
+        """
+        Verify a deferred resource is put in the store with its enqueue time.
+        """
+        with patch('pending.time.time', return_value=100):
+            item = defer('CreateCluster', 'Admin', ARN_PREFIX.format('redshift') + 'cluster:a',
+                         'redshift')
+        self.assertEqual(item['EnqueuedAt'], 100)
+        self.assertEqual(get_store().items(), [item])
+
+
+if __name__ == '__main__':
+    unittest.main()
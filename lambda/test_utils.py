@@ -1,4 +1,6 @@
 """A place for common test utility functions."""
+from collections import Counter
+
 import placebo
 
 from boto3wrapper import Boto3Wrapper
@@ -31,14 +33,54 @@ class MockContext:
         return self.ttl
 
 
+class CallRecorder:
+    """
+    Record the AWS API calls made by the clients of a session, in order, as
+    (service, operation, parameters) tuples.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def record(self, event_name, params, **_kwargs):
+        """
+        The before-parameter-build event handler.
+        @param event_name: before-parameter-build.<service>.<operation>
+        @param params: The API call parameters.
+        """
+        _, service, operation = event_name.split('.', 2)
+        self.calls.append((service, operation, dict(params)))
+
+    def count(self, operation=None):
+        """
+        @param operation: The operation name, e.g. CreateTags, None for all operations.
+        @return: The number of calls.
+        """
+        return sum(1 for _, name, _ in self.calls if operation in (None, name))
+
+    def operations(self):
+        """
+        @return: The number of calls per operation, a Counter.
+        """
+        return Counter(name for _, name, _ in self.calls)
+
+    def params(self, operation):
+        """
+        @param operation: The operation name.
+        @return: The parameters of each call of the operation.
+        """
+        return [params for _, name, params in self.calls if name == operation]
+
+
 def attach_local_aws_response(path, mode='playback'):
     """
     Provide a mock AWS response. Steps:
     1) Create or re-create a session.
     2) Bind the session to the mock API.
     3) Play the mock data.
+    4) Record the API calls made by the clients of the session.
     :param path: The location of the mock data.
     :param mode: Placebo runtime mode, playback(default) or record.
+    :return: The CallRecorder of the session.
     """
     session = Boto3Wrapper.get_session()
     pill = placebo.attach(session, data_path=path)
@@ -47,3 +89,19 @@ def attach_local_aws_response(path, mode='playback'):
         pill.playback()
     else:
         pill.record()
+    recorder = CallRecorder()
+    session.events.register('before-parameter-build', recorder.record)
+    return recorder
+
+
+def assert_max_api_calls(test, recorder, limit, operation=None):
+    """
+    Fail a test when more API calls were made than expected, to catch N+1 call patterns.
+    :param test: The unittest.TestCase.
+    :param recorder: The CallRecorder, see attach_local_aws_response.
+    :param limit: The maximum number of calls.
+    :param operation: The operation name, None for all operations.
+    """
+    count = recorder.count(operation)
+    test.assertLessEqual(count, limit, f'{count} {operation or "API"} calls, at most {limit} '
+                                       f'expected: {dict(recorder.operations())}')
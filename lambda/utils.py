@@ -1,7 +1,101 @@
 """A place for common utility functions."""
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from boto3wrapper import Boto3Wrapper
+from enrichment import get_backend
+from metrics import timer
+from registry import lookup_event, try_tag, classify_client_error, TAGGING_APIS
+from registry import ERROR_FATAL, ERROR_THROTTLED
 
 CREATOR_TAG_NAME = 'Creator'
 
+# Wait between state machine tag attempts, see backoff_seconds
+SFN_BACKOFF_BASE = int(os.environ.get('SFN_BACKOFF_BASE', '15'))
+SFN_BACKOFF_CAP = int(os.environ.get('SFN_BACKOFF_CAP', '300'))
+# Throttled attempts back off from a ceiling this many times higher
+SFN_THROTTLE_FACTOR = 4
+
+# Counts of handler invocations going through preflight, and of those exiting early
+# because the event is an error or is not supported. Kept across warm invocations.
+PREFLIGHT_COUNTERS = {
+    'invocations': 0,
+    'error_events': 0,
+    'unsupported_events': 0
+}
+
+
+class TTLCache:
+    """
+    A bounded least recently used cache whose entries expire ttl seconds after being put.
+    Lookups are counted in hits and misses. It is safe to share between threads, e.g. the
+    fanout and backfill workers.
+    """
+
+    def __init__(self, max_size, ttl, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get a live entry, marking it most recently used.
+        :param key: The entry key.
+        :param default: Returned when the key is missing or expired.
+        :return: The cached value or default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl=None):
+        """
+        Add or replace an entry, evicting the least recently used entry when full.
+        :param key: The entry key.
+        :param value: The value.
+        :param ttl: The seconds the entry lives, defaults to the ttl of the cache.
+        """
+        with self._lock:
+            self._entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Resolved creators, keyed by the userIdentity arn or principalId, kept across warm invocations
+CREATOR_CACHE = TTLCache(int(os.environ.get('CREATOR_CACHE_SIZE', '1024')),
+                         int(os.environ.get('CREATOR_CACHE_TTL', '900')))
+
+# Tag sets of creators, keyed by creator, kept across warm invocations, see creator_tags
+CREATOR_TAGS_CACHE = TTLCache(int(os.environ.get('CREATOR_CACHE_SIZE', '1024')),
+                              int(os.environ.get('CREATOR_TAGS_CACHE_TTL', '900')))
+# Seconds the Creator tag alone is cached after a failed lookup, see creator_tags
+CREATOR_TAGS_FAILURE_TTL = int(os.environ.get('CREATOR_TAGS_FAILURE_TTL', '60'))
+
 
 def is_err_detail(logger, detail, expect_resp_elems=True):
     """
@@ -34,6 +128,9 @@ def get_creator(event):
         o All others - principal ID (same as IAM owner ID)
         o All else fails - undetermined
 
+    Creators are cached in CREATOR_CACHE by the identity arn, or principalId when there
+    is no arn, so repeated events from the same identity are resolved once.
+
     TODO - Are all user identity types handled?
     https://docs.aws.amazon.com/awscloudtrail/latest/userguide/cloudtrail-event-reference-user-identity.html
 
@@ -41,6 +138,24 @@ def get_creator(event):
     :return: The creator.
     """
     detail = event['detail']
+    identity = detail['userIdentity']
+    key = identity.get('arn') or identity.get('principalId')
+    if key is None:
+        return _resolve_creator(detail)
+
+    user = CREATOR_CACHE.get(key)
+    if user is None:
+        user = _resolve_creator(detail)
+        CREATOR_CACHE.put(key, user)
+    return user
+
+
+def _resolve_creator(detail):
+    """
+    Resolve the creator from the event detail, see get_creator.
+    :param detail: The detail portion of the CloudTrail object.
+    :return: The creator.
+    """
     user_type = detail['userIdentity']['type']
 
     if user_type == 'IAMUser':
@@ -69,3 +184,129 @@ def load_creator_tag(creator):
         'Value': creator
     }
     return tag
+
+
+def creator_tags(creator):
+    """
+    Build the tags of a resource: the Creator tag, then the tags derived from the creator by
+    the lookup backend, see enrichment.py, sorted by key. Tag sets are cached in
+    CREATOR_TAGS_CACHE, so the backend is called once per creator and time to live. When
+    the lookup fails only the Creator tag is returned, and cached for
+    CREATOR_TAGS_FAILURE_TTL seconds, so a failing backend is not called on every event.
+
+    :param creator: The owner name, root_account, or AWS service creating the resource.
+    :return: The tag list.
+    """
+    tags = CREATOR_TAGS_CACHE.get(creator)
+    if tags is not None:
+        return list(tags)
+
+    tags = [load_creator_tag(creator)]
+    backend = get_backend()
+    if backend is None:
+        return tags
+    try:
+        derived = backend.lookup(creator)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.getLogger().warning('Cannot look up the tags of [ %s ]: %s', creator, error)
+        CREATOR_TAGS_CACHE.put(creator, tags, CREATOR_TAGS_FAILURE_TTL)
+        return list(tags)
+
+    tags += [{'Key': key, 'Value': derived[key]} for key in sorted(derived)
+             if key != CREATOR_TAG_NAME]
+    CREATOR_TAGS_CACHE.put(creator, tags)
+    return list(tags)
+
+
+def preflight(logger, event, expect_resp_elems=True):
+    """
+    Decide, before any AWS SDK client is built, whether the event has something to tag.
+    Error events and events missing from the registry exit early and are counted in
+    PREFLIGHT_COUNTERS.
+
+    :param logger: The application logger.
+    :param event: The CloudTrail event object.
+    :param expect_resp_elems: If true consider not response elements an error state.
+    :return: The (creator, event spec) pair, the spec is None when the handler should
+    exit without tagging.
+    """
+    PREFLIGHT_COUNTERS['invocations'] += 1
+    detail = event['detail']
+
+    with timer('ParseMs'):
+        if is_err_detail(logger, detail, expect_resp_elems):
+            PREFLIGHT_COUNTERS['error_events'] += 1
+            return None, None
+
+        spec = lookup_event(detail)
+        if spec is None:
+            logger.warning('Not supported action: %s', detail.get('eventName'))
+            PREFLIGHT_COUNTERS['unsupported_events'] += 1
+            return None, None
+
+        return get_creator(event), spec
+
+
+def tag_immediately(logger, spec, resource_id, creator):
+    """
+    Attempt to tag a resource that is normally tagged by a state machine once created,
+    when the TAG_IMMEDIATE environment variable is "true". Resources that are ready
+    when the creation event arrives skip the state machine.
+
+    :param logger: The application logger.
+    :param spec: The event spec, see registry.lookup_event.
+    :param resource_id: The resource ID or ARN.
+    :param creator: The Creator tag value.
+    :return: True if the resource was tagged, False if it still needs the state machine.
+    """
+    if os.environ.get('TAG_IMMEDIATE', 'false').lower() != 'true':
+        return False
+
+    client = Boto3Wrapper.get_client(TAGGING_APIS[spec['tagging']]['service'])
+    error = try_tag(client, spec['tagging'], resource_id, creator_tags(creator))
+    if error is not None:
+        logger.info('Immediate tag of [ %s ] failed, starting state machine: %s',
+                    resource_id, error)
+        return False
+
+    logger.info('Tagged [ %s ] with Creator [ %s ] without state machine', resource_id, creator)
+    return True
+
+
+def backoff_seconds(attempt, base=SFN_BACKOFF_BASE, cap=SFN_BACKOFF_CAP):
+    """
+    Exponential backoff with full jitter: a random wait between 1 second and
+    min(cap, base * 2 ** attempt) seconds.
+
+    :param attempt: The number of attempts made so far, 0 before the first.
+    :param base: The wait ceiling, in seconds, before the first attempt.
+    :param cap: The largest wait ceiling, in seconds.
+    :return: The whole number of seconds to wait.
+    """
+    ceiling = min(cap, base * 2 ** attempt)
+    return max(1, int(random.uniform(0, ceiling)))
+
+
+def schedule_retry(logger, event, error, attempt):
+    """
+    Update a state machine event after a failed tag attempt. Fatal errors end the execution
+    with TagStatus "failed". Otherwise the event stays pending and WaitSeconds is set to the
+    backoff before the next attempt, longer when the attempt was throttled.
+
+    :param logger: The application logger.
+    :param event: The state machine event.
+    :param error: The ClientError raised by the tag attempt.
+    :param attempt: The number of attempts made so far.
+    :return: The updated event.
+    """
+    error_class = classify_client_error(error)
+    logger.warning('%s: %s', error_class, error)
+
+    if error_class == ERROR_FATAL:
+        event['TagStatus'] = 'failed'
+        event['Error'] = str(error)
+    elif error_class == ERROR_THROTTLED:
+        event['WaitSeconds'] = backoff_seconds(attempt, SFN_BACKOFF_BASE * SFN_THROTTLE_FACTOR)
+    else:
+        event['WaitSeconds'] = backoff_seconds(attempt)
+    return event
@@ -0,0 +1,56 @@
+"""
+Trim a vendored boto3/botocore install down to the service models the Lambda functions use.
+
+Usage:
+    python3 tools/trim_botocore.py <vendor_dir> <service> [<service> ...]
+"""
+import os
+import shutil
+import sys
+
+
+def trim_data_dir(data_dir, services):
+    """
+    Remove the service model directories not listed in services. Files at the top of
+    the data directory (endpoints, partitions, retry and default configuration) are kept.
+
+    :param data_dir: The botocore or boto3 data directory.
+    :param services: The service names to keep.
+    :return: The number of service model directories removed.
+    """
+    removed = 0
+    if not os.path.isdir(data_dir):
+        return removed
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if os.path.isdir(path) and name not in services:
+            shutil.rmtree(path)
+            removed = removed + 1
+    return removed
+
+
+def main(argv):
+    """
+    Trim the botocore and boto3 data directories of a vendored install.
+    :param argv: The vendor directory followed by the service names to keep.
+    :return: The process exit code.
+    """
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+
+    vendor_dir, services = argv[0], set(argv[1:])
+    for package in ('botocore', 'boto3'):
+        data_dir = os.path.join(vendor_dir, package, 'data')
+        removed = trim_data_dir(data_dir, services)
+        kept = ', '.join(sorted(os.listdir(data_dir)))
+        print(f'{package}: removed {removed} service models, kept {kept}')
+
+    for name in os.listdir(vendor_dir):
+        if name.endswith('.dist-info') or name == 'bin' or name == '__pycache__':
+            shutil.rmtree(os.path.join(vendor_dir, name))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))